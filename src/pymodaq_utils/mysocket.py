@@ -5,12 +5,47 @@ Created the 26/10/2023
 @author: Sebastien Weber
 """
 import socket
-from typing import Union
+import time
+from typing import Optional, Union
+
+
+class IncompleteReceiveError(ConnectionError):
+    """ Raised when a message could not be entirely received
+
+    Attributes
+    ----------
+    received: int
+        the number of bytes received before the error
+    expected: int
+        the number of bytes that were expected
+    partial: bytes-like
+        the bytes received before the error
+    """
+
+    def __init__(self, message: str, received: int, expected: int, partial=b''):
+        super().__init__(f'{message}: {received} bytes received out of {expected}')
+        self.received = received
+        self.expected = expected
+        self.partial = partial
+
+
+class ConnectionClosedError(IncompleteReceiveError):
+    """ Raised when the peer closed the connection before a message was entirely received"""
+
+
+class ReceiveTimeoutError(IncompleteReceiveError, TimeoutError):
+    """ Raised when a message was not entirely received before the receive deadline"""
 
 
 class Socket:
     """Custom Socket wrapping the built-in one and added functionalities to
-    make sure message have been sent and received entirely"""
+    make sure message have been sent and received entirely
+
+    receive_timeout, if not None, is the maximum duration in seconds of each call to
+    check_received_length, see check_received_into
+    """
+    receive_timeout: Optional[float] = None
+
     def __init__(self, socket: socket.socket = None):
         super().__init__()
         self._socket = socket
@@ -49,26 +84,36 @@ class Socket:
     def recv(self, *args, **kwargs):
         return self.socket.recv(*args, **kwargs)
 
+    def recv_into(self, *args, **kwargs):
+        return self.socket.recv_into(*args, **kwargs)
+
     def close(self):
         return self.socket.close()
 
     def check_sended(self, data_bytes: bytes):
         """
         Make sure all bytes are sent through the socket
+
+        The remaining bytes are given to send as memoryview slices, hence without copy
+
         Parameters
         ----------
-        data_bytes: bytes
+        data_bytes: bytes, bytearray or memoryview
         """
-        if not isinstance(data_bytes, bytes):
+        if not isinstance(data_bytes, (bytes, bytearray, memoryview)):
             raise TypeError(f'{data_bytes} should be an bytes string, not a {type(data_bytes)}')
+        view = memoryview(data_bytes).cast('B')
         sended = 0
-        while sended < len(data_bytes):
-            sended += self.socket.send(data_bytes[sended:])
+        while sended < len(view):
+            sended += self.socket.send(view[sended:])
 
-    def check_received_length(self, length) -> bytes:
+    def check_received_length(self, length) -> bytearray:
         """
         Make sure all bytes (length) that should be received are received through the socket
 
+        The bytes are received directly into a preallocated bytearray, each call to recv_into
+        asking for all the bytes still expected
+
         Parameters
         ----------
         length: int
@@ -76,23 +121,76 @@ class Socket:
 
         Returns
         -------
-        bytes
+        bytearray: the received bytes, that can be wrapped by a memoryview or a numpy array
+            without copy
+
+        Raises
+        ------
+        ConnectionClosedError: if the peer closed the connection before all bytes are received
+        ReceiveTimeoutError: if the bytes are not all received within receive_timeout seconds
         """
         if not isinstance(length, int):
             raise TypeError(f'{length} should be an integer, not a {type(length)}')
 
-        mess_length = 0
-        data_bytes = b''
-        while mess_length < length:
-            if mess_length < length - 4096:
-                data_bytes_tmp = self.socket.recv(4096)
-            else:
-                data_bytes_tmp = self.socket.recv(length - mess_length)
-            mess_length += len(data_bytes_tmp)
-            data_bytes += data_bytes_tmp
-        # print(data_bytes)
+        data_bytes = bytearray(length)
+        self.check_received_into(data_bytes)
         return data_bytes
 
+    def check_received_into(self, buffer, timeout: Optional[float] = None):
+        """
+        Make sure the writable buffer is entirely filled with bytes received through the socket
+
+        Parameters
+        ----------
+        buffer: bytearray, memoryview or any writable object supporting the buffer protocol,
+            for instance a contiguous numpy array
+        timeout: float or None
+            the maximum duration in seconds to receive all the bytes, default to the
+            receive_timeout attribute. None to wait as long as the connection is open
+
+        Raises
+        ------
+        ConnectionClosedError: if the peer closed the connection before all bytes are received
+        ReceiveTimeoutError: if the bytes are not all received before the timeout, or before the
+            timeout of the wrapped socket if timeout and receive_timeout are None
+        """
+        if timeout is None:
+            timeout = self.receive_timeout
+        data_view = memoryview(buffer).cast('B')
+        length = len(data_view)
+        mess_length = 0
+        if timeout is None:
+            try:
+                while mess_length < length:
+                    nbytes = self.socket.recv_into(data_view[mess_length:], length - mess_length)
+                    if nbytes == 0:
+                        raise ConnectionClosedError('Connection closed by the peer', mess_length,
+                                                    length, data_view[:mess_length])
+                    mess_length += nbytes
+            except socket.timeout:  # the timeout set on the wrapped socket itself
+                raise ReceiveTimeoutError('Socket timeout expired', mess_length, length,
+                                          data_view[:mess_length]) from None
+            return
+
+        deadline = time.monotonic() + timeout
+        previous_timeout = self.socket.gettimeout()
+        try:
+            while mess_length < length:
+                remaining_time = deadline - time.monotonic()
+                if remaining_time <= 0:
+                    raise socket.timeout()
+                self.socket.settimeout(remaining_time)
+                nbytes = self.socket.recv_into(data_view[mess_length:], length - mess_length)
+                if nbytes == 0:
+                    raise ConnectionClosedError('Connection closed by the peer', mess_length,
+                                                length, data_view[:mess_length])
+                mess_length += nbytes
+        except socket.timeout:
+            raise ReceiveTimeoutError(f'Receive deadline of {timeout} s expired', mess_length,
+                                      length, data_view[:mess_length]) from None
+        finally:
+            self.socket.settimeout(previous_timeout)
+
     def get_first_nbytes(self, length: int) -> bytes:
         """ Read the first N bytes from the socket
 
@@ -103,7 +201,7 @@ class Socket:
 
         Returns
         -------
-        bytes: the read bytes string
+        bytearray: the read bytes string
         """
         return self.check_received_length(length)
 
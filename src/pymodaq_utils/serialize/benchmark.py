@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the serialization of all types registered in the SerializableFactory
+
+Run it as a script to print the results and optionally save them as JSON to compare runs done on
+different commits::
+
+    python -m pymodaq_utils.serialize.benchmark --output new.json --compare old.json
+"""
+import argparse
+import json
+import platform
+import queue
+import socket
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import utils
+from .factory import SerializableBase
+from .mysocket import Socket
+from .serializer import ser_factory
+
+OPERATIONS = ('serialize', 'deserialize', 'socket')
+
+
+class BenchmarkSerializable(SerializableBase):
+    """ User defined serializable type used to benchmark SerializableBase subclasses"""
+
+    def __init__(self, name: str, data: np.ndarray):
+        self.name = name
+        self.data = data
+
+    @staticmethod
+    def serialize(obj: 'BenchmarkSerializable') -> bytes:
+        return (ser_factory.get_apply_serializer(obj.name) +
+                ser_factory.get_apply_serializer(obj.data))
+
+    @staticmethod
+    def deserialize(bytes_str: utils.BytesLike) -> Tuple['BenchmarkSerializable',
+                                                         utils.BytesLike]:
+        name, remaining_bytes = ser_factory.get_apply_deserializer(bytes_str, False)
+        data, remaining_bytes = ser_factory.get_apply_deserializer(remaining_bytes, False)
+        return BenchmarkSerializable(name, data), remaining_bytes
+
+
+@dataclass
+class BenchmarkResult:
+    """ Timing and memory usage of one operation on one sample object"""
+    sample: str
+    obj_type: str
+    operation: str
+    nbytes: int
+    repeat: int
+    ns_per_op: float
+    mb_per_s: float
+    allocated_bytes: int
+
+
+def get_samples() -> Dict[str, Any]:
+    """ Get named sample objects covering all types registered by default, arrays of various data
+    types and sizes, flat and nested lists and a user defined SerializableBase subclass,
+    registered by run"""
+    samples = {
+        'str': 'a short string',
+        'str_10k': 'a' * 10000,
+        'bytes': b'some bytes',
+        'bytes_1M': bytes(2**20),
+        'int': 123456,
+        'float': 12.5,
+        'complex': 1.5 + 2.5j,
+        'bool': True,
+    }
+    for dtype in (np.uint8, np.int32, np.float64, np.complex128, np.bool_):
+        for shape in ((100,), (1000, 1000)):
+            array = np.ones(shape, dtype=dtype)
+            samples[f'ndarray_{array.dtype.name}_{array.size}'] = array
+    samples['list_mixed'] = ['a', 1, 2.5, np.arange(10), b'b']
+    samples['list_floats_10k'] = [0.1 * ind for ind in range(10000)]
+    samples['list_nested'] = [[ind, [f'{ind}', np.arange(ind)]] for ind in range(100)]
+    samples['serializable_base'] = BenchmarkSerializable('name', np.arange(1000.))
+    return samples
+
+
+def get_missing_types(samples: Dict[str, Any]) -> List[type]:
+    """ Get the registered types for which there is no sample object"""
+    sample_types = {type(obj) for obj in samples.values()}
+    return [obj_type for obj_type in ser_factory.get_serializables()
+            if obj_type not in sample_types]
+
+
+def time_operation(operation: Callable[[], Any], min_time: float) -> Tuple[int, float]:
+    """ Repeat an operation for at least min_time seconds
+
+    Returns
+    -------
+    int: the number of repetitions
+    float: the mean duration of the operation in nanoseconds
+    """
+    repeat = 0
+    start = time.perf_counter_ns()
+    elapsed = 0
+    while elapsed < min_time * 1e9 or repeat == 0:
+        operation()
+        repeat += 1
+        elapsed = time.perf_counter_ns() - start
+    return repeat, elapsed / repeat
+
+
+def measure_allocation(operation: Callable[[], Any]) -> int:
+    """ Get the peak memory allocated by one call of the operation, in bytes"""
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+
+# sentinel stopping the sender thread of SocketRoundTrip
+_STOP = object()
+
+
+class SocketRoundTrip:
+    """ Send objects through a connected pair of sockets and receive them back
+
+    The objects are sent by a single long-lived thread fed through a queue, so that the timing
+    does not include the creation of a thread per operation
+    """
+
+    def __init__(self):
+        sender, receiver = socket.socketpair()
+        self.sender = Socket(sender)
+        self.receiver = Socket(receiver)
+        self._objs: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._send_all, daemon=True)
+        self._thread.start()
+
+    def _send_all(self):
+        while True:
+            obj = self._objs.get()
+            if obj is _STOP:
+                return
+            self.sender.check_sended_with_serializer(obj)
+
+    def close(self):
+        self._objs.put(_STOP)
+        self._thread.join()
+        self.sender.close()
+        self.receiver.close()
+
+    def __call__(self, obj: Any):
+        self._objs.put(obj)
+        return self.receiver.check_received_with_deserializer()
+
+
+def run(min_time: float = 0.2, operations=OPERATIONS,
+        samples: Optional[Dict[str, Any]] = None) -> List[BenchmarkResult]:
+    """ Benchmark the serialization operations on all sample objects
+
+    Parameters
+    ----------
+    min_time: float
+        minimum duration in seconds of the timing of each operation
+    operations: iterable of str
+        among 'serialize', 'deserialize' and 'socket' (round-trip through a socketpair)
+    samples: dict
+        named objects to benchmark, default to the output of get_samples
+
+    Returns
+    -------
+    list of BenchmarkResult
+    """
+    ser_factory.register_decorator()(BenchmarkSerializable)
+    if samples is None:
+        samples = get_samples()
+    round_trip = SocketRoundTrip() if 'socket' in operations else None
+    results = []
+    try:
+        for sample, obj in samples.items():
+            bytes_str = ser_factory.get_apply_serializer(obj)
+            functions = dict(serialize=lambda: ser_factory.get_apply_serializer(obj),
+                             deserialize=lambda: ser_factory.get_apply_deserializer(bytes_str),
+                             socket=lambda: round_trip(obj))
+            for operation in operations:
+                repeat, ns_per_op = time_operation(functions[operation], min_time)
+                results.append(BenchmarkResult(
+                    sample=sample, obj_type=obj.__class__.__name__, operation=operation,
+                    nbytes=len(bytes_str), repeat=repeat, ns_per_op=ns_per_op,
+                    mb_per_s=len(bytes_str) / ns_per_op * 1e3,
+                    allocated_bytes=measure_allocation(functions[operation])))
+    finally:
+        if round_trip is not None:
+            round_trip.close()
+    return results
+
+
+def to_json(results: List[BenchmarkResult]) -> Dict[str, Any]:
+    """ Get a JSON serializable dictionary of the results together with the platform info"""
+    return dict(python=platform.python_version(), numpy=np.__version__,
+                platform=platform.platform(), time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                results=[asdict(result) for result in results])
+
+
+def compare(results: List[BenchmarkResult], reference: Dict[str, Any]) -> Dict[Tuple[str, str],
+                                                                               float]:
+    """ Get the ratio of the durations of the results to the ones of a reference JSON run
+
+    Returns
+    -------
+    dict: keys are (sample, operation), values the ratio new / reference time per operation
+    """
+    reference_times = {(result['sample'], result['operation']): result['ns_per_op']
+                       for result in reference['results']}
+    return {(result.sample, result.operation):
+            result.ns_per_op / reference_times[(result.sample, result.operation)]
+            for result in results if (result.sample, result.operation) in reference_times}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the pymodaq serializer')
+    parser.add_argument('--output', help='path of the JSON file where to save the results')
+    parser.add_argument('--compare', help='path of a JSON file of a previous run to compare with')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum duration in seconds of the timing of each operation')
+    parser.add_argument('--operations', nargs='+', default=OPERATIONS, choices=OPERATIONS)
+    args = parser.parse_args(args)
+
+    samples = get_samples()
+    for obj_type in get_missing_types(samples):
+        print(f'No sample object for the registered type {obj_type}, skipped')
+
+    results = run(args.min_time, args.operations, samples)
+    ratios = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            ratios = compare(results, json.load(f))
+
+    print(f'{"sample":<28}{"operation":<13}{"bytes":>10}{"ns/op":>14}{"MB/s":>10}'
+          f'{"allocated":>12}{"ratio":>8}')
+    for result in results:
+        ratio = ratios.get((result.sample, result.operation), None)
+        print(f'{result.sample:<28}{result.operation:<13}{result.nbytes:>10}'
+              f'{result.ns_per_op:>14.0f}{result.mb_per_s:>10.1f}{result.allocated_bytes:>12}'
+              f'{"" if ratio is None else f"{ratio:.2f}":>8}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(to_json(results), f, indent=2)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
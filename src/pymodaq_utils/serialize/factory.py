@@ -1,9 +1,14 @@
 from abc import ABCMeta, abstractmethod
-from typing import Callable, List, Any, Optional, Tuple, TypeVar, Union
+from contextlib import nullcontext
+import time
+from typing import Callable, List, Any, Optional, Sequence, Tuple, TypeVar, Union
 
 from numpy.typing import NDArray
 
-from . import utils
+from pymodaq_utils.logger import set_logger, get_module_name
+from . import instrumentation, utils
+
+logger = set_logger(get_module_name(__file__))
 
 
 class SerializableBase(metaclass=ABCMeta):
@@ -60,6 +65,20 @@ class SerializableBase(metaclass=ABCMeta):
         """
         ...
 
+    @classmethod
+    def write(cls, obj: "SerializableBase", writer: utils.BytesWriter):
+        """ Write the serialized object into a BytesWriter
+
+        Default implementation appends the output of the serialize method. Subclasses holding large
+        payloads may override it to write their content straight into the writer.
+
+        Parameters
+        ----------
+        obj: SerializableBase
+        writer: utils.BytesWriter
+        """
+        writer.write(cls.serialize(obj))
+
 
 # List of all objects serializable via the serializer
 SERIALIZABLE = Union[bytes, str, int, float, complex, list, NDArray, SerializableBase]
@@ -68,13 +87,17 @@ Serializable = TypeVar("Serializable", bound=SERIALIZABLE)
 _SerializableClass = TypeVar("_SerializableClass", bound=SerializableBase)
 
 Serializer = Callable[[Serializable], bytes]
-Deserializer = Callable[[bytes], Tuple[Serializable, bytes]]
+Deserializer = Callable[[utils.BytesLike], Tuple[Serializable, utils.BytesLike]]
+Writer = Callable[[Serializable, utils.BytesWriter], None]
 
 
 class SerializableFactory:
     """The factory class for creating executors"""
 
-    serializable_registry: dict[type[SERIALIZABLE], dict[str, Union[Serializer, Deserializer]]] = {}
+    serializable_registry: dict[type[SERIALIZABLE],
+                                dict[str, Union[Serializer, Deserializer, Writer]]] = {}
+    # index of the registered types by their class name, as written in the serialized bytes
+    serializable_names: dict[str, type[SERIALIZABLE]] = {}
 
     @classmethod
     def add_type_to_serialize(
@@ -89,9 +112,19 @@ class SerializableFactory:
             return bytes_str
         return wrap
 
+    @classmethod
+    def add_type_to_writer(
+        cls, write_method: Writer[Serializable]
+    ) -> Writer[Serializable]:
+        def wrap(obj: Serializable, writer: utils.BytesWriter):
+            writer.write_tag(obj.__class__.__name__)
+            write_method(obj, writer)
+        return wrap
+
     @classmethod
     def register_from_obj(cls, obj: Serializable, serialize_method: Serializer[Serializable],
-                          deserialize_method: Optional[Deserializer[Serializable]] = None):
+                          deserialize_method: Optional[Deserializer[Serializable]] = None,
+                          write_method: Optional[Writer[Serializable]] = None):
         """Method to register a serializable object class to the internal registry.
 
         """
@@ -101,6 +134,7 @@ class SerializableFactory:
             obj_type=obj_type,
             serialize_method=serialize_method,
             deserialize_method=deserialize_method,
+            write_method=write_method,
         )
 
     @classmethod
@@ -118,7 +152,8 @@ class SerializableFactory:
         ) -> type[_SerializableClass]:
             cls.register_from_type(wrapped_class,
                                    wrapped_class.serialize,
-                                   wrapped_class.deserialize)
+                                   wrapped_class.deserialize,
+                                   wrapped_class.write)
 
             # Return wrapped_class
             return wrapped_class
@@ -126,20 +161,38 @@ class SerializableFactory:
 
     @classmethod
     def register_from_type(cls, obj_type: type[Serializable], serialize_method: Serializer[Serializable],
-                           deserialize_method: Deserializer[Serializable]):
+                           deserialize_method: Deserializer[Serializable],
+                           write_method: Optional[Writer[Serializable]] = None):
         """Method to register a serializable object class to the internal registry.
 
+        If no write_method is given, the object is written into a BytesWriter using the output of
+        its serialize_method
+
+        If another class is already registered with the same name, a warning is logged: the class
+        name being the only type information of the serialized objects, both are deserialized as
+        the first registered one
         """
+        if write_method is None:
+            def write_method(obj: Serializable, writer: utils.BytesWriter):
+                writer.write(serialize_method(obj))
+
         if obj_type not in cls.serializable_registry:
             cls.serializable_registry[obj_type] = dict(
                 serializer=cls.add_type_to_serialize(serialize_method),
-                deserializer=deserialize_method)
+                deserializer=deserialize_method,
+                writer=cls.add_type_to_writer(write_method))
+            registered_type = cls.serializable_names.setdefault(obj_type.__name__, obj_type)
+            if registered_type is not obj_type:
+                logger.warning(f"{obj_type} has the same name as the registered class "
+                               f"{registered_type}: its objects will be deserialized as "
+                               f"objects of the latter")
 
     def get_type_from_str(self, obj_type_str: str) -> type:
-        for k in self.serializable_registry:
-            if obj_type_str in str(k):
-                return k
-        raise ValueError(f"Unknown type '{obj_type_str}'")
+        """ Get the registered type whose class name is exactly obj_type_str"""
+        try:
+            return self.serializable_names[obj_type_str]
+        except KeyError:
+            raise ValueError(f"Unknown type '{obj_type_str}'")
 
     def get_serializables(self) -> List[type]:
         return list(self.serializable_registry.keys())
@@ -151,6 +204,94 @@ class SerializableFactory:
         else:
             raise NotImplementedError(f"There is no known method to serialize '{obj_type}'")
 
+    def get_writer(self, obj_type: type) -> Writer:
+        entry_dict = self.serializable_registry.get(obj_type, None)
+        if entry_dict is not None:
+            return entry_dict['writer']  # type: ignore
+        else:
+            raise NotImplementedError(f"There is no known method to serialize '{obj_type}'")
+
+    def get_apply_writer(self, obj: Any, writer: Optional[utils.BytesWriter] = None,
+                         append_length=False) -> utils.BytesWriter:
+        """ Write the serialized object, together with its type, into a BytesWriter
+
+        Parameters
+        ----------
+        obj: object
+            should be a serializable object (see get_serializables)
+        writer: utils.BytesWriter
+            the writer to append the serialized object to. If None, a new one is created
+        append_length: bool
+            if True will write a frame header holding the length of the serialized object before
+            it, see utils.frame_header_to_bytes. If the writer has the compact_tags option, the
+            type names are then replaced by indexes in a table of tags written once after the
+            frame header
+
+        Returns
+        -------
+        utils.BytesWriter: the writer holding the encoded object
+        """
+        if writer is None:
+            writer = utils.BytesWriter()
+        if append_length:
+            obj_writer = writer.spawn()
+            table_writer = writer.spawn()
+            flags = 0
+            if writer.compact_tags:
+                with utils.writer_tag_table() as table:
+                    self.get_apply_writer(obj, obj_writer)
+                table_writer.write_tag_table(list(table))
+                flags |= utils.FRAME_FLAG_TAG_TABLE
+            else:
+                self.get_apply_writer(obj, obj_writer)
+            writer.write(utils.frame_header_to_bytes(table_writer.nbytes + obj_writer.nbytes,
+                                                     flags))
+            writer.extend(table_writer)
+            writer.extend(obj_writer)
+        else:
+            metrics = instrumentation.serialization_metrics
+            if metrics is None:
+                self.get_writer(obj.__class__)(obj, writer)
+            else:
+                start = time.perf_counter()
+                self.get_writer(obj.__class__)(obj, writer)
+                metrics.add('serialize', obj.__class__.__name__, time.perf_counter() - start)
+        return writer
+
+    def get_apply_batch_writer(self, objs: Sequence[Any],
+                               writer: Optional[utils.BytesWriter] = None) -> utils.BytesWriter:
+        """ Write several objects into a single frame, see utils.FRAME_FLAG_BATCH
+
+        The frame header is followed by the table of compact tags if the writer has the
+        compact_tags option, then by the number of objects, the offset of each serialized object
+        from the end of the offset table and finally the serialized objects
+
+        Parameters
+        ----------
+        objs: sequence of objects
+            should be serializable objects (see get_serializables)
+        writer: utils.BytesWriter
+            the writer to append the frame to. If None, a new one is created
+
+        Returns
+        -------
+        utils.BytesWriter: the writer holding the frame
+
+        See Also
+        --------
+        get_apply_batch_deserializer
+        """
+        if writer is None:
+            writer = utils.BytesWriter()
+        objs_writer = writer.spawn()
+        offsets = []
+        with (utils.writer_tag_table() if writer.compact_tags else nullcontext()) as table:
+            for obj in objs:
+                offsets.append(objs_writer.nbytes)
+                self.get_apply_writer(obj, objs_writer)
+        utils.write_batch_frame(writer, objs_writer, offsets, table)
+        return writer
+
     def get_apply_serializer(self, obj: Any, append_length=False) -> bytes:
         """
 
@@ -160,7 +301,7 @@ class SerializableFactory:
             should be a serializable object (see get_serializables)
         append_length: bool
             if True will append the length of the bytes string in the beginning of the returned
-            bytes
+            bytes, as a frame header (see utils.frame_header_to_bytes)
 
         Returns
         -------
@@ -170,19 +311,16 @@ class SerializableFactory:
         -----
         Symmetric method of :meth:SerializableFactory.get_apply_deserializer
 
+        The object is first written into a BytesWriter (see get_apply_writer) then all segments are
+        joined, so that array payloads are copied only once into the returned bytes
+
         Examples
         --------
         >>> ser_factory = SerializableFactory()
         >>> s = [23, 'a']
         >>>> ser_factory.get_apply_deserializer(ser_factory.get_apply_serializer(s) == s
         """
-        serializer = self.get_serializer(obj.__class__)
-        bytes_str = serializer(obj)
-        if not append_length:
-            return bytes_str
-        else:
-            bytes_str = utils.int_to_bytes(len(bytes_str)) + bytes_str
-            return bytes_str
+        return self.get_apply_writer(obj, append_length=append_length).to_bytes()
 
     def get_deserializer(self, obj_type: type[Serializable]) -> Deserializer[Serializable]:
         entry_dict = self.serializable_registry.get(obj_type, None)
@@ -192,24 +330,30 @@ class SerializableFactory:
             raise NotImplementedError(f"There is no known method to deserialize an '{obj_type}' type")
 
     def get_apply_deserializer(
-        self, bytes_str: bytes, only_object: bool = True
-    ) -> Union[SERIALIZABLE, Tuple[SERIALIZABLE, bytes]]:
+        self, bytes_str: utils.BytesLike, only_object: bool = True, flags: int = 0
+    ) -> Union[SERIALIZABLE, Tuple[SERIALIZABLE, memoryview]]:
         """ Infer which object is to be deserialized from the first bytes
 
         The type has been encoded by the get_apply_serializer method
 
         Parameters
         ----------
-        bytes_str: bytes
-            The bytes to convert back to an object
+        bytes_str: bytes, bytearray or memoryview
+            The bytes to convert back to an object. It is wrapped into a memoryview used as a read
+            cursor: headers and payloads are read by slicing the view, hence without copying the
+            remaining bytes
         only_object: bool (default False)
             if False, return the object and the remaining bytes if any
             if True return only the object
+        flags: int
+            the flags read from the frame header of the message, if any (see
+            utils.get_frame_header_from_bytes)
 
         Returns
         -------
         object: the reconstructed object
-        optional bytes: only if only_object parameter is False, will be the leftover bytes
+        optional memoryview: only if only_object parameter is False, will be a view on the
+            leftover bytes
 
         Notes
         -----
@@ -221,11 +365,63 @@ class SerializableFactory:
         >>> s = [23, 'a']
         >>>> ser_factory.get_apply_deserializer(ser_factory.get_apply_serializer(s) == s
         """
-        obj_type_str, remaining_bytes = self.get_deserializer(str)(bytes_str)
+        if flags & ~utils.FRAME_FLAGS:
+            raise ValueError(f'Unknown frame flags: {flags}')
+        if flags & utils.FRAME_FLAG_BATCH:
+            raise ValueError('The message is a batch of objects, use get_apply_batch_deserializer')
+        if flags & (utils.FRAME_FLAG_TEMPLATE | utils.FRAME_FLAG_TEMPLATE_REFERENCE):
+            raise ValueError('The message uses header templates, see serialize.template')
+        if flags & utils.FRAME_FLAG_TAG_TABLE:
+            table, remaining_bytes = utils.get_tag_table_from_bytes(memoryview(bytes_str))
+            with utils.tag_table(table):
+                return self.get_apply_deserializer(remaining_bytes, only_object)
+
+        obj_type_str, remaining_bytes = utils.get_tag_from_bytes(memoryview(bytes_str))
 
         obj_type = self.get_type_from_str(obj_type_str)
-        if obj_type is None:
-            raise NotImplementedError(f"There is no known method to deserialize an "
-                                      f"'{obj_type_str}' type")
-        result = self.get_deserializer(obj_type)(remaining_bytes)
+        metrics = instrumentation.serialization_metrics
+        if metrics is None:
+            result = self.get_deserializer(obj_type)(remaining_bytes)
+        else:
+            start = time.perf_counter()
+            result = self.get_deserializer(obj_type)(remaining_bytes)
+            metrics.add('deserialize', obj_type_str, time.perf_counter() - start)
         return result[0] if only_object else result
+
+    def get_apply_batch_deserializer(self, bytes_str: utils.BytesLike,
+                                     flags: int = 0) -> List[SERIALIZABLE]:
+        """ Get the objects of a message, one object if it is not a batch
+
+        Parameters
+        ----------
+        bytes_str: bytes, bytearray or memoryview
+            the message following the frame header
+        flags: int
+            the flags read from the frame header of the message
+
+        Returns
+        -------
+        list: the objects of the message, in order
+
+        See Also
+        --------
+        get_apply_batch_writer
+        """
+        if not flags & utils.FRAME_FLAG_BATCH:
+            return [self.get_apply_deserializer(bytes_str, flags=flags)]
+        if flags & ~utils.FRAME_FLAGS:
+            raise ValueError(f'Unknown frame flags: {flags}')
+        remaining_bytes = memoryview(bytes_str)
+        if flags & utils.FRAME_FLAG_TAG_TABLE:
+            table, remaining_bytes = utils.get_tag_table_from_bytes(remaining_bytes)
+        else:
+            table = None
+        nobjects, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+        offsets = []
+        for ind in range(nobjects):
+            offset, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+            offsets.append(offset)
+        offsets.append(len(remaining_bytes))
+        with (utils.tag_table(table) if table is not None else nullcontext()):
+            return [self.get_apply_deserializer(remaining_bytes[start:end])
+                    for start, end in zip(offsets[:-1], offsets[1:])]
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Optional instrumentation of the transport of serialized objects
+
+Two kinds of metrics can be collected, both disabled by default so that they cost a single test
+of a None attribute per message:
+
+* SocketMetrics, collected by a Socket whose metrics attribute is set: the bytes and messages sent
+  and received, the time spent waiting for the kernel to accept the sent bytes and the histogram
+  of the receive latency, from the reception of a frame header to the decoded object
+* SerializationMetrics, collected by SerializableFactory once enable_serialization_metrics is
+  called: the number of calls and the time spent serializing and deserializing each registered
+  type. Times include the nested objects, for instance the elements of a list
+
+MetricsReporter logs a line summarizing them periodically.
+
+Examples
+--------
+>>> socket.metrics = SocketMetrics()
+>>> enable_serialization_metrics()
+>>> with MetricsReporter(interval=10.) as reporter:
+...     reporter.add('camera', socket.metrics)
+...     acquire()
+>>> socket.metrics.snapshot()['bytes_sent']
+"""
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymodaq_utils.logger import set_logger, get_module_name
+
+logger = set_logger(get_module_name(__file__))
+
+# upper bounds in seconds of the latency histogram buckets, from 1 µs to about 16 s
+LATENCY_BOUNDS = tuple(1e-6 * 2 ** ind for ind in range(25))
+
+
+class LatencyHistogram:
+    """ Histogram of durations in buckets with logarithmic bounds
+
+    Parameters
+    ----------
+    bounds: sequence of float
+        the increasing upper bounds in seconds of the buckets, a last bucket holding the longer
+        durations
+    """
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, duration: float):
+        self.counts[bisect.bisect_left(self.bounds, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def copy(self) -> 'LatencyHistogram':
+        histogram = LatencyHistogram(self.bounds)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.max = self.max
+        return histogram
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count != 0 else 0.
+
+    def percentile(self, q: float) -> float:
+        """ Get an upper bound of the q-th percentile (q between 0 and 100) of the durations: the
+        upper bound of its bucket, or the largest duration for the last bucket"""
+        if self.count == 0:
+            return 0.
+        rank = q / 100 * self.count
+        cumulated = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulated += count
+            if cumulated >= rank and cumulated != 0:
+                return min(bound, self.max)
+        return self.max
+
+
+class SocketMetrics:
+    """ Counters of the traffic through a Socket, see Socket.metrics
+
+    Attributes
+    ----------
+    bytes_sent, bytes_received: int
+        the number of bytes of the frames sent and received, headers included
+    messages_sent, messages_received: int
+        the number of frames sent and received, a batch frame counting for one
+    send_blocked_time: float
+        the time in seconds spent waiting for the kernel to accept the sent bytes
+    receive_latency: LatencyHistogram
+        the time between the reception of the frame headers and the decoded objects
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.receive_latency = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.bytes_sent = 0
+            self.messages_sent = 0
+            self.send_blocked_time = 0.
+            self.bytes_received = 0
+            self.messages_received = 0
+            self.receive_latency.reset()
+
+    def add_sent(self, nbytes: int, duration: float):
+        with self._lock:
+            self.bytes_sent += nbytes
+            self.messages_sent += 1
+            self.send_blocked_time += duration
+
+    def add_received(self, nbytes: int, latency: float):
+        with self._lock:
+            self.bytes_received += nbytes
+            self.messages_received += 1
+            self.receive_latency.add(latency)
+
+    def snapshot(self) -> dict:
+        """ Get a consistent copy of the counters as a dict, the latency as a LatencyHistogram"""
+        with self._lock:
+            return dict(bytes_sent=self.bytes_sent, messages_sent=self.messages_sent,
+                        send_blocked_time=self.send_blocked_time,
+                        bytes_received=self.bytes_received,
+                        messages_received=self.messages_received,
+                        receive_latency=self.receive_latency.copy())
+
+
+class SerializationMetrics:
+    """ Number of calls and time spent serializing and deserializing each type, see
+    enable_serialization_metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings: Dict[Tuple[str, str], List] = {}
+
+    def reset(self):
+        with self._lock:
+            self._timings = {}
+
+    def add(self, operation: str, type_name: str, duration: float):
+        """ Count a call of operation ('serialize' or 'deserialize') on an object of a type"""
+        with self._lock:
+            timing = self._timings.get((operation, type_name))
+            if timing is None:
+                self._timings[(operation, type_name)] = [1, duration]
+            else:
+                timing[0] += 1
+                timing[1] += duration
+
+    def snapshot(self) -> Dict[str, Dict[str, Tuple[int, float]]]:
+        """ Get the number of calls and the total time in seconds of each operation, by type name
+
+        Examples
+        --------
+        >>> get_serialization_metrics().snapshot()
+        {'ndarray': {'serialize': (10, 0.0012), 'deserialize': (10, 0.0003)}}
+        """
+        with self._lock:
+            timings = {}
+            for (operation, type_name), (count, total) in self._timings.items():
+                timings.setdefault(type_name, {})[operation] = (count, total)
+            return timings
+
+
+# collected by SerializableFactory if not None, see enable_serialization_metrics
+serialization_metrics: Optional[SerializationMetrics] = None
+
+
+def enable_serialization_metrics() -> SerializationMetrics:
+    """ Make SerializableFactory time the serialization of all objects, keeping the metrics
+    already collected if enabled"""
+    global serialization_metrics
+    if serialization_metrics is None:
+        serialization_metrics = SerializationMetrics()
+    return serialization_metrics
+
+
+def disable_serialization_metrics():
+    global serialization_metrics
+    serialization_metrics = None
+
+
+def get_serialization_metrics() -> Optional[SerializationMetrics]:
+    """ Get the metrics collected by SerializableFactory, None if disabled"""
+    return serialization_metrics
+
+
+def format_size(nbytes: float) -> str:
+    for unit in ('B', 'kB', 'MB'):
+        if abs(nbytes) < 1000:
+            return f'{nbytes:.1f} {unit}'
+        nbytes /= 1000
+    return f'{nbytes:.1f} GB'
+
+
+class MetricsReporter:
+    """ Log a line summarizing socket and serialization metrics every interval seconds, from a
+    daemon thread
+
+    Rates are computed over the time since the previous line
+
+    Parameters
+    ----------
+    interval: float
+        the time in seconds between two lines
+    log_level: int
+        the level of the logged lines
+    """
+
+    def __init__(self, interval: float = 10., log_level: int = 20):
+        self.interval = interval
+        self.log_level = log_level
+        self._sources: Dict[str, SocketMetrics] = {}
+        self._previous: Dict[str, dict] = {}
+        self._previous_time = time.perf_counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'MetricsReporter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def add(self, name: str, metrics: SocketMetrics):
+        """ Add the metrics of a socket to the report, under a name"""
+        self._sources[name] = metrics
+        self._previous[name] = metrics.snapshot()
+
+    def remove(self, name: str):
+        self._sources.pop(name, None)
+        self._previous.pop(name, None)
+
+    def report(self) -> str:
+        """ Log and return the summary of the metrics since the previous report"""
+        now = time.perf_counter()
+        elapsed = max(now - self._previous_time, 1e-9)
+        self._previous_time = now
+        parts = []
+        for name, metrics in list(self._sources.items()):
+            snapshot = metrics.snapshot()
+            previous = self._previous.get(name, snapshot)
+            self._previous[name] = snapshot
+            rates = {key: (snapshot[key] - previous[key]) / elapsed
+                     for key in ('bytes_sent', 'messages_sent', 'send_blocked_time',
+                                 'bytes_received', 'messages_received')}
+            latency = snapshot['receive_latency']
+            parts.append(f"{name}: out {format_size(rates['bytes_sent'])}/s "
+                         f"{rates['messages_sent']:.1f} msg/s "
+                         f"blocked {100 * rates['send_blocked_time']:.1f}%, "
+                         f"in {format_size(rates['bytes_received'])}/s "
+                         f"{rates['messages_received']:.1f} msg/s "
+                         f"latency p50 {1e3 * latency.percentile(50):.3f} ms "
+                         f"p99 {1e3 * latency.percentile(99):.3f} ms")
+        metrics = serialization_metrics
+        if metrics is not None:
+            for type_name, timings in sorted(metrics.snapshot().items()):
+                parts.append(f'{type_name}: ' + ' '.join(
+                    f'{operation} {count} in {1e3 * total:.3f} ms'
+                    for operation, (count, total) in sorted(timings.items())))
+        line = '; '.join(parts)
+        logger.log(self.log_level, line)
+        return line
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.report()
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._previous_time = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
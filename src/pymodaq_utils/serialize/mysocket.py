@@ -1,11 +1,29 @@
-from typing import Any, Union, TYPE_CHECKING
+import asyncio
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple, Union, TYPE_CHECKING
 
+import numpy as np
+
+from pymodaq_utils.enums import BaseEnum, enum_checker
 from pymodaq_utils.mysocket import Socket
 from . import utils
 from .factory import SerializableFactory, SERIALIZABLE
+from .instrumentation import SocketMetrics
+from .serializer import NdArraySerializeDeserialize
+from .template import TemplateDecoder, TemplateEncoder, TEMPLATE_FLAGS
+
+if TYPE_CHECKING:
+    from .recording import RecordingWriter
 
 ser_factory = SerializableFactory()
 
+# maximum number of segments given at once to socket.sendmsg
+IOV_MAX = 1024
+
 
 class SocketString:
     """Mimic the Socket object but actually using a bytes string not a socket connection
@@ -60,10 +78,78 @@ class SocketString:
         """
         return self.check_received_length(length)
 
+    def get_frame_header(self) -> Tuple[int, int]:
+        """ Read the frame header of the next message, see utils.frame_header_to_bytes
+
+        Returns
+        -------
+        int: the length of the message
+        int: the frame flags
+        """
+        return utils.read_frame_header(self.get_first_nbytes)
+
 
 class Socket(Socket):
     """Custom Socket wrapping the built-in one and added functionalities to
-    make sure message have been sent and received entirely"""
+    make sure message have been sent and received entirely
+
+    The codec and codec_threshold attributes set the compression applied to the large array
+    payloads sent with check_sended_with_serializer and compact_tags the use of a table of compact
+    tags in front of each message, see utils.BytesWriter. pack_lists, if True, sends homogeneous
+    lists as packed blocks and fortran_order, if True, sends Fortran-contiguous arrays without
+    copy, to use only with peers able to decode them
+
+    shared_memory_threshold, if not None, is the size above which array payloads are sent through
+    shared memory segments, only the segment names going through the socket. Use it only between
+    processes of the same host where the receiver deserializes every message: the receiver
+    unlinks each segment when decoding it and releases it when the decoded array is garbage
+    collected, a message never received leaks its segment
+
+    recorder, if not None, is a RecordingWriter in which every message sent with
+    check_sended_with_serializer is also appended, it cannot be used together with shared memory
+
+    block_size and checksum, if not None, split large array payloads into blocks compressed and
+    checksummed in parallel, see utils.encode_blocks
+
+    file_segments, if True, makes check_sended_with_serializer send the payloads of arrays viewing
+    a numpy.memmap (for instance np.asarray(memmap)) from their file with socket.sendfile, see
+    utils.FileSegment. Frames of a recording can be sent the same way, see
+    RecordingReader.get_frame_segment
+
+    header_templates, if True, makes check_sended_with_serializer send only the payloads and the
+    changed headers of messages with the same structure as the previous one, see
+    serialize.template. The compact_tags option is then not used
+
+    metrics, if not None, is a SocketMetrics collecting the traffic of the messages sent with
+    check_sended_writer and received with check_received_with_deserializer or
+    check_received_objects_with_deserializer, see serialize.instrumentation
+    """
+    codec: Optional[str] = None
+    codec_threshold: int = utils.CODEC_THRESHOLD
+    compact_tags: bool = False
+    pack_lists: bool = False
+    fortran_order: bool = False
+    shared_memory_threshold: Optional[int] = None
+    recorder: Optional['RecordingWriter'] = None
+    metrics: Optional[SocketMetrics] = None
+    header_templates: bool = False
+    block_size: Optional[int] = None
+    checksum: Optional[str] = None
+    file_segments: bool = False
+
+    def __init__(self, socket=None):
+        super().__init__(socket)
+        self._template_encoder = TemplateEncoder()
+        self._template_decoder = TemplateDecoder()
+
+    def get_bytes_writer(self) -> utils.BytesWriter:
+        """ Get an empty BytesWriter with the serialization options of the socket"""
+        return utils.BytesWriter(codec=self.codec, codec_threshold=self.codec_threshold,
+                                 compact_tags=self.compact_tags,
+                                 shared_memory_threshold=self.shared_memory_threshold,
+                                 block_size=self.block_size, checksum=self.checksum,
+                                 file_segments=self.file_segments, pack_lists=self.pack_lists,
+                                 fortran_order=self.fortran_order)
 
     def check_sended(self, data_bytes: bytes):
         """
@@ -72,11 +158,70 @@ class Socket(Socket):
         ----------
         data_bytes: bytes
         """
-        if not isinstance(data_bytes, bytes):
+        if not isinstance(data_bytes, (bytes, bytearray, memoryview)):
             raise TypeError(f'{data_bytes} should be an bytes string, not a {type(data_bytes)}')
+        view = memoryview(data_bytes).cast('B')
         sended = 0
-        while sended < len(data_bytes):
-            sended += self.socket.send(data_bytes[sended:])
+        while sended < len(view):
+            sended += self.socket.send(view[sended:])
+
+    def check_sended_segments(self, segments: List[Union[utils.BytesLike, utils.FileSegment]]):
+        """ Make sure all segments are sent through the socket, in order, without concatenating them
+
+        Uses scatter-gather socket.sendmsg when available (not on Windows), otherwise sends each
+        segment using memoryview slices. FileSegment are sent with socket.sendfile, directly from
+        the file
+
+        Parameters
+        ----------
+        segments: list of bytes-like objects or utils.FileSegment
+        """
+        segments_in_memory = []
+        for segment in segments:
+            if isinstance(segment, utils.FileSegment):
+                self._check_sended_views(segments_in_memory)
+                segments_in_memory = []
+                self.check_sended_file(segment)
+            else:
+                segments_in_memory.append(segment)
+        self._check_sended_views(segments_in_memory)
+
+    def check_sended_file(self, segment: utils.FileSegment):
+        """ Send the bytes of a file region using socket.sendfile (os.sendfile where available)
+
+        The bytes are read and sent by chunks if the wrapped socket does not support sendfile
+        """
+        with segment.open() as f:
+            if hasattr(self.socket, 'sendfile'):
+                sended = self.socket.sendfile(f, segment.offset, segment.nbytes)
+            else:
+                f.seek(segment.offset)
+                sended = 0
+                while sended < segment.nbytes:
+                    chunk = f.read(min(segment.nbytes - sended, 2**20))
+                    if len(chunk) == 0:
+                        break
+                    self.check_sended(chunk)
+                    sended += len(chunk)
+        if sended != segment.nbytes:
+            raise EOFError(f'{segment} is beyond the end of the file')
+
+    def _check_sended_views(self, segments: List[utils.BytesLike]):
+        views = [memoryview(segment).cast('B') for segment in segments]
+        if hasattr(self.socket, 'sendmsg'):
+            ind_view = 0
+            while ind_view < len(views):
+                sended = self.socket.sendmsg(views[ind_view:ind_view + IOV_MAX])
+                while ind_view < len(views) and sended >= views[ind_view].nbytes:
+                    sended -= views[ind_view].nbytes
+                    ind_view += 1
+                if sended > 0:
+                    views[ind_view] = views[ind_view][sended:]
+        else:
+            for view in views:
+                sended = 0
+                while sended < view.nbytes:
+                    sended += self.socket.send(view[sended:])
 
     def check_sended_with_serializer(self, obj: SERIALIZABLE):
         """ Convenience function to convert permitted objects to bytes and then use
@@ -85,18 +230,670 @@ class Socket(Socket):
         Appends to bytes the length of the message to make sure the reception knows how much bytes
         to expect
 
+        The message is not concatenated into a single bytes string: the headers and the buffers of
+        the arrays are sent as separate segments, see check_sended_segments
+
         For a list of allowed objects, see :meth:`Serializer.to_bytes`
         """
         # do not use Serializer anymore but mimic its behavior
-        self.check_sended(ser_factory.get_apply_serializer(obj, append_length=True))
+        self.check_sended_writer(*self.get_frame_writers(obj))
+
+    def get_frame_writers(self, obj: SERIALIZABLE) -> Tuple[utils.BytesWriter,
+                                                            Optional[utils.BytesWriter]]:
+        """ Serialize an object into the frame to send, see check_sended_with_serializer
+
+        Returns
+        -------
+        utils.BytesWriter: the frame to send
+        utils.BytesWriter or None: the frame to record instead, if the frame to send cannot be
+            decoded on its own, see check_sended_writer
+        """
+        writer = self.get_bytes_writer()
+        if self.header_templates:
+            message = ser_factory.get_apply_writer(obj, writer)
+            record_writer = message.spawn()
+            record_writer.write(utils.frame_header_to_bytes(message.nbytes))
+            record_writer.extend(message)
+            return self._template_encoder.encode(message), record_writer
+        return ser_factory.get_apply_writer(obj, writer, append_length=True), None
+
+    def check_sended_batch_with_serializer(self, objs: Sequence[SERIALIZABLE]):
+        """ Send several objects in a single batch frame, see
+        SerializableFactory.get_apply_batch_writer and BatchSender
+
+        The objects are received with check_received_objects_with_deserializer
+        """
+        writer = self.get_bytes_writer()
+        self.check_sended_writer(ser_factory.get_apply_batch_writer(objs, writer))
+
+    def check_sended_writer(self, writer: utils.BytesWriter,
+                            record_writer: Optional[utils.BytesWriter] = None):
+        """ Send the segments of a writer holding a whole frame, recording them if a recorder is
+        set
+
+        record_writer, if given, holds the frame to record instead, for frames that cannot be
+        decoded on their own"""
+        if self.recorder is not None and writer.shared_memory_threshold is not None:
+            raise ValueError('Messages sent through shared memory cannot be recorded')
+        segments = writer.segments
+        if self.metrics is None:
+            self.check_sended_segments(segments)
+        else:
+            start = time.perf_counter()
+            self.check_sended_segments(segments)
+            self.metrics.add_sent(writer.nbytes, time.perf_counter() - start)
+        if self.recorder is not None:
+            self.recorder.write_segments(segments if record_writer is None else
+                                         record_writer.segments)
 
     def check_receiving(self, bytes_str: bytes):
-        """ First read the 4th first bytes to get the total message length
+        """ First read the frame header to get the total message length
         Make sure to read that much bytes before processing the message
 
         See check_sended and check_sended_with_serializer for a symmetric action
         """
-        
-        bytes_len_bytes, remaining_bytes = utils.split_nbytes(bytes_str, 4)
-        bytes_len = utils.bytes_to_int(bytes_len_bytes)
-        self.check_received_length(bytes_len)
\ No newline at end of file
+        bytes_len, flags, remaining_bytes = utils.get_frame_header_from_bytes(bytes_str)
+        return self.check_received_length(bytes_len)
+
+    def get_frame_header(self) -> Tuple[int, int]:
+        """ Read the frame header of the next message, see utils.frame_header_to_bytes
+
+        Returns
+        -------
+        int: the length of the message
+        int: the frame flags
+        """
+        return utils.read_frame_header(self.get_first_nbytes)
+
+    def check_received_with_deserializer(self, out: Optional[utils.ArrayProvider] = None
+                                         ) -> SERIALIZABLE:
+        """ Convenience function to receive a message sent with check_sended_with_serializer and
+        convert it back to an object
+
+        The frame header is read first to know how much bytes to expect
+
+        Parameters
+        ----------
+        out: ndarray, list of ndarray, utils.ArrayPool or Callable
+            if not None, the arrays into which received arrays are written, see
+            utils.get_array_provider. When the message is a single uncompressed array, its
+            payload is received directly into the output array, otherwise it is copied into it
+        """
+        bytes_len, flags = self.get_frame_header()
+        if self.metrics is None:
+            return self._check_received_object(bytes_len, flags, out)
+        start = time.perf_counter()
+        obj = self._check_received_object(bytes_len, flags, out)
+        self._add_received_metrics(bytes_len, flags, start)
+        return obj
+
+    def _add_received_metrics(self, bytes_len: int, flags: int, start: float):
+        self.metrics.add_received(len(utils.frame_header_to_bytes(bytes_len, flags)) + bytes_len,
+                                  time.perf_counter() - start)
+
+    def _check_received_object(self, bytes_len: int, flags: int,
+                               out: Optional[utils.ArrayProvider]) -> SERIALIZABLE:
+        if out is None:
+            if flags & TEMPLATE_FLAGS:
+                return self._check_received_template(bytes_len, flags)
+            return ser_factory.get_apply_deserializer(self.check_received_length(bytes_len),
+                                                      flags=flags)
+        with utils.output_arrays(out):
+            if flags & TEMPLATE_FLAGS:
+                return self._check_received_template(bytes_len, flags)
+            if flags == 0:
+                return self._check_received_array_into_output(bytes_len)
+            return ser_factory.get_apply_deserializer(self.check_received_length(bytes_len),
+                                                      flags=flags)
+
+    def _check_received_template(self, bytes_len: int, flags: int) -> SERIALIZABLE:
+        """ Receive a message of bytes_len bytes using header templates, see serialize.template"""
+        if flags & utils.FRAME_FLAG_TEMPLATE_REFERENCE:
+            return self._template_decoder.receive(bytes_len, self.check_received_into)
+        return self._template_decoder.define(self.check_received_length(bytes_len))
+
+    def _check_received_array_into_output(self, bytes_len: int) -> SERIALIZABLE:
+        """ Receive a message of bytes_len bytes, parsing its headers while they are received so
+        that the payload of a message made of a single array is received directly into its output
+        array (see utils.get_output_array). Other messages are decoded as usual"""
+        message = bytearray(bytes_len)
+        view = memoryview(message)
+        position = 0
+
+        def receive(nbytes: int) -> memoryview:
+            nonlocal position
+            if position + nbytes > bytes_len:
+                raise ValueError('Inconsistent message length')
+            self.check_received_into(view[position:position + nbytes])
+            position += nbytes
+            return view[position - nbytes:position]
+
+        def receive_int() -> int:
+            int_bytes = receive(4)
+            if bytes(int_bytes) == utils.LENGTH_ESCAPE_BYTES:
+                return int.from_bytes(receive(8), 'big')
+            return utils.bytes_to_int(int_bytes)
+
+        def receive_string() -> str:
+            return utils.bytes_to_string(receive(receive_int()))
+
+        if (bytes_len >= 4 and receive_string() == np.ndarray.__name__ and position + 4 <=
+                bytes_len):
+            ndarray_type, *options = receive_string().split(
+                NdArraySerializeDeserialize.OPTIONS_SEPARATOR)
+            if set(options) <= {'F'}:
+                order = 'F' if options else 'C'
+                ndarray_len = receive_int()
+                shape = tuple(receive_int() for _ in range(receive_int())) or (1,)
+                dtype = np.dtype(ndarray_type)
+                try:
+                    out = (utils.get_output_array(dtype, shape, order)
+                           if position + ndarray_len == bytes_len else None)
+                except ValueError:
+                    self.check_received_into(view[position:])  # keep the stream consistent
+                    raise
+                if out is not None and out.nbytes == ndarray_len:
+                    self.check_received_into(out if order == 'C' else out.T)
+                    return out
+        self.check_received_into(view[position:])
+        return ser_factory.get_apply_deserializer(message)
+
+    def check_received_objects_with_deserializer(self) -> List[SERIALIZABLE]:
+        """ Receive the next message and convert it back to the list of its objects
+
+        A batch frame, see check_sended_batch_with_serializer, gives all its objects in order,
+        any other message a list of its single object
+        """
+        bytes_len, flags = self.get_frame_header()
+        start = time.perf_counter() if self.metrics is not None else None
+        if flags & TEMPLATE_FLAGS:
+            objs = [self._check_received_template(bytes_len, flags)]
+        else:
+            objs = ser_factory.get_apply_batch_deserializer(self.check_received_length(bytes_len),
+                                                            flags=flags)
+        if start is not None:
+            self._add_received_metrics(bytes_len, flags, start)
+        return objs
+
+
+class BatchSender:
+    """ Gather small objects to be sent through a Socket into batch frames
+
+    Objects are serialized as soon as they are given to send, a batch frame holding them is sent
+    when its size reaches max_bytes, when it holds max_count objects or at the latest max_delay
+    seconds after its first object, from a timer thread. Received objects are obtained with
+    Socket.check_received_objects_with_deserializer
+
+    Parameters
+    ----------
+    socket: Socket
+        the socket through which the batches are sent, with its serialization options
+    max_bytes: int
+        the size in bytes of the serialized objects above which the batch is sent
+    max_count: int
+        the number of objects above which the batch is sent
+    max_delay: float or None
+        the maximum time in seconds an object waits before being sent. None to only send
+        batches when full or when flush is called
+
+    Notes
+    -----
+    With max_delay, batches are sent from a timer thread, possibly while the caller sends other
+    messages through the same socket, which would interleave their bytes. Send such messages only
+    after calling flush, with no concurrent call to send, or use max_delay=None
+
+    Examples
+    --------
+    >>> with BatchSender(socket, max_delay=0.005) as sender:
+    ...     for value in values:
+    ...         sender.send(value)
+    """
+
+    def __init__(self, socket: Socket, max_bytes: int = 65536, max_count: int = 1024,
+                 max_delay: Optional[float] = 0.01):
+        self._socket = socket
+        self._max_bytes = max_bytes
+        self._max_count = max_count
+        self._max_delay = max_delay
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+        self._reset()
+
+    def _reset(self):
+        self._writer = self._socket.get_bytes_writer()
+        self._objs_writer = self._writer.spawn()
+        self._offsets: List[int] = []
+        self._table: Optional[Dict[str, int]] = {} if self._writer.compact_tags else None
+
+    def __len__(self) -> int:
+        """int: the number of objects waiting to be sent"""
+        return len(self._offsets)
+
+    def __enter__(self) -> 'BatchSender':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def send(self, obj: SERIALIZABLE):
+        """ Serialize an object into the current batch, sending the batch if it is full
+
+        The batch is left unchanged if the object cannot be serialized"""
+        with self._lock:
+            obj_writer = self._objs_writer.spawn()
+            table = dict(self._table) if self._table is not None else None
+            with (utils.writer_tag_table(table) if table is not None else nullcontext()):
+                ser_factory.get_apply_writer(obj, obj_writer)
+            self._table = table
+            self._offsets.append(self._objs_writer.nbytes)
+            self._objs_writer.extend(obj_writer)
+            if (self._objs_writer.nbytes >= self._max_bytes or
+                    len(self._offsets) >= self._max_count):
+                self.flush()
+            elif len(self._offsets) == 1 and self._max_delay is not None:
+                self._timer = threading.Timer(self._max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """ Send the current batch if it holds objects"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if len(self._offsets) == 0:
+                return
+            utils.write_batch_frame(self._writer, self._objs_writer, self._offsets, self._table)
+            writer = self._writer
+            self._reset()
+            self._socket.check_sended_writer(writer)
+
+    def close(self):
+        """ Send the pending objects"""
+        self.flush()
+
+
+class QueuePolicy(BaseEnum):
+    """ What QueuedSender.send does with a new frame when the queue is full"""
+    BLOCK = 0  # wait for the sender thread to make room
+    DROP_OLDEST = 1  # discard the oldest queued frame
+    DROP_NEWEST = 2  # discard the new frame
+    COALESCE_LATEST = 3  # replace the queued frame with the same key, else discard the oldest
+
+
+@dataclass
+class SenderMetrics:
+    """ Snapshot of the queue of a QueuedSender"""
+    depth: int  # number of frames waiting in the queue
+    nbytes: int  # number of bytes waiting in the queue
+    max_depth: int  # largest depth reached
+    sent: int  # number of frames sent
+    dropped: int  # number of frames discarded because the queue was full
+    coalesced: int  # number of frames replaced by a newer frame with the same key
+    blocked_time: float  # total time in seconds send waited for room in the queue
+
+
+class QueuedSender:
+    """ Send objects through a Socket from a dedicated thread draining a bounded queue of frames
+
+    Objects are serialized by send, in the calling thread, and the data of their arrays copied
+    into the queued frame, so that the caller may modify them as soon as send returns. The
+    sender thread then waits for the kernel to accept the bytes, so that a slow peer never
+    stalls the caller, within the limits of the queue policy.
+
+    Parameters
+    ----------
+    socket: Socket
+        the socket through which the frames are sent, with its serialization options
+    maxsize: int
+        the number of frames the queue holds at most
+    policy: QueuePolicy or str
+        what to do with a new frame when the queue is full, see QueuePolicy. Policies
+        discarding frames cannot be used with the header_templates or shared memory options of
+        the socket, whose frames depend on each other or own resources
+    max_bytes: int or None
+        the number of bytes the queue holds at most, beside its first frame. None for no limit
+
+    Examples
+    --------
+    >>> with QueuedSender(socket, maxsize=8, policy='coalesce_latest') as sender:
+    ...     while acquiring:
+    ...         sender.send(grab_frame(), key='camera')
+    ...     print(sender.metrics)
+    """
+
+    def __init__(self, socket: Socket, maxsize: int = 64,
+                 policy: Union[QueuePolicy, str] = QueuePolicy.BLOCK,
+                 max_bytes: Optional[int] = None):
+        self._socket = socket
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._policy = enum_checker(QueuePolicy, policy)
+        if self._policy != QueuePolicy.BLOCK and (socket.header_templates or
+                                                  socket.shared_memory_threshold is not None):
+            raise ValueError(f'The {self._policy.name} policy cannot be used with header templates '
+                             f'or shared memory')
+        self._queue: Deque[Tuple[utils.BytesWriter, Optional[utils.BytesWriter], Any]] = deque()
+        self._condition = threading.Condition()
+        self._nbytes = 0
+        self._sending = False
+        self._closed = False
+        self._error: Optional[Exception] = None
+        self._max_depth = 0
+        self._sent = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._blocked_time = 0.
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        """int: the number of frames waiting in the queue"""
+        return len(self._queue)
+
+    def __enter__(self) -> 'QueuedSender':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(flush=exc_type is None)
+
+    @property
+    def policy(self) -> QueuePolicy:
+        return self._policy
+
+    @property
+    def metrics(self) -> SenderMetrics:
+        """SenderMetrics: the current state of the queue and its counters"""
+        with self._condition:
+            return SenderMetrics(len(self._queue), self._nbytes, self._max_depth, self._sent,
+                                 self._dropped, self._coalesced, self._blocked_time)
+
+    def _is_full(self, nbytes: int) -> bool:
+        return len(self._queue) != 0 and (
+            len(self._queue) >= self._maxsize or
+            (self._max_bytes is not None and self._nbytes + nbytes > self._max_bytes))
+
+    def _check_error(self):
+        if self._error is not None:
+            raise ConnectionError(f'The sender thread stopped: {self._error}') from self._error
+        if self._closed:
+            raise ValueError('Sending through a closed QueuedSender')
+
+    def send(self, obj: SERIALIZABLE, key: Any = None) -> bool:
+        """ Serialize an object and queue its frame for sending
+
+        Parameters
+        ----------
+        obj: object
+            a serializable object
+        key: hashable
+            with the COALESCE_LATEST policy, when the queue is full, a queued frame with the same
+            key is replaced by the new one, for instance to only send the latest frame of each
+            detector
+
+        Returns
+        -------
+        bool: False if the frame was discarded by the DROP_NEWEST policy, else True
+
+        Raises
+        ------
+        ConnectionError: if a previous frame could not be sent
+        """
+        writer, record_writer = self._socket.get_frame_writers(obj)
+        frame = (writer.copy(), record_writer.copy() if record_writer is not None else None, key)
+        nbytes = writer.nbytes
+        with self._condition:
+            self._check_error()
+            if self._policy == QueuePolicy.COALESCE_LATEST and self._is_full(nbytes):
+                for ind, (queued_writer, _, queued_key) in enumerate(self._queue):
+                    if queued_key == key:
+                        self._queue[ind] = frame
+                        self._nbytes += nbytes - queued_writer.nbytes
+                        self._coalesced += 1
+                        return True
+            if self._is_full(nbytes):
+                if self._policy == QueuePolicy.BLOCK:
+                    start = time.perf_counter()
+                    while self._is_full(nbytes) and self._error is None:
+                        self._condition.wait()
+                    self._blocked_time += time.perf_counter() - start
+                    self._check_error()
+                elif self._policy == QueuePolicy.DROP_NEWEST:
+                    self._dropped += 1
+                    return False
+                else:
+                    while self._is_full(nbytes):
+                        self._nbytes -= self._queue.popleft()[0].nbytes
+                        self._dropped += 1
+            self._queue.append(frame)
+            self._nbytes += nbytes
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._condition.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._queue) == 0 and not self._closed:
+                    self._condition.wait()
+                if len(self._queue) == 0:
+                    return
+                writer, record_writer, _ = self._queue.popleft()
+                self._nbytes -= writer.nbytes
+                self._sending = True
+                self._condition.notify_all()
+            try:
+                self._socket.check_sended_writer(writer, record_writer)
+            except Exception as e:
+                with self._condition:
+                    self._error = e
+                    self._dropped += len(self._queue)
+                    self._queue.clear()
+                    self._nbytes = 0
+                    self._sending = False
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._sent += 1
+                self._sending = False
+                self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """ Wait for all the queued frames to be sent
+
+        Returns
+        -------
+        bool: False if the timeout expired before, else True
+
+        Raises
+        ------
+        ConnectionError: if a frame could not be sent
+        """
+        with self._condition:
+            done = self._condition.wait_for(
+                lambda: self._error is not None or (len(self._queue) == 0 and not self._sending),
+                timeout)
+            if self._error is not None:
+                raise ConnectionError(f'The sender thread stopped: {self._error}') from self._error
+            return done
+
+    def close(self, flush: bool = True):
+        """ Stop the sender thread, after sending the queued frames if flush is True
+
+        Raises
+        ------
+        ConnectionError: if flush is True and a frame could not be sent
+        """
+        with self._condition:
+            if not flush:
+                self._dropped += len(self._queue)
+                self._queue.clear()
+                self._nbytes = 0
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        if flush and self._error is not None:
+            raise ConnectionError(f'The sender thread stopped: {self._error}') from self._error
+
+
+class AsyncSocket:
+    """asyncio counterpart of the Socket object, speaking the same framing over asyncio streams
+
+    Parameters
+    ----------
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    See Also
+    --------
+    :class:`Socket`, :meth:`AsyncSocket.open_connection`
+    """
+    codec: Optional[str] = None
+    codec_threshold: int = utils.CODEC_THRESHOLD
+    compact_tags: bool = False
+    pack_lists: bool = False
+    fortran_order: bool = False
+    shared_memory_threshold: Optional[int] = None
+    block_size: Optional[int] = None
+    checksum: Optional[str] = None
+    file_segments: bool = False
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    def get_bytes_writer(self) -> utils.BytesWriter:
+        """ Get an empty BytesWriter with the serialization options of the socket"""
+        return utils.BytesWriter(codec=self.codec, codec_threshold=self.codec_threshold,
+                                 compact_tags=self.compact_tags,
+                                 shared_memory_threshold=self.shared_memory_threshold,
+                                 block_size=self.block_size, checksum=self.checksum,
+                                 file_segments=self.file_segments, pack_lists=self.pack_lists,
+                                 fortran_order=self.fortran_order)
+
+    @classmethod
+    async def open_connection(cls, host: str = None, port: int = None, **kwargs) -> 'AsyncSocket':
+        """ Open a connection using asyncio.open_connection, see its documentation for the arguments
+        (for instance an already connected socket can be given using the sock keyword)"""
+        reader, writer = await asyncio.open_connection(host, port, **kwargs)
+        return cls(reader, writer)
+
+    @property
+    def reader(self) -> asyncio.StreamReader:
+        return self._reader
+
+    @property
+    def writer(self) -> asyncio.StreamWriter:
+        return self._writer
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def check_sended(self, data_bytes: utils.BytesLike):
+        """ Make sure all bytes are sent through the stream, waiting for the write buffer to be
+        drained"""
+        await self.check_sended_segments([data_bytes])
+
+    async def check_sended_segments(self, segments: List[utils.BytesLike]):
+        """ Write all segments, in order, to the stream
+
+        The write buffer is drained after each segment, yielding to the event loop while large
+        payloads are in flight. FileSegment are sent with loop.sendfile
+        """
+        loop = asyncio.get_running_loop()
+        for segment in segments:
+            if isinstance(segment, utils.FileSegment):
+                with segment.open() as f:
+                    sended = await loop.sendfile(self._writer.transport, f, segment.offset,
+                                                 segment.nbytes)
+                if sended != segment.nbytes:
+                    raise EOFError(f'{segment} is beyond the end of the file')
+            else:
+                self._writer.write(segment)
+            await self._writer.drain()
+
+    async def check_sended_with_serializer(self, obj: SERIALIZABLE):
+        """ Convert a permitted object to bytes segments, preceded by its frame header, and send
+        them
+
+        See Also
+        --------
+        :meth:`Socket.check_sended_with_serializer`
+        """
+        writer = self.get_bytes_writer()
+        await self.check_sended_segments(
+            ser_factory.get_apply_writer(obj, writer, append_length=True).segments)
+
+    async def check_sended_batch_with_serializer(self, objs: Sequence[SERIALIZABLE]):
+        """ Send several objects in a single batch frame
+
+        See Also
+        --------
+        :meth:`Socket.check_sended_batch_with_serializer`
+        """
+        writer = self.get_bytes_writer()
+        await self.check_sended_segments(
+            ser_factory.get_apply_batch_writer(objs, writer).segments)
+
+    async def check_received_length(self, length: int) -> bytearray:
+        """ Receive exactly length bytes from the stream into a preallocated bytearray
+
+        Raises
+        ------
+        asyncio.IncompleteReadError: if the stream is closed before all bytes are received
+        """
+        if not isinstance(length, int):
+            raise TypeError(f'{length} should be an integer, not a {type(length)}')
+        data_bytes = bytearray(length)
+        mess_length = 0
+        while mess_length < length:
+            chunk = await self._reader.read(length - mess_length)
+            if len(chunk) == 0:
+                raise asyncio.IncompleteReadError(bytes(data_bytes[:mess_length]), length)
+            data_bytes[mess_length:mess_length + len(chunk)] = chunk
+            mess_length += len(chunk)
+        return data_bytes
+
+    async def get_frame_header(self) -> Tuple[int, int]:
+        """ Read the frame header of the next message, see utils.frame_header_to_bytes
+
+        Returns
+        -------
+        int: the length of the message
+        int: the frame flags
+        """
+        header_bytes = await self.check_received_length(4)
+        header_length = utils.get_frame_header_length(header_bytes)
+        if header_length > 4:
+            header_bytes += await self.check_received_length(header_length - 4)
+        length, flags, _ = utils.get_frame_header_from_bytes(header_bytes)
+        return length, flags
+
+    async def check_received_with_deserializer(self, out: Optional[utils.ArrayProvider] = None
+                                               ) -> SERIALIZABLE:
+        """ Receive a message sent with check_sended_with_serializer and convert it back to an
+        object
+
+        If out is not None, received arrays are copied into the arrays it provides, see
+        utils.get_array_provider
+
+        See Also
+        --------
+        :meth:`Socket.check_received_with_deserializer`
+        """
+        bytes_len, flags = await self.get_frame_header()
+        bytes_str = await self.check_received_length(bytes_len)
+        with (utils.output_arrays(out) if out is not None else nullcontext()):
+            return ser_factory.get_apply_deserializer(bytes_str, flags=flags)
+
+    async def check_received_objects_with_deserializer(self) -> List[SERIALIZABLE]:
+        """ Receive the next message and convert it back to the list of its objects
+
+        See Also
+        --------
+        :meth:`Socket.check_received_objects_with_deserializer`
+        """
+        bytes_len, flags = await self.get_frame_header()
+        return ser_factory.get_apply_batch_deserializer(
+            await self.check_received_length(bytes_len), flags=flags)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only recording of serialized objects into a file, indexed for random access
+
+A recording is made of two files:
+
+* the data file starting with FILE_MAGIC and followed by the frames exactly as sent through a
+  Socket, that is a frame header (see utils.frame_header_to_bytes) followed by the serialized
+  object (see SerializableFactory.get_apply_serializer)
+* the sidecar index file, with the INDEX_SUFFIX appended to the data file path, holding the
+  offset of each frame in the data file as a little-endian unsigned 64 bits integer
+
+Both files are only appended to, so that a recording can be read while it is written. If the
+index is missing or lags behind the data file, for instance after a crash, it is rebuilt by
+scanning the frames, and a trailing incomplete frame is ignored.
+
+Examples
+--------
+>>> with RecordingWriter('frames.pmq') as recorder:
+...     recorder.write(np.arange(10))
+...     recorder.write('a string')
+>>> with RecordingReader('frames.pmq') as reader:
+...     reader[1]
+'a string'
+"""
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from . import utils
+from .factory import SerializableFactory, SERIALIZABLE
+
+ser_factory = SerializableFactory()
+
+FILE_MAGIC = b'PYMODAQREC\x00\x01'
+INDEX_SUFFIX = '.idx'
+INDEX_DTYPE = np.dtype('<u8')
+
+
+def get_index_path(path: Union[str, Path]) -> Path:
+    """ Get the path of the sidecar index file of the recording at path"""
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def scan_frames(bytes_str: utils.BytesLike, offset: int) -> Tuple[List[int], int]:
+    """ Find the complete frames of a recording data file starting at offset
+
+    Returns
+    -------
+    list of int: the offsets of the complete frames found
+    int: the offset of the end of the last complete frame
+    """
+    view = memoryview(bytes_str).cast('B')
+    offsets = []
+    while len(view) - offset >= 4:
+        header_length = utils.get_frame_header_length(view[offset:offset + 4])
+        if len(view) - offset < header_length:
+            break
+        length, _, _ = utils.get_frame_header_from_bytes(view[offset:offset + header_length])
+        if len(view) - offset - header_length < length:
+            break
+        offsets.append(offset)
+        offset += header_length + length
+    return offsets, offset
+
+
+def _check_magic(bytes_str: utils.BytesLike, path: Path):
+    if bytes(bytes_str[:len(FILE_MAGIC)]) != FILE_MAGIC:
+        raise ValueError(f'{path} is not a pymodaq recording file')
+
+
+class RecordingWriter:
+    """ Append serialized objects to a recording file and its index
+
+    Parameters
+    ----------
+    path: str or Path
+        the recording data file, created if it does not exist, otherwise appended to
+    codec: str or None
+        the codec used to compress large array payloads, see utils.BytesWriter
+    codec_threshold: int
+        the size in bytes above which array payloads are compressed
+    compact_tags: bool
+        if True, each frame holds a table of compact tags, see utils.BytesWriter
+    pack_lists: bool
+        if True, homogeneous lists are written as packed blocks, see utils.BytesWriter
+    fortran_order: bool
+        if True, Fortran-contiguous arrays are written without copy, see utils.BytesWriter
+    block_size: int or None
+        the size of the blocks large array payloads to compress or checksum are split into
+    checksum: str or None
+        the checksum computed on the blocks of large array payloads, see utils.encode_blocks
+
+    See Also
+    --------
+    :class:`RecordingReader`
+    """
+
+    def __init__(self, path: Union[str, Path], codec: Optional[str] = None,
+                 codec_threshold: int = utils.CODEC_THRESHOLD, compact_tags: bool = False,
+                 block_size: Optional[int] = None, checksum: Optional[str] = None,
+                 pack_lists: bool = False, fortran_order: bool = False):
+        self._path = Path(path)
+        self._codec = codec
+        self._codec_threshold = codec_threshold
+        self._compact_tags = compact_tags
+        self._block_size = block_size
+        self._checksum = checksum
+        self._pack_lists = pack_lists
+        self._fortran_order = fortran_order
+        self._nframes, self._offset = self._repair()
+        self._file = open(self._path, 'ab')
+        self._index_file = open(get_index_path(self._path), 'ab')
+
+    def _repair(self) -> Tuple[int, int]:
+        """ Create the recording files or make an existing index consistent with its data file,
+        truncating a trailing incomplete frame
+
+        Returns
+        -------
+        int: the number of frames in the recording
+        int: the size of the data file
+        """
+        index_path = get_index_path(self._path)
+        if not self._path.exists() or self._path.stat().st_size == 0:
+            self._path.write_bytes(FILE_MAGIC)
+            index_path.write_bytes(b'')
+            return 0, len(FILE_MAGIC)
+
+        with open(self._path, 'r+b') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                _check_magic(mapped, self._path)
+                offsets = load_index(self._path, len(mapped))
+                start = len(FILE_MAGIC) if len(offsets) == 0 else int(offsets[-1])
+                scanned_offsets, end = scan_frames(mapped, start)
+                size = len(mapped)
+            if end != size:
+                f.truncate(end)
+        offsets = np.concatenate((offsets[:-1], np.array(scanned_offsets, dtype=INDEX_DTYPE)))
+        index_path.write_bytes(offsets.astype(INDEX_DTYPE).tobytes())
+        return len(offsets), end
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def __len__(self) -> int:
+        return self._nframes
+
+    def __enter__(self) -> 'RecordingWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, obj: SERIALIZABLE) -> int:
+        """ Serialize an object and append its frame to the recording
+
+        Returns
+        -------
+        int: the index of the frame in the recording
+        """
+        writer = utils.BytesWriter(codec=self._codec, codec_threshold=self._codec_threshold,
+                                   compact_tags=self._compact_tags, block_size=self._block_size,
+                                   checksum=self._checksum, pack_lists=self._pack_lists,
+                                   fortran_order=self._fortran_order)
+        return self.write_segments(ser_factory.get_apply_writer(obj, writer,
+                                                                append_length=True).segments)
+
+    def write_segments(self, segments: List[utils.BytesLike]) -> int:
+        """ Append an already serialized frame, header included, given as a list of segments,
+        for instance the segments sent by Socket.check_sended_with_serializer
+
+        Returns
+        -------
+        int: the index of the frame in the recording
+        """
+        for segment in segments:
+            self._file.write(segment.read() if isinstance(segment, utils.FileSegment) else segment)
+        self._index_file.write(struct.pack('<Q', self._offset))
+        self._offset += sum(len(memoryview(segment).cast('B'))
+                            if not isinstance(segment, utils.FileSegment) else segment.nbytes
+                            for segment in segments)
+        self._nframes += 1
+        return self._nframes - 1
+
+    def flush(self):
+        """ Flush the data file before the index so that readers never get offsets of frames
+        not yet in the data file"""
+        self._file.flush()
+        self._index_file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+            self._index_file.close()
+
+
+def load_index(path: Union[str, Path], size: int) -> np.ndarray:
+    """ Load the frame offsets of a recording from its index file, ignoring offsets beyond the
+    size of the data file"""
+    index_path = get_index_path(path)
+    if not index_path.exists():
+        return np.zeros((0,), dtype=INDEX_DTYPE)
+    index_bytes = index_path.read_bytes()
+    offsets = np.frombuffer(index_bytes[:len(index_bytes) - len(index_bytes) % INDEX_DTYPE.itemsize],
+                            dtype=INDEX_DTYPE)
+    return offsets[offsets < size]
+
+
+class RecordingReader:
+    """ Random access to the frames of a recording file mapped in memory
+
+    Frames are decoded without copy: arrays are read-only views on the mapped file. The mapping
+    is released when the reader is closed and all decoded arrays have been garbage collected.
+
+    Parameters
+    ----------
+    path: str or Path
+        the recording data file
+
+    See Also
+    --------
+    :class:`RecordingWriter`
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self._path = Path(path)
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._offsets = np.zeros((0,), dtype=INDEX_DTYPE)
+        self._end = 0
+        self.refresh()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def refresh(self):
+        """ Map the data file again to access the frames appended since the last refresh"""
+        size = os.path.getsize(self._path)
+        if self._mmap is not None and size == len(self._mmap):
+            return
+        with open(self._path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _check_magic(mapped, self._path)
+        self._release()
+        self._mmap = mapped
+        self._view = memoryview(mapped)
+        offsets = load_index(self._path, size)
+        start = len(FILE_MAGIC) if len(offsets) == 0 else int(offsets[-1])
+        scanned_offsets, self._end = scan_frames(self._view, start)
+        self._offsets = np.concatenate((offsets[:-1],
+                                        np.array(scanned_offsets, dtype=INDEX_DTYPE)))
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __enter__(self) -> 'RecordingReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_frame(self, index: int) -> Tuple[memoryview, int]:
+        """ Get the serialized object of a frame without decoding it
+
+        Returns
+        -------
+        memoryview: the bytes of the serialized object, without the frame header
+        int: the frame flags
+        """
+        if self._view is None:
+            raise ValueError('I/O operation on closed recording')
+        offset = int(self._offsets[index])
+        length, flags, remaining_bytes = utils.get_frame_header_from_bytes(self._view[offset:])
+        return remaining_bytes[:length], flags
+
+    def get_frame_segment(self, index: int) -> utils.FileSegment:
+        """ Get the region of the data file holding a frame, header included, for instance to
+        replay it through a Socket with check_sended_segments, without reading it into memory"""
+        start = int(self._offsets[index])
+        index = index % len(self._offsets)
+        end = int(self._offsets[index + 1]) if index + 1 < len(self._offsets) else self._end
+        return utils.FileSegment(self._path, start, end - start)
+
+    def __getitem__(self, index: int) -> SERIALIZABLE:
+        """ Decode the object of the frame at index, negative indexes counting from the end
+
+        Raises
+        ------
+        ValueError: if the frame is a batch of objects, see get_objects
+        """
+        bytes_str, flags = self.get_frame(index)
+        if flags & utils.FRAME_FLAG_BATCH:
+            raise ValueError(f'The frame {index} is a batch of objects, use get_objects')
+        return ser_factory.get_apply_deserializer(bytes_str, flags=flags)
+
+    def get_objects(self, index: int) -> List[SERIALIZABLE]:
+        """ Decode the objects of the frame at index: all the objects of a batch frame, for
+        instance sent by a BatchSender, or a list of the single object of any other frame"""
+        bytes_str, flags = self.get_frame(index)
+        return ser_factory.get_apply_batch_deserializer(bytes_str, flags=flags)
+
+    def __iter__(self) -> Iterator[SERIALIZABLE]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def iter_objects(self) -> Iterator[SERIALIZABLE]:
+        """ Iterate over the objects of all the frames, those of batch frames one by one"""
+        for index in range(len(self)):
+            yield from self.get_objects(index)
+
+    def _release(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:  # decoded arrays still refer to the mapping, it is unmapped
+                pass             # when they are garbage collected
+            self._mmap = None
+
+    def close(self):
+        self._release()
+        self._offsets = np.zeros((0,), dtype=INDEX_DTYPE)
@@ -7,7 +7,8 @@ Created the 20/10/2023
 from base64 import b64encode, b64decode
 from enum import Enum
 import numbers
-from typing import Optional, Tuple, List, Union, TYPE_CHECKING, Any
+import struct
+from typing import Dict, Optional, Tuple, List, Union, TYPE_CHECKING, Any
 
 import numpy as np
 
@@ -31,14 +32,17 @@ class StringSerializeDeserialize(SerializableBase):
         -------
         bytes: the total bytes message to serialize the string
         """
-        bytes_string = b''
-        cmd_bytes, cmd_length_bytes = utils.str_len_to_bytes(string)
-        bytes_string += cmd_length_bytes
-        bytes_string += cmd_bytes
-        return bytes_string
+        writer = utils.BytesWriter()
+        StringSerializeDeserialize.write(string, writer)
+        return writer.to_bytes()
 
     @staticmethod
-    def deserialize(bytes_str) -> Tuple[str, bytes]:
+    def write(string: str, writer: utils.BytesWriter):
+        """ Write a string and its length into a BytesWriter"""
+        writer.write_string(string)
+
+    @staticmethod
+    def deserialize(bytes_str: utils.BytesLike) -> Tuple[str, utils.BytesLike]:
         """Convert bytes into a str object
 
         Convert first the fourth first bytes into an int encoding the length of the string to decode
@@ -57,19 +61,50 @@ class StringSerializeDeserialize(SerializableBase):
 class BytesSerializeDeserialize(SerializableBase):
     @staticmethod
     def serialize(some_bytes: bytes) -> bytes:
-        bytes_string = b''
-        bytes_string += utils.int_to_bytes(len(some_bytes))
-        bytes_string += some_bytes
-        return bytes_string
+        writer = utils.BytesWriter()
+        BytesSerializeDeserialize.write(some_bytes, writer)
+        return writer.to_bytes()
+
+    @staticmethod
+    def write(some_bytes: bytes, writer: utils.BytesWriter):
+        """ Write a bytes string and its length into a BytesWriter"""
+        writer.write_int(len(some_bytes))
+        writer.write_payload(some_bytes)
 
     @staticmethod
-    def deserialize(bytes_str: bytes) -> Tuple[bytes, bytes]:
+    def deserialize(bytes_str: utils.BytesLike) -> Tuple[bytes, utils.BytesLike]:
         bytes_len, remaining_bytes = utils.get_int_from_bytes(bytes_str)
         bytes_str, remaining_bytes = utils.split_nbytes(remaining_bytes, bytes_len)
-        return bytes_str, remaining_bytes
+        return bytes(bytes_str), remaining_bytes
+
+
+def _get_scalar_structs() -> Tuple[Dict[str, struct.Struct], Dict[type, Tuple[str, struct.Struct]]]:
+    """ Get the precompiled structs used to pack and unpack python scalars
+
+    Returns
+    -------
+    dict: numpy data type string -> struct.Struct to unpack a scalar of this data type
+    dict: python scalar type -> (numpy data type string, struct.Struct) to pack such a scalar with
+        the same data type numpy would use
+    """
+    unpackers = {'|b1': struct.Struct('?')}
+    for byte_order in '<>':
+        for data_type, struct_format in (('i4', 'i'), ('i8', 'q'), ('f4', 'f'), ('f8', 'd'),
+                                         ('c8', 'ff'), ('c16', 'dd')):
+            unpackers[byte_order + data_type] = struct.Struct(byte_order + struct_format)
+
+    packers = {}
+    for scalar_type in (bool, int, float, complex):
+        data_type = np.array([scalar_type()]).dtype.descr[0][1]
+        if data_type in unpackers:
+            packers[scalar_type] = (data_type, unpackers[data_type])
+    return unpackers, packers
 
 
 class ScalarSerializeDeserialize(SerializableBase):
+    # fast path for python scalars, producing the same bytes as the numpy conversion
+    _unpackers, _packers = _get_scalar_structs()
+
     @staticmethod
     def serialize(scalar: complex) -> bytes:
         """ Convert a scalar into a bytes message together with the info to convert it back
@@ -82,21 +117,42 @@ class ScalarSerializeDeserialize(SerializableBase):
         -------
         bytes: the total bytes message to serialize the scalar
         """
-        if not isinstance(scalar, numbers.Number):
-            # type hint is complex, instance comparison Number
-            raise TypeError(f'{scalar} should be an integer or a float, not a {type(scalar)}')
-        scalar_array = np.array([scalar])
-        data_type = scalar_array.dtype.descr[0][1]
-        data_bytes = scalar_array.tobytes()
-
-        bytes_string = b''
-        bytes_string += StringSerializeDeserialize.serialize(data_type)
-        bytes_string += utils.int_to_bytes(len(data_bytes))
-        bytes_string += data_bytes
-        return bytes_string
+        writer = utils.BytesWriter()
+        ScalarSerializeDeserialize.write(scalar, writer)
+        return writer.to_bytes()
+
+    @staticmethod
+    def write(scalar: complex, writer: utils.BytesWriter):
+        """ Write a scalar, its data type and length into a BytesWriter
+
+        Python bool, int, float and complex are packed using precompiled structs, other numbers
+        (numpy scalars, integers too large for the platform integer...) are converted using numpy
+        """
+        data_bytes = None
+        packer = ScalarSerializeDeserialize._packers.get(type(scalar), None)
+        if packer is not None:
+            data_type, scalar_struct = packer
+            try:
+                if data_type[1] == 'c':
+                    data_bytes = scalar_struct.pack(scalar.real, scalar.imag)
+                else:
+                    data_bytes = scalar_struct.pack(scalar)
+            except struct.error:
+                pass
+        if data_bytes is None:
+            if not isinstance(scalar, numbers.Number):
+                # type hint is complex, instance comparison Number
+                raise TypeError(f'{scalar} should be an integer or a float, not a {type(scalar)}')
+            scalar_array = np.array([scalar])
+            data_type = scalar_array.dtype.descr[0][1]
+            data_bytes = scalar_array.tobytes()
+
+        writer.write_tag(data_type)
+        writer.write_int(len(data_bytes))
+        writer.write(data_bytes)
 
     @staticmethod
-    def deserialize(bytes_str: bytes) -> Tuple[complex, bytes]:
+    def deserialize(bytes_str: utils.BytesLike) -> Tuple[complex, utils.BytesLike]:
         """Convert bytes into a python object of type (float, int, complex or boolean)
 
         Get first the data type from a string deserialization, then the data length and finally convert this
@@ -107,9 +163,16 @@ class ScalarSerializeDeserialize(SerializableBase):
         numbers.Number: the decoded number
         bytes: the remaining bytes string if any
         """
-        data_type, remaining_bytes = StringSerializeDeserialize.deserialize(bytes_str)
+        data_type, remaining_bytes = utils.get_tag_from_bytes(bytes_str)
         data_len, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
         number_bytes, remaining_bytes = utils.split_nbytes(remaining_bytes, data_len)
+        unpacker = ScalarSerializeDeserialize._unpackers.get(data_type, None)
+        if unpacker is not None and unpacker.size == data_len:
+            values = unpacker.unpack(number_bytes)
+            if len(values) == 2:
+                return complex(*values), remaining_bytes
+            return values[0], remaining_bytes
+
         number = np.frombuffer(number_bytes, dtype=data_type)[0]
         if 'f' in data_type:
             number = float(number)  # because one get numpy float type
@@ -123,6 +186,8 @@ class ScalarSerializeDeserialize(SerializableBase):
 
 
 class NdArraySerializeDeserialize(SerializableBase):
+    # separates the data type from the options describing how the array payload is encoded
+    OPTIONS_SEPARATOR = ';'
 
     @staticmethod
     def serialize(array: np.ndarray) -> bytes:
@@ -149,35 +214,106 @@ class NdArraySerializeDeserialize(SerializableBase):
         * serialize data shape length
         * serialize all values of the shape as integers converted to bytes
         * serialize array as bytes
+
+        The data type string may be followed by options, each one preceded by the
+        OPTIONS_SEPARATOR:
+
+        * F: the array bytes are in Fortran order
+        * the name of the codec used to compress the array bytes (the data length is then the
+          compressed length)
+        * shm: the array bytes are in a shared memory segment whose name is sent instead (the
+          data length is then the length of the name)
+        * blocks: the array bytes are split into blocks, optionally compressed and checksummed,
+          preceded by a block table, see utils.encode_blocks
+        """
+        writer = utils.BytesWriter()
+        NdArraySerializeDeserialize.write(array, writer)
+        return writer.to_bytes()
+
+    @staticmethod
+    def write(array: np.ndarray, writer: utils.BytesWriter):
+        """ Write a ndarray and the info to convert it back into a BytesWriter
+
+        The array buffer itself is given to the writer without copy if the array is C-contiguous,
+        or Fortran-contiguous (then flagged with the F option) if the writer has the fortran_order
+        option, otherwise it is copied once into a C-contiguous array
+
+        If the writer has a codec, arrays larger than its codec_threshold are compressed, unless
+        compression does not reduce their size
+
+        If the writer has a block_size, larger arrays to be compressed or checksummed are split
+        into blocks processed on a thread pool, see utils.encode_blocks
+
+        If the writer has the file_segments option, the bytes of memory-mapped arrays are written
+        as a utils.FileSegment, sent from the file without being read into memory
+
+        If the writer has a shared_memory_threshold, larger arrays are copied into a shared memory
+        segment owned by the receiver: such messages have to be deserialized exactly once, on the
+        same host, otherwise the segment is leaked (see utils.share_bytes)
         """
         if not isinstance(array, np.ndarray):
             raise TypeError(f'{array} should be an numpy array, not a {type(array)}')
         array_type = array.dtype.descr[0][1]
         array_shape = array.shape
 
-        array = array.reshape(array.size)
-        array_bytes = array.tobytes()
-        bytes_string = b''
-        bytes_string += StringSerializeDeserialize.serialize(array_type)
-        bytes_string += utils.int_to_bytes(len(array_bytes))
-        bytes_string += utils.int_to_bytes(len(array_shape))
+        if array.flags.c_contiguous:
+            sent_array = array
+        elif array.flags.f_contiguous and writer.fortran_order:
+            array_type += NdArraySerializeDeserialize.OPTIONS_SEPARATOR + 'F'
+            sent_array = array.T
+        else:
+            sent_array = np.ascontiguousarray(array)
+        array_bytes = memoryview(sent_array.reshape(array.size)).cast('B')
+        if writer.use_shared_memory(array.nbytes):
+            array_type += NdArraySerializeDeserialize.OPTIONS_SEPARATOR + 'shm'
+            array_bytes = utils.str_to_bytes(utils.share_bytes(array_bytes))
+        elif writer.use_blocks(array.nbytes):
+            array_type += NdArraySerializeDeserialize.OPTIONS_SEPARATOR + 'blocks'
+            codec = writer.codec if array.nbytes >= writer.codec_threshold else None
+            array_bytes = utils.encode_blocks(array_bytes, writer.block_size, codec,
+                                              writer.checksum)
+        elif writer.codec is not None and array.nbytes >= writer.codec_threshold:
+            compressed_bytes = utils.CODECS[writer.codec][0](array_bytes)
+            if len(compressed_bytes) < array.nbytes:
+                array_type += NdArraySerializeDeserialize.OPTIONS_SEPARATOR + writer.codec
+                array_bytes = compressed_bytes
+        if writer.file_segments and array_bytes.__class__ is memoryview:
+            file_span = utils.get_file_span(sent_array)
+            if file_span is not None:
+                array_bytes = utils.FileSegment(file_span[0], file_span[1], array.nbytes)
+        blocks = array_bytes if isinstance(array_bytes, list) else [array_bytes]
+        writer.write_tag(array_type)
+        writer.write_int(sum(len(block) for block in blocks))
+        writer.write_int(len(array_shape))
         for shape_elt in array_shape:
-            bytes_string += utils.int_to_bytes(shape_elt)
-        bytes_string += array_bytes
-        return bytes_string
+            writer.write_int(shape_elt)
+        for block in blocks:
+            writer.write_payload(block)
 
     @staticmethod
-    def deserialize(bytes_str: bytes) -> Tuple[np.ndarray, bytes]:
+    def deserialize(bytes_str: utils.BytesLike) -> Tuple[np.ndarray, memoryview]:
         """Convert bytes into a numpy ndarray object
 
         Convert the first bytes into a ndarray reading first information about the array's data
 
         Returns
         -------
-        ndarray: the decoded numpy array
-        bytes: the remaining bytes string if any
+        ndarray: the decoded numpy array, a read-only view on the received bytes if these were
+            immutable
+        memoryview: a view on the remaining bytes string if any
+
+        Notes
+        -----
+        No copy of the array payload is done, the array is built directly on the underlying buffer,
+        unless the payload has been compressed. Arrays sent in Fortran order are decoded as
+        Fortran-contiguous arrays. Arrays sent through shared memory are views on the attached
+        segment which is released when the array is garbage collected
+
+        Within the utils.output_arrays context, the array is copied into the provided output
+        array, if any, instead
         """
-        ndarray_type, remaining_bytes = StringSerializeDeserialize.deserialize(bytes_str)
+        ndarray_type, remaining_bytes = utils.get_tag_from_bytes(memoryview(bytes_str))
+        ndarray_type, *options = ndarray_type.split(NdArraySerializeDeserialize.OPTIONS_SEPARATOR)
         ndarray_len, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
         shape_len, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
         shape = []
@@ -186,21 +322,55 @@ class NdArraySerializeDeserialize(SerializableBase):
             shape.append(shape_elt)
 
         ndarray_bytes, remaining_bytes = utils.split_nbytes(remaining_bytes, ndarray_len)
-        ndarray = np.frombuffer(ndarray_bytes, dtype=ndarray_type)
-        ndarray = ndarray.reshape(tuple(shape))
+        order = 'C'
+        segment = None
+        for option in options:
+            if option == 'F':
+                order = 'F'
+            elif option in utils.CODECS:
+                ndarray_bytes = utils.CODECS[option][1](ndarray_bytes)
+            elif option == 'blocks':
+                ndarray_bytes = utils.decode_blocks(ndarray_bytes)
+            elif option == 'shm':
+                segment = utils.attach_shared_bytes(utils.bytes_to_string(ndarray_bytes))
+                ndarray_bytes = segment.buf
+            else:
+                raise ValueError(f'Unknown ndarray option: {option}')
+        if segment is None:
+            ndarray = np.frombuffer(ndarray_bytes, dtype=ndarray_type)
+        else:
+            # the segment may be larger than requested as its size is rounded to pages
+            ndarray = np.frombuffer(ndarray_bytes, dtype=ndarray_type,
+                                    count=int(np.prod(shape, dtype=np.int64)))
+            utils.close_shared_bytes_with(segment, ndarray.base)
+        ndarray = ndarray.reshape(tuple(shape), order=order)
         ndarray = np.atleast_1d(ndarray)  # remove singleton dimensions
+        out = utils.get_output_array(ndarray.dtype, ndarray.shape, order)
+        if out is not None:
+            np.copyto(out, ndarray)
+            ndarray = out
         return ndarray, remaining_bytes
 
 
 class ListSerializeDeserialize(SerializableBase):
+    # string written in place of the first element type to announce a packed homogeneous list.
+    # It cannot be the name of a registered class
+    PACKED_TAG = '<packed>'
+    # lists shorter than this are always written element by element
+    PACKED_MIN_LENGTH = 8
+    # numpy data type kinds a packed list of each scalar type may use, see _pack
+    PACKED_KINDS = {bool: 'b', int: 'iu', float: 'f', complex: 'c'}
+
     @staticmethod
-    def serialize(list_object: List) -> bytes:
+    def serialize(list_object: List, pack_lists: bool = False) -> bytes:
         """ Convert a list of objects into a bytes message together with the info to convert it back
 
         Parameters
         ----------
         list_object: list
             the list could contain whatever objects are registered in the SerializableFactory
+        pack_lists: bool
+            if True, homogeneous lists are packed, see utils.BytesWriter
 
         Returns
         -------
@@ -214,18 +384,70 @@ class ListSerializeDeserialize(SerializableBase):
 
         Then for each object:
         * use the serialization method adapted to each object in the list
+
+        If pack_lists is True and all objects are of the same scalar type (bool, int, float or
+        complex) or are str or bytes with the same length in bytes, the list is packed as a single
+        block:
+        * the PACKED_TAG string
+        * the type name of the elements as a string
+        * the numpy data type of the block as a string
+        * the block as a bytes string
         """
+        writer = utils.BytesWriter(pack_lists=pack_lists)
+        ListSerializeDeserialize.write(list_object, writer)
+        return writer.to_bytes()
+
+    @staticmethod
+    def write(list_object: List, writer: utils.BytesWriter):
+        """ Write the list length then each of its objects together with their type into a
+        BytesWriter"""
         if not isinstance(list_object, list):
             raise TypeError(f'{list_object} should be a list, not a {type(list_object)}')
 
-        bytes_string = b''
-        bytes_string += utils.int_to_bytes(len(list_object))
-        for obj in list_object:
-            bytes_string += ser_factory.get_apply_serializer(obj)
-        return bytes_string
+        writer.write_int(len(list_object))
+        packed = ListSerializeDeserialize._pack(list_object) if writer.pack_lists else None
+        if packed is not None:
+            obj_type_str, data_type, data = packed
+            writer.write_tag(ListSerializeDeserialize.PACKED_TAG)
+            writer.write_tag(obj_type_str)
+            writer.write_tag(data_type)
+            writer.write_int(len(data))
+            writer.write_payload(data)
+        else:
+            for obj in list_object:
+                ser_factory.get_apply_writer(obj, writer)
 
     @staticmethod
-    def deserialize(bytes_str: bytes) -> Tuple[List[Any], bytes]:
+    def _pack(list_object: List) -> Optional[Tuple[str, str, memoryview]]:
+        """ Get the elements type name, the numpy data type and the packed bytes of an homogeneous
+        list or None if the list cannot be packed"""
+        if len(list_object) < ListSerializeDeserialize.PACKED_MIN_LENGTH:
+            return None
+        obj_type = type(list_object[0])
+        if obj_type not in (bool, int, float, complex, str, bytes):
+            return None
+        if not all(type(obj) is obj_type for obj in list_object):
+            return None
+
+        if obj_type is str or obj_type is bytes:
+            if obj_type is str:
+                list_object = [obj.encode() for obj in list_object]
+            item_size = len(list_object[0])
+            if item_size == 0 or not all(len(obj) == item_size for obj in list_object):
+                return None
+            return obj_type.__name__, f'V{item_size}', memoryview(b''.join(list_object))
+
+        try:
+            array = np.array(list_object)
+        except OverflowError:
+            return None
+        # python ints too large for a numpy integer are promoted to float or object
+        if array.dtype.kind not in ListSerializeDeserialize.PACKED_KINDS[obj_type]:
+            return None
+        return obj_type.__name__, array.dtype.descr[0][1], memoryview(array).cast('B')
+
+    @staticmethod
+    def deserialize(bytes_str: utils.BytesLike) -> Tuple[List[Any], memoryview]:
         """Convert bytes into a list of objects
 
         Convert the first bytes into a list reading first information about the list elt types, length ...
@@ -233,10 +455,21 @@ class ListSerializeDeserialize(SerializableBase):
         Returns
         -------
         list: the decoded list
-        bytes: the remaining bytes string if any
+        memoryview: a view on the remaining bytes string if any
+
+        Notes
+        -----
+        Elements are read one after the other from a memoryview on bytes_str, so that decoding
+        the list is linear in the message size
         """
         list_obj = []
-        list_len, remaining_bytes = utils.get_int_from_bytes(bytes_str)
+        list_len, remaining_bytes = utils.get_int_from_bytes(memoryview(bytes_str))
+        if list_len == 0:
+            return list_obj, remaining_bytes
+
+        tag, packed_bytes = utils.get_tag_from_bytes(remaining_bytes)
+        if tag == ListSerializeDeserialize.PACKED_TAG:
+            return ListSerializeDeserialize._unpack(packed_bytes)
 
         for ind in range(list_len):
             obj, remaining_bytes = ser_factory.get_apply_deserializer(remaining_bytes,
@@ -244,26 +477,46 @@ class ListSerializeDeserialize(SerializableBase):
             list_obj.append(obj)
         return list_obj, remaining_bytes
 
+    @staticmethod
+    def _unpack(bytes_str: memoryview) -> Tuple[List[Any], memoryview]:
+        """ Convert a packed block of homogeneous objects into a list, see _pack"""
+        obj_type_str, remaining_bytes = utils.get_tag_from_bytes(bytes_str)
+        data_type, remaining_bytes = utils.get_tag_from_bytes(remaining_bytes)
+        data_len, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+        data, remaining_bytes = utils.split_nbytes(remaining_bytes, data_len)
+        list_obj = np.frombuffer(data, dtype=data_type).tolist()
+        if obj_type_str == 'str':
+            list_obj = [utils.bytes_to_string(obj) for obj in list_obj]
+        return list_obj, remaining_bytes
+
 
 ser_factory.register_from_type(bytes,
                                        BytesSerializeDeserialize.serialize,
-                                       BytesSerializeDeserialize.deserialize)
+                                       BytesSerializeDeserialize.deserialize,
+                                       BytesSerializeDeserialize.write)
 ser_factory.register_from_type(str, StringSerializeDeserialize.serialize,
-                                       StringSerializeDeserialize.deserialize)
+                                       StringSerializeDeserialize.deserialize,
+                                       StringSerializeDeserialize.write)
 ser_factory.register_from_type(int, ScalarSerializeDeserialize.serialize,
-                                       ScalarSerializeDeserialize.deserialize)
+                                       ScalarSerializeDeserialize.deserialize,
+                                       ScalarSerializeDeserialize.write)
 ser_factory.register_from_type(float, ScalarSerializeDeserialize.serialize,
-                                       ScalarSerializeDeserialize.deserialize)
+                                       ScalarSerializeDeserialize.deserialize,
+                                       ScalarSerializeDeserialize.write)
 ser_factory.register_from_obj(1 + 1j, ScalarSerializeDeserialize.serialize,
-                                      ScalarSerializeDeserialize.deserialize)
+                                      ScalarSerializeDeserialize.deserialize,
+                                      ScalarSerializeDeserialize.write)
 ser_factory.register_from_type(bool, ScalarSerializeDeserialize.serialize,
-                                       ScalarSerializeDeserialize.deserialize)
+                                       ScalarSerializeDeserialize.deserialize,
+                                       ScalarSerializeDeserialize.write)
 ser_factory.register_from_obj(np.array([0, 1]),
                                       NdArraySerializeDeserialize.serialize,
-                                      NdArraySerializeDeserialize.deserialize)
+                                      NdArraySerializeDeserialize.deserialize,
+                                      NdArraySerializeDeserialize.write)
 ser_factory.register_from_type(list,
                                        ListSerializeDeserialize.serialize,
-                                       ListSerializeDeserialize.deserialize)
+                                       ListSerializeDeserialize.deserialize,
+                                       ListSerializeDeserialize.write)
 
 
 class SerializableTypes(Enum):
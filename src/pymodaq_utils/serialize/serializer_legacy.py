@@ -250,7 +250,7 @@ class DeSerializer:
         self._bytes_string = bytes_string
 
     def get_message_length(self) -> int:
-        return utils.bytes_to_int(self._bytes_string.check_received_length(4))
+        return utils.read_frame_header(self._bytes_string.check_received_length)[0]
 
     @classmethod
     def from_b64_string(cls, b64_string: Union[bytes, str]) -> "DeSerializer":
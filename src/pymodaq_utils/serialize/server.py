@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Single-threaded server handling many clients exchanging framed serialized messages
+
+A SocketServer accepts connections on a listening socket and services all of them from one
+selectors-based loop, without a thread per client: each connection reads into its own
+StreamDeserializer and writes from its own queue of pending bytes, so that a slow client never
+blocks the others.
+
+Examples
+--------
+>>> def on_message(connection, obj):
+...     connection.send(['echo', obj])
+>>> server = SocketServer(('localhost', 0), on_message=on_message)
+>>> thread = threading.Thread(target=server.serve_forever)
+>>> thread.start()
+>>> server.broadcast('to every client')
+>>> server.stop()
+>>> thread.join()
+>>> server.close()
+"""
+from collections import deque
+import selectors
+import socket
+import threading
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from pymodaq_utils.logger import set_logger, get_module_name
+from . import utils
+from .factory import SerializableFactory, SERIALIZABLE
+from .mysocket import Socket, IOV_MAX
+from .stream import FramingError, StreamDeserializer
+
+logger = set_logger(get_module_name(__file__))
+
+ser_factory = SerializableFactory()
+
+RECEIVE_SIZE = 2**16
+MAX_PENDING = 2**26
+
+
+class ServerConnection:
+    """ A client connected to a SocketServer
+
+    Attributes
+    ----------
+    socket: Socket
+        the non-blocking connection socket
+    address: tuple
+        the address of the client as returned by accept
+    received: deque
+        the objects received from the client, when the server has no on_message callback
+    """
+
+    def __init__(self, server: 'SocketServer', sock: Socket, address: Tuple):
+        self._server = server
+        self.socket = sock
+        self.address = address
+        self.received: Deque[SERIALIZABLE] = deque()
+        self._deserializer = StreamDeserializer()
+        self._pending: Deque[memoryview] = deque()
+        self._npending = 0
+        self._closed = False
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.address})'
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def pending_bytes(self) -> int:
+        """int: the number of bytes queued but not yet sent to the client"""
+        return self._npending
+
+    def send(self, obj: SERIALIZABLE):
+        """ Queue an object for sending, see SocketServer.send"""
+        self._server.send(self, obj)
+
+    def close(self):
+        """ Close the connection, see SocketServer.disconnect"""
+        self._server.disconnect(self)
+
+
+class SocketServer:
+    """ Server of many clients exchanging framed serialized messages from a single loop
+
+    Messages are framed as sent by Socket.check_sended_with_serializer. Batch frames and header
+    templates from the clients are supported, see StreamDeserializer. Objects sent to the clients
+    are serialized with the codec, codec_threshold, compact_tags, pack_lists and fortran_order
+    options, with the same meaning as for Socket.
+
+    send, broadcast, disconnect and stop can be called from any thread: they only queue bytes and
+    wake the loop up, the sockets are written to by the thread running the loop.
+
+    A message that cannot be decoded is logged and skipped, a client is only disconnected if its
+    stream cannot be decoded anymore, see StreamDeserializer. Errors raised by the callbacks are
+    logged without affecting the other clients.
+
+    Parameters
+    ----------
+    address: tuple
+        the (host, port) to listen on, port 0 picking a free port, see the address property
+    on_message: Callable or None
+        called as on_message(connection, obj) for each object received. If None, the objects are
+        appended to the received deque of their connection
+    on_connect: Callable or None
+        called as on_connect(connection) when a client connects
+    on_disconnect: Callable or None
+        called as on_disconnect(connection) when a connection is closed
+    max_pending: int or None
+        the number of bytes that may be queued for a client before it is considered too slow and
+        disconnected. If None, the queue is not limited
+    backlog: int
+        the number of unaccepted connections the system allows before refusing new ones
+
+    See Also
+    --------
+    :class:`ServerConnection`, :class:`~pymodaq_utils.serialize.mysocket.Socket`
+    """
+    codec: Optional[str] = None
+    codec_threshold: int = utils.CODEC_THRESHOLD
+    compact_tags: bool = False
+    pack_lists: bool = False
+    fortran_order: bool = False
+
+    def __init__(self, address: Tuple[str, int] = ('', 0),
+                 on_message: Optional[Callable[[ServerConnection, SERIALIZABLE], Any]] = None,
+                 on_connect: Optional[Callable[[ServerConnection], Any]] = None,
+                 on_disconnect: Optional[Callable[[ServerConnection], Any]] = None,
+                 max_pending: Optional[int] = MAX_PENDING, backlog: int = 128):
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.max_pending = max_pending
+
+        self._lock = threading.RLock()
+        self._selector = selectors.DefaultSelector()
+        self._connections: List[ServerConnection] = []
+        self._to_update: List[ServerConnection] = []
+        self._running = False
+        self._receive_buffer = bytearray(RECEIVE_SIZE)
+
+        self._listener = Socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        self._listener.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen(backlog)
+        self._listener.socket.setblocking(False)
+        self._selector.register(self._listener.socket, selectors.EVENT_READ, None)
+
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+        self._selector.register(self._wakeup_receiver, selectors.EVENT_READ, None)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """tuple: the address the server listens on"""
+        return self._listener.getsockname()
+
+    @property
+    def connections(self) -> List[ServerConnection]:
+        """list: a copy of the list of the connected clients"""
+        with self._lock:
+            return list(self._connections)
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def __enter__(self) -> 'SocketServer':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_bytes_writer(self) -> utils.BytesWriter:
+        return utils.BytesWriter(codec=self.codec, codec_threshold=self.codec_threshold,
+                                 compact_tags=self.compact_tags, pack_lists=self.pack_lists,
+                                 fortran_order=self.fortran_order)
+
+    def serialize(self, obj: SERIALIZABLE) -> memoryview:
+        """ Get the frame, header included, holding a serialized object"""
+        return memoryview(ser_factory.get_apply_writer(obj, self.get_bytes_writer(),
+                                                       append_length=True).to_bytes())
+
+    def send(self, connection: ServerConnection, obj: SERIALIZABLE):
+        """ Queue an object for sending to a client"""
+        self._queue(connection, self.serialize(obj))
+        self._wakeup()
+
+    def broadcast(self, obj: SERIALIZABLE, exclude: Optional[ServerConnection] = None):
+        """ Queue an object for sending to all the clients, serializing it only once
+
+        Parameters
+        ----------
+        obj: object
+            a serializable object
+        exclude: ServerConnection or None
+            a client not to send the object to, for instance the one it comes from
+        """
+        frame = self.serialize(obj)
+        for connection in self.connections:
+            if connection is not exclude:
+                self._queue(connection, frame)
+        self._wakeup()
+
+    def _queue(self, connection: ServerConnection, frame: memoryview):
+        with self._lock:
+            if connection.closed:
+                return
+            if (self.max_pending is not None and
+                    connection.pending_bytes + len(frame) > self.max_pending):
+                logger.warning(f'Disconnecting {connection}: {connection.pending_bytes} bytes '
+                               f'are still waiting to be sent')
+                self._to_update.append(connection)
+                connection._closed = True
+                return
+            if connection.pending_bytes == 0:
+                self._to_update.append(connection)
+            connection._pending.append(frame)
+            connection._npending += len(frame)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_sender.send(b'\x00')
+        except (BlockingIOError, OSError):  # already woken up or closed
+            pass
+
+    def disconnect(self, connection: ServerConnection):
+        """ Close a client connection once the loop processes it, discarding the bytes not yet
+        sent"""
+        with self._lock:
+            if not connection.closed:
+                connection._closed = True
+                self._to_update.append(connection)
+        self._wakeup()
+
+    def stop(self):
+        """ Make serve_forever return"""
+        self._running = False
+        self._wakeup()
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        """ Service the connections until stop is called"""
+        self._running = True
+        while self._running:
+            self.serve_once(poll_interval)
+
+    def serve_once(self, timeout: Optional[float] = None):
+        """ Wait for events on the sockets at most timeout seconds and process them: accept the new
+        clients, receive and dispatch the complete messages and send the queued bytes"""
+        self._update()
+        for key, events in self._selector.select(timeout):
+            if key.fileobj is self._listener.socket:
+                self._accept()
+            elif key.fileobj is self._wakeup_receiver:
+                try:
+                    while self._wakeup_receiver.recv(RECEIVE_SIZE):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                connection: ServerConnection = key.data
+                if events & selectors.EVENT_READ and not connection.closed:
+                    self._receive(connection)
+                if events & selectors.EVENT_WRITE and not connection.closed:
+                    self._send_pending(connection)
+        self._update()
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.socket.setblocking(False)
+        connection = ServerConnection(self, sock, address)
+        with self._lock:
+            self._connections.append(connection)
+        self._selector.register(sock.socket, selectors.EVENT_READ, connection)
+        if self.on_connect is not None:
+            self._call(self.on_connect, connection)
+
+    @staticmethod
+    def _call(callback: Callable, connection: ServerConnection, *args):
+        """ Call a user callback, logging its errors so that they only affect their connection"""
+        try:
+            callback(connection, *args)
+        except Exception as e:
+            logger.exception(f'Error in {callback} for {connection}: {e}')
+
+    def _receive(self, connection: ServerConnection):
+        try:
+            nbytes = connection.socket.recv_into(self._receive_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.warning(f'Disconnecting {connection}: {e}')
+            nbytes = 0
+        if nbytes == 0:
+            self._close(connection)
+            return
+        invalid_stream = False
+        try:
+            objs = connection._deserializer.feed(memoryview(self._receive_buffer)[:nbytes])
+        except FramingError as e:  # the stream cannot be resynchronized
+            logger.warning(f'Disconnecting {connection}: {e}')
+            objs = connection._deserializer.feed(b'')
+            invalid_stream = True
+        except Exception as e:
+            logger.warning(f'Skipping an invalid message from {connection}: {e}')
+            objs = connection._deserializer.feed(b'')
+        for obj in objs:
+            if self.on_message is None:
+                connection.received.append(obj)
+            else:
+                self._call(self.on_message, connection, obj)
+        if invalid_stream:
+            self._close(connection)
+
+    def _send_pending(self, connection: ServerConnection):
+        with self._lock:
+            views = list(connection._pending)[:IOV_MAX]
+        try:
+            if hasattr(connection.socket.socket, 'sendmsg'):
+                sended = connection.socket.socket.sendmsg(views)
+            else:
+                sended = connection.socket.send(views[0])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.warning(f'Disconnecting {connection}: {e}')
+            self._close(connection)
+            return
+        with self._lock:
+            connection._npending -= sended
+            while sended > 0 and connection._pending:
+                view = connection._pending[0]
+                if sended >= len(view):
+                    connection._pending.popleft()
+                    sended -= len(view)
+                else:
+                    connection._pending[0] = view[sended:]
+                    sended = 0
+            if connection.pending_bytes == 0:
+                self._to_update.append(connection)
+
+    def _update(self):
+        """ Apply the changes of the connections requested since the last call, from the thread
+        running the loop"""
+        with self._lock:
+            to_update, self._to_update = self._to_update, []
+        for connection in to_update:
+            if connection.closed:
+                self._close(connection)
+            elif connection in self._connections:
+                events = selectors.EVENT_READ
+                if connection.pending_bytes != 0:
+                    events |= selectors.EVENT_WRITE
+                self._selector.modify(connection.socket.socket, events, connection)
+
+    def _close(self, connection: ServerConnection):
+        with self._lock:
+            connection._closed = True
+            if connection not in self._connections:
+                return
+            self._connections.remove(connection)
+            connection._pending.clear()
+            connection._npending = 0
+        self._selector.unregister(connection.socket.socket)
+        connection.socket.close()
+        if self.on_disconnect is not None:
+            self._call(self.on_disconnect, connection)
+
+    def close(self):
+        """ Close all the connections and the listening socket"""
+        self._running = False
+        for connection in self.connections:
+            self._close(connection)
+        self._selector.close()
+        self._listener.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
@@ -0,0 +1,130 @@
+from typing import List, Optional
+
+from . import utils
+from .factory import SerializableFactory, SERIALIZABLE
+from .template import TemplateDecoder, TEMPLATE_FLAGS
+
+ser_factory = SerializableFactory()
+
+
+class FramingError(ValueError):
+    """ Raised by StreamDeserializer.feed when a frame header is invalid: the following frames
+    cannot be found anymore in the stream"""
+    pass
+
+
+class StreamDeserializer:
+    """ Incremental deserializer of a stream of framed messages
+
+    Messages are expected to be framed as done by the method
+    :meth:`SerializableFactory.get_apply_serializer` with append_length=True, that is a frame
+    header holding the message length followed by the serialized object. Arbitrary chunks of the
+    stream are given to the feed method that returns the objects whose frames are complete, so that
+    a single event loop can service many non-blocking connections. The objects of batch frames
+    (see SerializableFactory.get_apply_batch_writer) are returned individually and frames using
+    header templates (see serialize.template) are supported.
+
+    Examples
+    --------
+    >>> stream_deserializer = StreamDeserializer()
+    >>> bytes_str = ser_factory.get_apply_serializer('hello', append_length=True)
+    >>> stream_deserializer.feed(bytes_str[:5])
+    []
+    >>> stream_deserializer.feed(bytes_str[5:])
+    ['hello']
+    """
+
+    def __init__(self):
+        self._header = bytearray()
+        self._payload: Optional[bytearray] = None
+        self._position = 0
+        self._flags = 0
+        self._template_decoder = TemplateDecoder()
+        self._objects: List[SERIALIZABLE] = []
+
+    @property
+    def pending(self) -> bool:
+        """bool: True if a frame has been partially received"""
+        return len(self._header) != 0 or self._payload is not None
+
+    def feed(self, chunk: utils.BytesLike) -> List[SERIALIZABLE]:
+        """ Process a chunk of the stream
+
+        Parameters
+        ----------
+        chunk: bytes, bytearray or memoryview
+            the next bytes received from the stream, of any length
+
+        Returns
+        -------
+        list: the objects whose frames have been completed by this chunk, in order
+
+        Raises
+        ------
+        FramingError: if a frame header is invalid. The stream cannot be decoded anymore, the
+            objects decoded from the chunk before it are returned by the next call to feed(b'')
+        Exception: the error raised by the decoding of a frame. The whole chunk is processed
+            first and the objects decoded from it are returned by the next call, for instance
+            feed(b''), so that an invalid frame is skipped without losing the other ones
+        """
+        view = memoryview(chunk).cast('B')
+        objects, self._objects = self._objects, []
+        error = None
+        while True:
+            if self._payload is None:
+                if len(view) == 0:
+                    break
+                try:
+                    view = self._feed_header(view)
+                except FramingError:
+                    self._objects = objects
+                    raise
+                if self._payload is None:
+                    continue
+
+            nbytes = min(len(self._payload) - self._position, len(view))
+            self._payload[self._position:self._position + nbytes] = view[:nbytes]
+            self._position += nbytes
+            view = view[nbytes:]
+            if self._position == len(self._payload):
+                payload, self._payload = self._payload, None
+                try:
+                    if self._flags & TEMPLATE_FLAGS:
+                        objects.append(self._template_decoder.decode(payload, self._flags))
+                    else:
+                        objects.extend(ser_factory.get_apply_batch_deserializer(
+                            payload, flags=self._flags))
+                except Exception as e:
+                    if error is None:
+                        error = e
+            elif len(view) == 0:
+                break
+        if error is not None:
+            self._objects = objects
+            raise error
+        return objects
+
+    def _feed_header(self, view: memoryview) -> memoryview:
+        """ Accumulate the bytes of the frame header and allocate the message buffer once the
+        header is complete
+
+        Returns
+        -------
+        memoryview: the bytes of the chunk left after the header
+        """
+        if len(self._header) < 4:
+            header_length = 4
+        else:
+            header_length = utils.get_frame_header_length(self._header)
+        nbytes = min(header_length - len(self._header), len(view))
+        self._header += view[:nbytes]
+        if (len(self._header) >= 4 and
+                utils.get_frame_header_length(self._header) == len(self._header)):
+            try:
+                length, self._flags, _ = utils.get_frame_header_from_bytes(self._header)
+                self._payload = bytearray(length)
+            except (ValueError, MemoryError) as e:
+                raise FramingError(f'Invalid frame header: {e}') from e
+            self._header = bytearray()
+            self._position = 0
+        return view[nbytes:]
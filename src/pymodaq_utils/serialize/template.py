@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Header templates for streams of messages sharing the same structure
+
+Successive messages of a stream, for instance the frames of a detector, often only differ by
+their payloads (see utils.BytesWriter.write_payload): their type tags, data types and shapes are
+identical. With header templates, a first message defines the template, sent with the
+utils.FRAME_FLAG_TEMPLATE flag, whose body is the table of its payloads, that is their number then
+the offset and length of each one, followed by the message itself.
+
+The next messages with the same length and the same payload layout are sent with the
+utils.FRAME_FLAG_TEMPLATE_REFERENCE flag, whose body is the table of the patches to apply to the
+headers of the template, that is their number then the offset, length and bytes of each one,
+followed by the payloads only. Any other message defines a new template.
+
+Both ends of a connection keep their template, see TemplateEncoder and TemplateDecoder, so that
+frames using templates cannot be decoded on their own.
+"""
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from . import utils
+from .factory import SerializableFactory, SERIALIZABLE
+
+ser_factory = SerializableFactory()
+
+TEMPLATE_FLAGS = utils.FRAME_FLAG_TEMPLATE | utils.FRAME_FLAG_TEMPLATE_REFERENCE
+
+
+def get_patch(bytes_str: bytes, reference: bytes) -> Optional[Tuple[int, bytes]]:
+    """ Get the smallest range of bytes to write over reference to get bytes_str, both of the
+    same length
+
+    Returns
+    -------
+    tuple or None: the offset of the range in bytes_str and its bytes, None if there is no
+        difference
+    """
+    if bytes_str == reference:
+        return None
+    changed = np.flatnonzero(np.frombuffer(bytes_str, dtype=np.uint8) !=
+                             np.frombuffer(reference, dtype=np.uint8))
+    start, end = int(changed[0]), int(changed[-1]) + 1
+    return start, bytes_str[start:end]
+
+
+class TemplateEncoder:
+    """ Sending end of a stream of messages using header templates"""
+
+    def __init__(self):
+        self._nbytes = None
+        self._layout: Optional[List[Tuple[int, int]]] = None
+        self._headers: List[Tuple[int, bytes]] = []
+
+    def reset(self):
+        """ Forget the current template, the next message defines a new one"""
+        self._layout = None
+
+    def encode(self, message: utils.BytesWriter,
+               writer: Optional[utils.BytesWriter] = None) -> utils.BytesWriter:
+        """ Write a frame, header included, holding a serialized message
+
+        Parameters
+        ----------
+        message: utils.BytesWriter
+            the serialized message, without frame header (see
+            SerializableFactory.get_apply_writer)
+        writer: utils.BytesWriter
+            the writer to append the frame to. If None, a new one is created
+
+        Returns
+        -------
+        utils.BytesWriter: the writer holding the frame
+        """
+        if writer is None:
+            writer = message.spawn()
+        headers, payloads = message.split_payloads()
+        layout = [(offset, len(payload)) for offset, payload in payloads]
+        table_writer = writer.spawn()
+        if self._layout == layout and self._nbytes == message.nbytes:
+            patches = []
+            for (offset, header), (_, template_header) in zip(headers, self._headers):
+                patch = get_patch(bytes(header), template_header)
+                if patch is not None:
+                    patches.append((offset + patch[0], patch[1]))
+            table_writer.write_int(len(patches))
+            for offset, patch in patches:
+                table_writer.write_int(offset)
+                table_writer.write_int(len(patch))
+                table_writer.write(patch)
+            writer.write(utils.frame_header_to_bytes(
+                table_writer.nbytes + sum(nbytes for _, nbytes in layout),
+                utils.FRAME_FLAG_TEMPLATE_REFERENCE))
+            writer.extend(table_writer)
+            for _, payload in payloads:
+                writer.write(payload)
+        else:
+            self._layout = layout
+            self._nbytes = message.nbytes
+            self._headers = [(offset, bytes(header)) for offset, header in headers]
+            table_writer.write_int(len(layout))
+            for offset, nbytes in layout:
+                table_writer.write_int(offset)
+                table_writer.write_int(nbytes)
+            writer.write(utils.frame_header_to_bytes(table_writer.nbytes + message.nbytes,
+                                                     utils.FRAME_FLAG_TEMPLATE))
+            writer.extend(table_writer)
+            writer.extend(message)
+        return writer
+
+
+class TemplateDecoder:
+    """ Receiving end of a stream of messages using header templates
+
+    When the template describes a single array and a message does not patch its headers, the
+    array is built directly on the received payload without parsing the headers again.
+    """
+
+    def __init__(self):
+        self._nbytes = None
+        self._layout: List[Tuple[int, int]] = []
+        self._headers: List[Tuple[int, bytes]] = []
+        self._array_info: Optional[Tuple[np.dtype, Tuple[int, ...], str]] = None
+
+    def decode(self, bytes_str: utils.BytesLike, flags: int) -> SERIALIZABLE:
+        """ Decode the body of a frame using header templates
+
+        Parameters
+        ----------
+        bytes_str: bytes, bytearray or memoryview
+            the frame body, following the frame header
+        flags: int
+            the flags of the frame header
+        """
+        if flags & utils.FRAME_FLAG_TEMPLATE:
+            return self.define(bytes_str)
+        view = memoryview(bytes_str).cast('B')
+        position = 0
+
+        def read_into(buffer):
+            nonlocal position
+            buffer = memoryview(buffer).cast('B')
+            buffer[:] = view[position:position + len(buffer)]
+            position += len(buffer)
+        return self.receive(len(view), read_into)
+
+    def define(self, bytes_str: utils.BytesLike) -> SERIALIZABLE:
+        """ Store the template defined by the body of a frame with the FRAME_FLAG_TEMPLATE flag
+        and decode its message"""
+        npayloads, remaining_bytes = utils.get_int_from_bytes(memoryview(bytes_str))
+        layout = []
+        for ind in range(npayloads):
+            offset, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+            nbytes, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+            layout.append((offset, nbytes))
+        headers = []
+        position = 0
+        for offset, nbytes in layout + [(len(remaining_bytes), 0)]:
+            if offset > position:
+                headers.append((position, bytes(remaining_bytes[position:offset])))
+            position = offset + nbytes
+        self._nbytes = len(remaining_bytes)
+        self._layout = layout
+        self._headers = headers
+
+        obj = ser_factory.get_apply_deserializer(remaining_bytes)
+        self._array_info = None
+        if isinstance(obj, np.ndarray) and len(layout) == 1 and layout[0][1] == obj.nbytes:
+            self._array_info = (obj.dtype, obj.shape, 'C' if obj.flags.c_contiguous else 'F')
+        return obj
+
+    def receive(self, length: int, read_into: Callable[[utils.BytesLike], None]) -> SERIALIZABLE:
+        """ Receive the body of a frame with the FRAME_FLAG_TEMPLATE_REFERENCE flag and decode its
+        message
+
+        Parameters
+        ----------
+        length: int
+            the length of the frame body
+        read_into: Callable
+            a function filling entirely the writable buffer given as argument with the next
+            bytes of the frame body, for instance Socket.check_received_into. Patches and payloads
+            are read directly at their place in the rebuilt message
+        """
+        if self._nbytes is None:
+            raise ValueError('No header template has been defined')
+        message = bytearray(self._nbytes)
+        view = memoryview(message)
+        nread = 0
+
+        def read_int() -> int:
+            nonlocal nread
+            int_bytes = bytearray(4)
+            read_into(int_bytes)
+            nread += 4
+            if int_bytes == utils.LENGTH_ESCAPE_BYTES:
+                int_bytes = bytearray(8)
+                read_into(int_bytes)
+                nread += 8
+                return int.from_bytes(int_bytes, 'big')
+            return utils.bytes_to_int(int_bytes)
+
+        for offset, header in self._headers:
+            view[offset:offset + len(header)] = header
+        npatches = read_int()
+        for ind in range(npatches):
+            offset = read_int()
+            nbytes = read_int()
+            read_into(view[offset:offset + nbytes])
+            nread += nbytes
+        if nread + sum(nbytes for _, nbytes in self._layout) != length:
+            raise ValueError('The message does not match the header template')
+
+        if npatches == 0 and self._array_info is not None:
+            offset, nbytes = self._layout[0]
+            try:
+                out = utils.get_output_array(*self._array_info)
+            except ValueError:
+                read_into(view[offset:offset + nbytes])  # keep the stream consistent
+                raise
+            if out is not None:
+                read_into(out if self._array_info[2] == 'C' else out.T)
+                return out
+            read_into(view[offset:offset + nbytes])
+            dtype, shape, order = self._array_info
+            return np.frombuffer(message, dtype=dtype, count=int(np.prod(shape)),
+                                 offset=offset).reshape(shape, order=order)
+
+        for offset, nbytes in self._layout:
+            read_into(view[offset:offset + nbytes])
+        return ser_factory.get_apply_deserializer(message)
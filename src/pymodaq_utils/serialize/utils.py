@@ -1,13 +1,100 @@
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+import hashlib
+import lzma
+import mmap
+import os
+import threading
+import weakref
+import zlib
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None
+
 import numpy as np
-from typing import Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# compression codecs that can be applied to array payloads: name -> (compress, decompress)
+CODECS: Dict[str, Tuple[Callable[[BytesLike], bytes], Callable[[BytesLike], bytes]]] = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+}
+# payloads smaller than this are never compressed
+CODEC_THRESHOLD = 65536
+
+# checksums that can be computed on the blocks of array payloads: name -> digest function
+CHECKSUMS: Dict[str, Callable[[BytesLike], bytes]] = {
+    'crc32': lambda bytes_str: zlib.crc32(bytes_str).to_bytes(4, 'big'),
+    'adler32': lambda bytes_str: zlib.adler32(bytes_str).to_bytes(4, 'big'),
+    'md5': lambda bytes_str: hashlib.md5(bytes_str).digest(),
+    'sha256': lambda bytes_str: hashlib.sha256(bytes_str).digest(),
+    'blake2b': lambda bytes_str: hashlib.blake2b(bytes_str).digest(),
+}
+# size of the blocks into which large payloads are split to be compressed and checksummed in
+# parallel, see encode_blocks
+BLOCK_SIZE = 2**20
+
+# thread pool used to process blocks, see get_executor
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# payloads can be transferred through shared memory segments only with the POSIX semantics where
+# a segment outlives the handles of its creator until it is unlinked
+SHARED_MEMORY_AVAILABLE = shared_memory is not None and os.name == 'posix'
+_shared_segments: List[Tuple[weakref.ref, 'shared_memory.SharedMemory']] = []
+# reentrant as segments are closed by finalizers, which the garbage collector may run anywhere
+_shared_segments_lock = threading.RLock()
 
+# a 4 bytes length equal to LENGTH_ESCAPE announces that the actual length follows as 8 bytes
+LENGTH_ESCAPE = 0xFFFFFFFF
+LENGTH_ESCAPE_BYTES = LENGTH_ESCAPE.to_bytes(4, 'big')
 
-def split_nbytes(bytes_str: bytes, bytes_len: int) -> Tuple[bytes, bytes]:
+# version of the extended frame header, see frame_header_to_bytes
+FRAME_VERSION = 1
+FRAME_EXTENDED_HEADER_LENGTH = 4 + 1 + 1 + 8
+# frame flags
+FRAME_FLAG_TAG_TABLE = 0x01  # the message starts with the table of its compact tags
+FRAME_FLAG_BATCH = 0x02  # the message holds several objects behind a table of their offsets
+FRAME_FLAG_TEMPLATE = 0x04  # the message defines the header template of the next messages
+FRAME_FLAG_TEMPLATE_REFERENCE = 0x08  # the message only holds changes to the header template
+FRAME_FLAGS = (FRAME_FLAG_TAG_TABLE | FRAME_FLAG_BATCH | FRAME_FLAG_TEMPLATE |
+               FRAME_FLAG_TEMPLATE_REFERENCE)
+
+# maximum number of entries in a table of compact tags
+TAG_TABLE_MAX_LENGTH = 0x8000
+
+# table of the compact tags of the message being deserialized, if any
+_tag_table: ContextVar[Optional[List[str]]] = ContextVar('tag_table', default=None)
+# table of the compact tags of the message being serialized, if any: tag -> index
+_writer_tag_table: ContextVar[Optional[Dict[str, int]]] = ContextVar('writer_tag_table',
+                                                                    default=None)
+# provider of the arrays into which the arrays of the message being deserialized are decoded
+_output_arrays: ContextVar[Optional[Callable[[np.dtype, Tuple[int, ...], str],
+                                             Optional[np.ndarray]]]] = ContextVar('output_arrays',
+                                                                                  default=None)
+
+
+def split_nbytes(bytes_str: BytesLike, bytes_len: int) -> Tuple[BytesLike, BytesLike]:
+    """ Split a bytes string in two at the bytes_len index
+
+    When bytes_str is a memoryview, both returned objects are views on the same underlying buffer
+    so that no data is copied
+    """
     return bytes_str[:bytes_len], bytes_str[bytes_len:]
 
 
-def get_int_from_bytes(bytes_str: bytes) -> Tuple[int, bytes]:
+def get_int_from_bytes(bytes_str: BytesLike) -> Tuple[int, BytesLike]:
     """ Convert the 4 first bytes into an integer
+
+    If these 4 bytes are equal to LENGTH_ESCAPE, the integer is read from the 8 following bytes
+
     Returns
     -------
     int: the decoded integer
@@ -15,16 +102,19 @@ def get_int_from_bytes(bytes_str: bytes) -> Tuple[int, bytes]:
     """
     int_bytes, remaining_bytes = split_nbytes(bytes_str, 4)
     int_obj = bytes_to_int(int_bytes)
+    if int_obj == LENGTH_ESCAPE:
+        int_bytes, remaining_bytes = split_nbytes(remaining_bytes, 8)
+        int_obj = int.from_bytes(int_bytes, 'big')
     return int_obj, remaining_bytes
 
 
-def bytes_to_string(message: bytes) -> str:
-    return message.decode()
+def bytes_to_string(message: BytesLike) -> str:
+    return str(message, 'utf-8')
 
 
-def bytes_to_int(bytes_string: bytes) -> int:
+def bytes_to_int(bytes_string: BytesLike) -> int:
     """Convert a bytes of length 4 into an integer"""
-    if not isinstance(bytes_string, bytes):
+    if not isinstance(bytes_string, (bytes, bytearray, memoryview)):
         raise TypeError(f'{bytes_string} should be an bytes string, not a {type(bytes_string)}')
     assert len(bytes_string) == 4
     return int.from_bytes(bytes_string, 'big')
@@ -67,6 +157,9 @@ def bytes_to_nd_array(data: bytes, dtype: np.dtype, shape: Tuple[int]) -> np.nda
 def int_to_bytes(an_integer: int) -> bytes:
     """Convert an unsigned integer into a byte array of length 4 in big endian
 
+    Integers greater or equal to LENGTH_ESCAPE (4 GiB lengths) are converted into the 4 bytes
+    LENGTH_ESCAPE followed by the integer as 8 bytes in big endian
+
     Parameters
     ----------
     an_integer: int
@@ -79,9 +172,570 @@ def int_to_bytes(an_integer: int) -> bytes:
         raise TypeError(f'{an_integer} should be an integer, not a {type(an_integer)}')
     elif an_integer < 0:
         raise ValueError('Can only serialize unsigned integer using this method')
+    elif an_integer >= LENGTH_ESCAPE:
+        return LENGTH_ESCAPE_BYTES + an_integer.to_bytes(8, 'big')
     return an_integer.to_bytes(4, 'big')
 
 
+def tag_id_to_bytes(tag_id: int) -> bytes:
+    """ Convert the index of a tag in a table of compact tags into 1 byte (index lower than 128)
+    or 2 bytes in big endian with the highest bit set"""
+    if tag_id < 0x80:
+        return tag_id.to_bytes(1, 'big')
+    elif tag_id < TAG_TABLE_MAX_LENGTH:
+        return (tag_id | 0x8000).to_bytes(2, 'big')
+    raise ValueError(f'A table of compact tags cannot hold more than {TAG_TABLE_MAX_LENGTH} '
+                     f'entries')
+
+
+def get_tag_from_bytes(bytes_str: BytesLike) -> Tuple[str, BytesLike]:
+    """ Read a tag (type name, data type...)
+
+    The tag is read as a string preceded by its length, unless a table of compact tags is in use
+    (see :func:`tag_table`) in which case it is read as the index of the tag in the table, see
+    :func:`tag_id_to_bytes`
+
+    Returns
+    -------
+    str: the decoded tag
+    bytes: the remaining bytes string if any
+    """
+    table = _tag_table.get()
+    if table is None:
+        tag_len, remaining_bytes = get_int_from_bytes(bytes_str)
+        tag_bytes, remaining_bytes = split_nbytes(remaining_bytes, tag_len)
+        return bytes_to_string(tag_bytes), remaining_bytes
+    if bytes_str[0] < 0x80:
+        tag_bytes, remaining_bytes = split_nbytes(bytes_str, 1)
+    else:
+        tag_bytes, remaining_bytes = split_nbytes(bytes_str, 2)
+    return table[int.from_bytes(tag_bytes, 'big') & 0x7FFF], remaining_bytes
+
+
+def get_tag_table_from_bytes(bytes_str: BytesLike) -> Tuple[List[str], BytesLike]:
+    """ Read a table of compact tags: its length followed by each tag as a string
+
+    Returns
+    -------
+    list of str: the tags, in the order of their index
+    bytes: the remaining bytes string if any
+    """
+    table_len, remaining_bytes = get_int_from_bytes(bytes_str)
+    table = []
+    for ind in range(table_len):
+        tag_len, remaining_bytes = get_int_from_bytes(remaining_bytes)
+        tag_bytes, remaining_bytes = split_nbytes(remaining_bytes, tag_len)
+        table.append(bytes_to_string(tag_bytes))
+    return table, remaining_bytes
+
+
+@contextmanager
+def tag_table(table: List[str]):
+    """ Context manager within which tags are read as indexes in the given table"""
+    token = _tag_table.set(table)
+    try:
+        yield table
+    finally:
+        _tag_table.reset(token)
+
+
+@contextmanager
+def writer_tag_table(table: Optional[Dict[str, int]] = None):
+    """ Context manager within which all BytesWriter write their tags as indexes in a table of
+    compact tags. The table, filled while writing, is yielded as a dict: tag -> index
+
+    An existing table can be given to keep on filling it"""
+    if table is None:
+        table = {}
+    token = _writer_tag_table.set(table)
+    try:
+        yield table
+    finally:
+        _writer_tag_table.reset(token)
+
+
+class ArrayPool:
+    """ Pool of reusable arrays keyed by their data type, shape and memory order
+
+    Give it as the out argument of the deserializing methods (see output_arrays) so that decoded
+    arrays are taken from the pool instead of being allocated, then release them once used.
+
+    Parameters
+    ----------
+    max_per_key: int
+        the maximum number of released arrays kept for each data type, shape and order
+
+    Examples
+    --------
+    >>> pool = ArrayPool()
+    >>> while True:
+    ...     frame = socket.check_received_with_deserializer(out=pool)
+    ...     display(frame)
+    ...     pool.release(frame)
+    """
+
+    def __init__(self, max_per_key: int = 2):
+        self._max_per_key = max_per_key
+        self._arrays: Dict[Tuple[np.dtype, Tuple[int, ...], str], List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """int: the number of released arrays available"""
+        return sum(len(arrays) for arrays in self._arrays.values())
+
+    def get(self, dtype: np.dtype, shape: Tuple[int, ...], order: str = 'C') -> np.ndarray:
+        """ Get a released array of the given type, shape and order, or a new one"""
+        key = (np.dtype(dtype), tuple(shape), order)
+        with self._lock:
+            arrays = self._arrays.get(key, None)
+            if arrays:
+                return arrays.pop()
+        return np.empty(key[1], dtype=key[0], order=order)
+
+    __call__ = get
+
+    def release(self, array: np.ndarray):
+        """ Give back an array obtained from get, once it is not used anymore"""
+        order = 'C' if array.flags.c_contiguous else 'F'
+        key = (array.dtype, array.shape, order)
+        with self._lock:
+            arrays = self._arrays.setdefault(key, [])
+            if len(arrays) < self._max_per_key:
+                arrays.append(array)
+
+
+ArrayProvider = Union[np.ndarray, List[np.ndarray], ArrayPool,
+                      Callable[[np.dtype, Tuple[int, ...], str], Optional[np.ndarray]]]
+
+
+def is_output_compatible(array: np.ndarray, dtype: np.dtype, shape: Tuple[int, ...],
+                         order: str = 'C') -> bool:
+    """ Check if an array can be used as the output of the decoding of an array with the given
+    data type, shape and memory order"""
+    return (array.dtype == dtype and array.shape == tuple(shape) and array.flags.writeable and
+            array.flags[f'{order}_CONTIGUOUS'])
+
+
+def get_array_provider(out: ArrayProvider) -> Callable[[np.dtype, Tuple[int, ...], str],
+                                                       Optional[np.ndarray]]:
+    """ Get a callable giving output arrays from the out argument of the deserializing methods
+
+    Parameters
+    ----------
+    out: ndarray, list of ndarray, ArrayPool or Callable
+        an array or a list of arrays, each one used for at most one compatible decoded array, a
+        pool of arrays or a callable taking the data type, shape and order of a decoded array and
+        returning an array to decode into or None
+
+    Returns
+    -------
+    Callable: taking the data type, shape and memory order, returning an array or None
+    """
+    if isinstance(out, np.ndarray):
+        out = [out]
+    if isinstance(out, list):
+        arrays = list(out)
+
+        def provider(dtype: np.dtype, shape: Tuple[int, ...], order: str):
+            for ind, array in enumerate(arrays):
+                if is_output_compatible(array, dtype, shape, order):
+                    return arrays.pop(ind)
+            return None
+        return provider
+    if callable(out):
+        return out
+    raise TypeError(f'{out} cannot provide output arrays')
+
+
+@contextmanager
+def output_arrays(out: ArrayProvider):
+    """ Context manager within which decoded arrays are written into the arrays given by out,
+    see get_array_provider"""
+    token = _output_arrays.set(get_array_provider(out))
+    try:
+        yield
+    finally:
+        _output_arrays.reset(token)
+
+
+def get_output_array(dtype: np.dtype, shape: Tuple[int, ...],
+                     order: str = 'C') -> Optional[np.ndarray]:
+    """ Get the array into which an array should be decoded, if any, see output_arrays
+
+    Raises
+    ------
+    ValueError: if the provided array does not match the data type, shape and order
+    """
+    provider = _output_arrays.get()
+    if provider is None:
+        return None
+    array = provider(dtype, shape, order)
+    if array is not None and not is_output_compatible(array, dtype, shape, order):
+        raise ValueError(f'Cannot decode an array of type {dtype} and shape {shape} into an '
+                         f'array of type {array.dtype} and shape {array.shape}')
+    return array
+
+
+def write_batch_frame(writer: 'BytesWriter', objs_writer: 'BytesWriter', offsets: List[int],
+                      table: Optional[Dict[str, int]] = None):
+    """ Write a frame holding several serialized objects, see FRAME_FLAG_BATCH
+
+    Parameters
+    ----------
+    writer: BytesWriter
+        the writer to append the frame to
+    objs_writer: BytesWriter
+        the writer holding the serialized objects, one after the other
+    offsets: list of int
+        the offset of each object in objs_writer
+    table: dict or None
+        the table of compact tags used to write the objects, if any (see writer_tag_table)
+    """
+    flags = FRAME_FLAG_BATCH
+    table_writer = writer.spawn()
+    if table is not None:
+        table_writer.write_tag_table(list(table))
+        flags |= FRAME_FLAG_TAG_TABLE
+    table_writer.write_int(len(offsets))
+    for offset in offsets:
+        table_writer.write_int(offset)
+    writer.write(frame_header_to_bytes(table_writer.nbytes + objs_writer.nbytes, flags))
+    writer.extend(table_writer)
+    writer.extend(objs_writer)
+
+
+def share_bytes(bytes_str: BytesLike) -> str:
+    """ Copy bytes into a new shared memory segment whose ownership is given to the receiver
+
+    The handle of the segment is closed in this process which stops tracking it: the segment has
+    to be attached, hence unlinked, exactly once using :func:`attach_shared_bytes`, typically by
+    the process deserializing the message holding its name.
+
+    Parameters
+    ----------
+    bytes_str: bytes-like
+
+    Returns
+    -------
+    str: the name of the shared memory segment
+    """
+    if not SHARED_MEMORY_AVAILABLE:
+        raise NotImplementedError('Shared memory transfer is only available on POSIX systems')
+    view = memoryview(bytes_str).cast('B')
+    segment = shared_memory.SharedMemory(create=True, size=max(view.nbytes, 1))
+    try:
+        segment.buf[:view.nbytes] = view
+    except Exception:
+        segment.close()
+        segment.unlink()
+        raise
+    name = segment.name
+    segment.close()
+    resource_tracker.unregister(f'/{name}', 'shared_memory')
+    return name
+
+
+def attach_shared_bytes(name: str) -> 'shared_memory.SharedMemory':
+    """ Attach a shared memory segment created by :func:`share_bytes` and take its ownership
+
+    The segment name is unlinked immediately so that its memory is released as soon as the
+    returned SharedMemory is closed, see :func:`close_shared_bytes_with`.
+    """
+    close_released_shared_bytes()
+    segment = shared_memory.SharedMemory(name)
+    segment.unlink()
+    return segment
+
+
+def close_shared_bytes_with(segment: 'shared_memory.SharedMemory', owner: object):
+    """ Close an attached shared memory segment as soon as owner is garbage collected
+
+    owner should be the object holding the only views on the segment buffer, for instance the
+    buffer of the array built on it (its base, as the array is finalized before releasing it). A
+    segment that cannot be closed then, because views on its buffer still exist, is closed by the
+    next call to :func:`close_released_shared_bytes`.
+    """
+    segment_info = (weakref.ref(owner), segment)
+    with _shared_segments_lock:
+        _shared_segments.append(segment_info)
+    weakref.finalize(owner, _close_released_segment, segment_info)
+
+
+def _close_released_segment(segment_info: Tuple[weakref.ref, 'shared_memory.SharedMemory']):
+    with _shared_segments_lock:
+        if segment_info not in _shared_segments:
+            return
+        try:
+            segment_info[1].close()
+        except BufferError:  # views on the segment buffer are still alive
+            return
+        _shared_segments.remove(segment_info)
+
+
+def close_released_shared_bytes():
+    """ Close the attached shared memory segments whose owner has been garbage collected"""
+    with _shared_segments_lock:
+        for segment_info in list(_shared_segments):
+            if segment_info[0]() is None:
+                _close_released_segment(segment_info)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """ Get the thread pool shared by the block encoding and decoding, created on first use
+
+    Compression (zlib, bz2, lzma) and checksums (zlib, hashlib) release the GIL on large buffers,
+    so that blocks are processed on several cores"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix='pymodaq_serialize')
+        return _executor
+
+
+def encode_blocks(bytes_str: BytesLike, block_size: int = BLOCK_SIZE, codec: Optional[str] = None,
+                  checksum: Optional[str] = None) -> List[BytesLike]:
+    """ Split a payload into blocks compressed and checksummed in parallel, see get_executor
+
+    The encoded payload starts with the block table: the block size, the payload length, the
+    codec and checksum names (empty strings if None) and the number of blocks, then for each block
+    its stored length and checksum digest (as a length and bytes). The stored blocks follow, in
+    order. A block is stored uncompressed if compression does not reduce its size, its stored
+    length is then the block length.
+
+    Returns
+    -------
+    list of bytes-like: the block table followed by the stored blocks, uncompressed blocks being
+        views on bytes_str
+    """
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f'Unknown codec {codec}, should be one of {list(CODECS)}')
+    if checksum is not None and checksum not in CHECKSUMS:
+        raise ValueError(f'Unknown checksum {checksum}, should be one of {list(CHECKSUMS)}')
+    view = memoryview(bytes_str).cast('B')
+    blocks = [view[start:start + block_size] for start in range(0, len(view), block_size)]
+
+    def encode_block(block: memoryview) -> Tuple[BytesLike, bytes]:
+        if codec is not None:
+            compressed_block = CODECS[codec][0](block)
+            if len(compressed_block) < len(block):
+                block = compressed_block
+        return block, CHECKSUMS[checksum](block) if checksum is not None else b''
+
+    encoded_blocks = list(get_executor().map(encode_block, blocks))
+    table_writer = BytesWriter()
+    table_writer.write_int(block_size)
+    table_writer.write_int(len(view))
+    table_writer.write_string('' if codec is None else codec)
+    table_writer.write_string('' if checksum is None else checksum)
+    table_writer.write_int(len(encoded_blocks))
+    for block, digest in encoded_blocks:
+        table_writer.write_int(len(block))
+        table_writer.write_string(digest)
+    return [table_writer.to_bytes()] + [block for block, _ in encoded_blocks]
+
+
+def decode_blocks(bytes_str: BytesLike) -> BytesLike:
+    """ Decode a payload encoded with encode_blocks, checking and decompressing its blocks in
+    parallel
+
+    Returns
+    -------
+    bytes-like: the payload, a view on bytes_str if its blocks are not compressed
+
+    Raises
+    ------
+    ValueError: if the checksum of a block does not match
+    """
+    block_size, remaining_bytes = get_int_from_bytes(memoryview(bytes_str))
+    nbytes, remaining_bytes = get_int_from_bytes(remaining_bytes)
+    codec, remaining_bytes = get_int_from_bytes(remaining_bytes)
+    codec, remaining_bytes = split_nbytes(remaining_bytes, codec)
+    codec = bytes_to_string(codec) or None
+    checksum, remaining_bytes = get_int_from_bytes(remaining_bytes)
+    checksum, remaining_bytes = split_nbytes(remaining_bytes, checksum)
+    checksum = bytes_to_string(checksum) or None
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f'Unknown codec {codec}, should be one of {list(CODECS)}')
+    if checksum is not None and checksum not in CHECKSUMS:
+        raise ValueError(f'Unknown checksum {checksum}, should be one of {list(CHECKSUMS)}')
+    nblocks, remaining_bytes = get_int_from_bytes(remaining_bytes)
+    block_infos = []
+    for ind in range(nblocks):
+        block_len, remaining_bytes = get_int_from_bytes(remaining_bytes)
+        digest_len, remaining_bytes = get_int_from_bytes(remaining_bytes)
+        digest, remaining_bytes = split_nbytes(remaining_bytes, digest_len)
+        block_infos.append((block_len, bytes(digest)))
+
+    blocks_bytes = remaining_bytes
+    blocks = []
+    for ind, (block_len, digest) in enumerate(block_infos):
+        block, remaining_bytes = split_nbytes(remaining_bytes, block_len)
+        blocks.append((ind, block, digest))
+    compressed = any(len(block) != min(block_size, nbytes - ind * block_size)
+                     for ind, block, _ in blocks)
+    if compressed and codec is None:
+        raise ValueError('Inconsistent block table: compressed blocks without codec')
+    data = bytearray(nbytes) if compressed else None
+
+    def decode_block(block_info: Tuple[int, memoryview, bytes]):
+        ind, block, digest = block_info
+        if checksum is not None and CHECKSUMS[checksum](block) != digest:
+            raise ValueError(f'Checksum mismatch in block {ind} of the payload')
+        if data is not None:
+            raw_len = min(block_size, nbytes - ind * block_size)
+            if len(block) != raw_len:
+                block = CODECS[codec][1](block)
+            data[ind * block_size:ind * block_size + raw_len] = block
+
+    for _ in get_executor().map(decode_block, blocks):
+        pass
+    if data is not None:
+        return data
+    return blocks_bytes[:nbytes]
+
+
+class FileSegment:
+    """ Segment of a BytesWriter whose bytes are a region of a file, read only when needed
+
+    Sockets send such segments with socket.sendfile, so that file-backed payloads (memory-mapped
+    arrays, frames of a recording) are sent without being loaded into memory
+
+    Parameters
+    ----------
+    path: str or Path
+        the file holding the bytes
+    offset: int
+        the position of the bytes in the file
+    nbytes: int
+        the number of bytes
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], offset: int, nbytes: int):
+        self.path = path
+        self.offset = offset
+        self.nbytes = nbytes
+
+    def __len__(self) -> int:
+        return self.nbytes
+
+    def __repr__(self) -> str:
+        return f'FileSegment({self.path!r}, {self.offset}, {self.nbytes})'
+
+    def open(self):
+        """ Open the file in binary read mode"""
+        return open(self.path, 'rb')
+
+    def read(self) -> bytes:
+        """ Read the bytes of the segment"""
+        with self.open() as f:
+            f.seek(self.offset)
+            return f.read(self.nbytes)
+
+
+def get_file_span(array: np.ndarray) -> Optional[Tuple[str, int]]:
+    """ Get the file region holding the bytes of a memory-mapped array
+
+    Returns
+    -------
+    tuple or None: the file name and the position of the array bytes in the file if array is
+        C-contiguous and views a numpy.memmap, for instance np.asarray(memmap[10:20]), whose file
+        reflects its content (that is not opened in copy-on-write mode), otherwise None
+    """
+    if not array.flags.c_contiguous:
+        return None
+    mapped = array
+    while mapped is not None and not isinstance(mapped, np.memmap):
+        mapped = getattr(mapped, 'base', None)
+    if mapped is None or getattr(mapped, 'filename', None) is None or mapped.mode == 'c':
+        return None
+    base = mapped.base
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, 'base', None)
+    if base is None:
+        return None
+    mapping_offset = mapped.offset - mapped.offset % mmap.ALLOCATIONGRANULARITY
+    mapping_address = np.frombuffer(base, dtype=np.uint8).__array_interface__['data'][0]
+    return str(mapped.filename), (mapping_offset + array.__array_interface__['data'][0] -
+                                  mapping_address)
+
+
+def frame_header_to_bytes(length: int, flags: int = 0) -> bytes:
+    """ Get the header to put in front of a serialized message of a given length
+
+    Messages shorter than 4 GiB without any flag use the legacy header: their length as 4 bytes.
+    Other messages use the extended header made of:
+
+    * LENGTH_ESCAPE as 4 bytes
+    * the frame version as 1 byte
+    * the frame flags as 1 byte
+    * the message length as 8 bytes
+
+    Parameters
+    ----------
+    length: int
+        the length of the message in bytes
+    flags: int
+        bit flags describing the message encoding, stored in one byte
+
+    Returns
+    -------
+    bytes
+    """
+    if length < LENGTH_ESCAPE and flags == 0:
+        return int_to_bytes(length)
+    return (LENGTH_ESCAPE_BYTES + FRAME_VERSION.to_bytes(1, 'big') + flags.to_bytes(1, 'big') +
+            length.to_bytes(8, 'big'))
+
+
+def get_frame_header_length(bytes_str: BytesLike) -> int:
+    """ Get the length of the frame header starting with the 4 bytes of bytes_str"""
+    if bytes(bytes_str[:4]) == LENGTH_ESCAPE_BYTES:
+        return FRAME_EXTENDED_HEADER_LENGTH
+    return 4
+
+
+def get_frame_header_from_bytes(bytes_str: BytesLike) -> Tuple[int, int, BytesLike]:
+    """ Decode a frame header, see frame_header_to_bytes
+
+    Returns
+    -------
+    int: the length of the message following the header
+    int: the frame flags
+    bytes: the remaining bytes string if any
+    """
+    header_bytes, remaining_bytes = split_nbytes(bytes_str, get_frame_header_length(bytes_str))
+    if len(header_bytes) == 4:
+        return bytes_to_int(header_bytes), 0, remaining_bytes
+    version = header_bytes[4]
+    if version > FRAME_VERSION:
+        raise ValueError(f'Unsupported frame version {version}, should be at most {FRAME_VERSION}')
+    flags = header_bytes[5]
+    length = int.from_bytes(header_bytes[6:], 'big')
+    return length, flags, remaining_bytes
+
+
+def read_frame_header(read: Callable[[int], BytesLike]) -> Tuple[int, int]:
+    """ Read and decode a frame header from a stream
+
+    Parameters
+    ----------
+    read: Callable
+        method returning exactly the requested number of bytes from the stream, for instance
+        Socket.get_first_nbytes
+
+    Returns
+    -------
+    int: the length of the message following the header
+    int: the frame flags
+    """
+    header_bytes = bytes(read(4))
+    header_length = get_frame_header_length(header_bytes)
+    if header_length > 4:
+        header_bytes += bytes(read(header_length - 4))
+    length, flags, _ = get_frame_header_from_bytes(header_bytes)
+    return length, flags
+
+
 def str_to_bytes(message: str) -> bytes:
     if not isinstance(message, str):
         raise TypeError('Can only serialize str object using this method')
@@ -106,3 +760,274 @@ def str_len_to_bytes( message: Union[str, bytes]) -> Tuple[bytes, bytes]:
     if not isinstance(message, bytes):
         message = str_to_bytes(message)
     return message, int_to_bytes(len(message))
+
+
+class BytesWriter:
+    """ Accumulate the bytes of a serialized message in a single pass
+
+    Small pieces of data (headers, lengths, type names...) are appended into a growing bytearray
+    while large payloads (typically ndarray buffers) are kept as references to their own buffer,
+    so that the final message is produced with at most one copy of each payload.
+
+    Parameters
+    ----------
+    segment_threshold: int
+        Size in bytes above which written data is stored as its own segment instead of being
+        copied into the current bytearray
+    codec: str or None
+        Name of the compression codec (see CODECS) serializers should apply to their large
+        payloads, None for no compression
+    codec_threshold: int
+        Size in bytes below which payloads are not compressed
+    compact_tags: bool
+        If True, framed messages (see SerializableFactory.get_apply_writer) write their tags as
+        indexes in a table of tags put in front of the message
+    shared_memory_threshold: int or None
+        Size in bytes above which serializers should transfer their payloads through shared
+        memory segments (see share_bytes), only for peers on the same host. None to disable it.
+    block_size: int or None
+        If not None, payloads larger than block_size to be compressed or checksummed are split
+        into blocks of this size processed in parallel, see encode_blocks
+    checksum: str or None
+        Name of the checksum (see CHECKSUMS) computed on the blocks of payloads larger than
+        block_size, None for no checksum
+    file_segments: bool
+        If True, serializers should write file-backed payloads (see get_file_span) as
+        FileSegment instead of reading them
+    pack_lists: bool
+        If True, homogeneous lists of scalars, str or bytes are written as a single packed block,
+        see ListSerializeDeserialize. Peers using a version without packed lists cannot decode
+        them, hence the option is disabled by default
+    fortran_order: bool
+        If True, Fortran-contiguous arrays are written without copy and flagged to be decoded in
+        Fortran order, see NdArraySerializeDeserialize. Peers using a version without this flag
+        cannot decode them, hence the option is disabled by default
+
+    Examples
+    --------
+    >>> writer = BytesWriter()
+    >>> writer.write_string('hello')
+    >>> writer.to_bytes()
+    b'\\x00\\x00\\x00\\x05hello'
+    """
+
+    def __init__(self, segment_threshold: int = 1024, codec: Optional[str] = None,
+                 codec_threshold: int = CODEC_THRESHOLD, compact_tags: bool = False,
+                 shared_memory_threshold: Optional[int] = None, block_size: Optional[int] = None,
+                 checksum: Optional[str] = None, file_segments: bool = False,
+                 pack_lists: bool = False, fortran_order: bool = False):
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f'Unknown codec {codec}, should be one of {list(CODECS)}')
+        if checksum is not None and checksum not in CHECKSUMS:
+            raise ValueError(f'Unknown checksum {checksum}, should be one of {list(CHECKSUMS)}')
+        self._block_size = block_size
+        self._checksum = checksum
+        self._file_segments = file_segments
+        self._pack_lists = pack_lists
+        self._fortran_order = fortran_order
+        self._segment_threshold = segment_threshold
+        self._codec = codec
+        self._codec_threshold = codec_threshold
+        self._compact_tags = compact_tags
+        self._shared_memory_threshold = shared_memory_threshold
+        self._segments: List[BytesLike] = []
+        self._buffer = bytearray()
+        self._nbytes = 0
+        self._payloads: List[Tuple[int, int]] = []
+
+    def spawn(self) -> 'BytesWriter':
+        """ Get a new empty writer with the same options"""
+        return BytesWriter(self._segment_threshold, self._codec, self._codec_threshold,
+                           self._compact_tags, self._shared_memory_threshold, self._block_size,
+                           self._checksum, self._file_segments, self._pack_lists,
+                           self._fortran_order)
+
+    def copy(self) -> 'BytesWriter':
+        """ Get a writer holding the same message whose segments referring to mutable buffers,
+        for instance the data of the serialized arrays, are copied, so that the message stays
+        unchanged whatever happens later to the serialized objects"""
+        writer = self.spawn()
+        for segment in self.segments:
+            if isinstance(segment, memoryview) and not isinstance(segment.obj, bytes):
+                segment = bytes(segment)
+            writer.write(segment)
+        writer._payloads = list(self._payloads)
+        return writer
+
+    def use_blocks(self, nbytes: int) -> bool:
+        """ Check if a payload of nbytes should be split into blocks, see encode_blocks"""
+        return (self._block_size is not None and nbytes > self._block_size and
+                (self._checksum is not None or
+                 (self._codec is not None and nbytes >= self._codec_threshold)))
+
+    def use_shared_memory(self, nbytes: int) -> bool:
+        """ Check if a payload of nbytes should be transferred through shared memory"""
+        return (self._shared_memory_threshold is not None and SHARED_MEMORY_AVAILABLE and
+                nbytes >= self._shared_memory_threshold)
+
+    @property
+    def compact_tags(self) -> bool:
+        """bool: True if framed messages should use a table of compact tags"""
+        return self._compact_tags
+
+    @property
+    def pack_lists(self) -> bool:
+        """bool: True if homogeneous lists should be written as packed blocks"""
+        return self._pack_lists
+
+    @property
+    def fortran_order(self) -> bool:
+        """bool: True if Fortran-contiguous arrays should be written in Fortran order"""
+        return self._fortran_order
+
+    def __len__(self):
+        return self._nbytes
+
+    @property
+    def nbytes(self) -> int:
+        """int: the total number of bytes written so far"""
+        return self._nbytes
+
+    @property
+    def codec(self) -> Optional[str]:
+        """str: the name of the compression codec to apply to large payloads, if any"""
+        return self._codec
+
+    @property
+    def codec_threshold(self) -> int:
+        """int: the size in bytes below which payloads are not compressed"""
+        return self._codec_threshold
+
+    @property
+    def file_segments(self) -> bool:
+        """bool: True if file-backed payloads should be written as FileSegment"""
+        return self._file_segments
+
+    @property
+    def block_size(self) -> Optional[int]:
+        """int or None: the size of the blocks large payloads are split into"""
+        return self._block_size
+
+    @property
+    def checksum(self) -> Optional[str]:
+        """str or None: the name of the checksum computed on the blocks of large payloads"""
+        return self._checksum
+
+    @property
+    def shared_memory_threshold(self) -> Optional[int]:
+        """int or None: the size in bytes above which payloads are sent through shared memory"""
+        return self._shared_memory_threshold
+
+    @property
+    def segments(self) -> List[Union[BytesLike, FileSegment]]:
+        """list of bytes-like or FileSegment: the written segments, in order"""
+        self._flush()
+        return self._segments
+
+    def _flush(self):
+        if len(self._buffer) != 0:
+            self._segments.append(self._buffer)
+            self._buffer = bytearray()
+
+    def write(self, bytes_str: BytesLike):
+        """ Append some bytes-like object (bytes, bytearray, memoryview, contiguous ndarray...) or
+        a FileSegment"""
+        if type(bytes_str) is bytes and len(bytes_str) < self._segment_threshold:
+            self._buffer += bytes_str
+            self._nbytes += len(bytes_str)
+            return
+        if isinstance(bytes_str, FileSegment):
+            self._flush()
+            self._segments.append(bytes_str)
+            self._nbytes += bytes_str.nbytes
+            return
+        view = memoryview(bytes_str)
+        if view.nbytes < self._segment_threshold:
+            self._buffer += view
+        else:
+            self._flush()
+            self._segments.append(view.cast('B') if view.format != 'B' or view.ndim != 1 else view)
+        self._nbytes += view.nbytes
+
+    def write_payload(self, bytes_str: Union[BytesLike, FileSegment]):
+        """ Append the bytes of a payload, for instance the data of an array, as opposed to the
+        headers describing it, see payloads"""
+        self._payloads.append((self._nbytes, bytes_str.nbytes if isinstance(bytes_str, FileSegment)
+                               else memoryview(bytes_str).nbytes))
+        self.write(bytes_str)
+
+    @property
+    def payloads(self) -> List[Tuple[int, int]]:
+        """list of tuple: the offset and length of each payload written with write_payload"""
+        return self._payloads
+
+    def split_payloads(self) -> Tuple[List[Tuple[int, memoryview]], List[Tuple[int, memoryview]]]:
+        """ Split the written bytes into the headers and the payloads, without copy
+
+        Returns
+        -------
+        list of tuple: the offset and bytes of each header piece found between payloads
+        list of tuple: the offset and bytes of each payload
+        """
+        headers = []
+        payloads = []
+        payload_iter = iter(self._payloads)
+        payload = next(payload_iter, None)
+        offset = 0
+        for segment in self.segments:
+            if isinstance(segment, FileSegment):  # always written as a whole payload
+                payloads.append((offset, segment))
+                payload = next(payload_iter, None)
+                offset += segment.nbytes
+                continue
+            view = memoryview(segment).cast('B')
+            position = 0
+            while payload is not None and payload[0] < offset + len(view):
+                start = payload[0] - offset
+                if start > position:
+                    headers.append((offset + position, view[position:start]))
+                payloads.append((payload[0], view[start:start + payload[1]]))
+                position = start + payload[1]
+                payload = next(payload_iter, None)
+            if position < len(view):
+                headers.append((offset + position, view[position:]))
+            offset += len(view)
+        return headers, payloads
+
+    def write_int(self, an_integer: int):
+        """ Append an unsigned integer, see :func:`int_to_bytes`"""
+        self.write(int_to_bytes(an_integer))
+
+    def write_string(self, message: Union[str, bytes]):
+        """ Append a string preceded by its length, see :func:`str_len_to_bytes`"""
+        message, len_as_bytes = str_len_to_bytes(message)
+        self.write(len_as_bytes)
+        self.write(message)
+
+    def write_tag(self, tag: str):
+        """ Append a tag (type name, data type...) as a string preceded by its length, or as its
+        index in the table of compact tags if within a writer_tag_table context"""
+        table = _writer_tag_table.get()
+        if table is None:
+            self.write_string(tag)
+        else:
+            self.write(tag_id_to_bytes(table.setdefault(tag, len(table))))
+
+    def write_tag_table(self, tags: List[str]):
+        """ Append a table of compact tags, see get_tag_table_from_bytes"""
+        self.write_int(len(tags))
+        for tag in tags:
+            self.write_string(tag)
+
+    def extend(self, writer: 'BytesWriter'):
+        """ Append all the segments of another writer without copying its large segments"""
+        offset = self._nbytes
+        self._payloads.extend((payload_offset + offset, nbytes)
+                              for payload_offset, nbytes in writer.payloads)
+        for segment in writer.segments:
+            self.write(segment)
+
+    def to_bytes(self) -> bytes:
+        """ Join all segments into a single bytes object, copying each segment only once"""
+        return b''.join(segment.read() if isinstance(segment, FileSegment) else segment
+                        for segment in self.segments)
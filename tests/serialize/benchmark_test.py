@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+
+from pymodaq_utils.serialize import benchmark
+
+
+def test_samples_cover_registered_types():
+    samples = benchmark.get_samples()
+    assert [obj_type for obj_type in benchmark.get_missing_types(samples)
+            if obj_type.__module__.startswith('pymodaq_utils')] == []  # not the ones of the tests
+
+
+def test_run():
+    samples = {'float': 12.5, 'ndarray': np.arange(100), 'list': ['a', 1]}
+    results = benchmark.run(min_time=0., samples=samples)
+    assert len(results) == len(samples) * len(benchmark.OPERATIONS)
+    for result in results:
+        assert result.repeat >= 1
+        assert result.ns_per_op > 0
+        assert result.mb_per_s > 0
+        assert result.allocated_bytes >= 0
+
+    ratios = benchmark.compare(results, json.loads(json.dumps(benchmark.to_json(results))))
+    assert all(ratio == 1. for ratio in ratios.values())
+
+
+def test_main(tmp_path, capsys):
+    output = tmp_path.joinpath('results.json')
+    benchmark.main(['--min-time', '0', '--operations', 'serialize', '--output', str(output)])
+    benchmark.main(['--min-time', '0', '--operations', 'serialize', '--compare', str(output)])
+    assert 'serializable_base' in capsys.readouterr().out
+    results = json.loads(output.read_text())['results']
+    assert {result['operation'] for result in results} == {'serialize'}
+
+
+def test_socket_round_trip():
+    round_trip = benchmark.SocketRoundTrip()
+    thread = round_trip._thread
+    for obj in ('a', np.arange(10)):
+        assert np.array_equal(round_trip(obj), obj)
+    assert round_trip._thread is thread
+    round_trip.close()
+    assert not thread.is_alive()
@@ -0,0 +1,98 @@
+import logging
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from pymodaq_utils.serialize import instrumentation, utils
+from pymodaq_utils.serialize.instrumentation import (LatencyHistogram, MetricsReporter,
+                                                     SocketMetrics)
+from pymodaq_utils.serialize.mysocket import Socket
+from pymodaq_utils.serialize.serializer import ser_factory
+
+
+@pytest.fixture
+def serialization_metrics():
+    yield instrumentation.enable_serialization_metrics()
+    instrumentation.disable_serialization_metrics()
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.
+    for duration in (1e-5,) * 98 + (1e-2, 100.):
+        histogram.add(duration)
+    assert histogram.count == 100
+    assert histogram.max == 100.
+    assert 1e-5 <= histogram.percentile(50) < 2e-5
+    assert 1e-2 <= histogram.percentile(99) < 2e-2
+    assert histogram.percentile(100) == 100.
+    assert histogram.mean == pytest.approx((98e-5 + 1e-2 + 100.) / 100)
+    copy = histogram.copy()
+    histogram.reset()
+    assert histogram.count == 0 and copy.count == 100
+
+
+def test_serialization_metrics(serialization_metrics):
+    obj = ['a', np.arange(10), [1, 2.]]
+    ser_factory.get_apply_deserializer(ser_factory.get_apply_serializer(obj))
+    timings = serialization_metrics.snapshot()
+    assert timings['list']['serialize'][0] == 2
+    assert timings['list']['deserialize'][0] == 2
+    assert timings['ndarray']['serialize'][0] == 1
+    assert timings['float']['deserialize'][0] == 1
+    assert all(total >= 0 for type_timings in timings.values()
+               for _, total in type_timings.values())
+
+    instrumentation.disable_serialization_metrics()
+    ser_factory.get_apply_serializer(obj)
+    assert serialization_metrics.snapshot() == timings
+    assert instrumentation.get_serialization_metrics() is None
+
+
+def test_socket_metrics():
+    sender, receiver = (Socket(sock) for sock in socket.socketpair())
+    sender.metrics = SocketMetrics()
+    receiver.metrics = SocketMetrics()
+    objs = [np.zeros((100, 100)), 'text']
+
+    def send_all():
+        for obj in objs:
+            sender.check_sended_with_serializer(obj)
+        sender.check_sended_batch_with_serializer(objs)
+
+    thread = threading.Thread(target=send_all)
+    thread.start()
+    receiver.check_received_with_deserializer()
+    receiver.check_received_with_deserializer(out=utils.ArrayPool())
+    receiver.check_received_objects_with_deserializer()
+    thread.join()
+    sent, received = sender.metrics.snapshot(), receiver.metrics.snapshot()
+    assert sent['messages_sent'] == received['messages_received'] == 3
+    assert sent['bytes_sent'] == received['bytes_received'] > 2 * 80000
+    assert sent['send_blocked_time'] > 0
+    assert received['receive_latency'].count == 3
+    assert received['bytes_sent'] == 0
+    sender.close()
+    receiver.close()
+
+
+def test_reporter(serialization_metrics, caplog):
+    metrics = SocketMetrics()
+    metrics.add_sent(2000, 0.)
+    reporter = MetricsReporter(interval=0.01)
+    reporter.add('link', metrics)
+    metrics.add_sent(3000, 0.)
+    metrics.add_received(500, 1e-3)
+    ser_factory.get_apply_serializer('a')
+    with caplog.at_level(logging.INFO, logger=instrumentation.logger.name):
+        line = reporter.report()
+    assert line.startswith('link: out ')
+    assert 'str: serialize 1 in ' in line
+    assert 'p50 1.000 ms' in line
+    assert line in caplog.text
+
+    with reporter:
+        threading.Event().wait(0.05)
+    assert reporter._thread is None
@@ -0,0 +1,135 @@
+import socket
+
+import numpy as np
+import pytest
+
+from pymodaq_utils.serialize.mysocket import BatchSender, Socket
+from pymodaq_utils.serialize.recording import (RecordingReader, RecordingWriter, FILE_MAGIC,
+                                               get_index_path)
+
+OBJECTS = ['hello', 12.5, [1, 'a', b'b'], np.arange(10000).reshape((100, 100)), b'']
+
+
+def assert_equal(obj, obj_back):
+    if isinstance(obj, np.ndarray):
+        assert np.array_equal(obj, obj_back)
+    else:
+        assert obj == obj_back
+
+
+@pytest.mark.parametrize('options', (dict(), dict(codec='zlib', codec_threshold=100),
+                                     dict(compact_tags=True)))
+def test_write_read(tmp_path, options):
+    path = tmp_path / 'recording.pmq'
+    with RecordingWriter(path, **options) as recorder:
+        for ind, obj in enumerate(OBJECTS):
+            assert recorder.write(obj) == ind
+    assert path.read_bytes().startswith(FILE_MAGIC)
+    assert get_index_path(path).stat().st_size == 8 * len(OBJECTS)
+
+    with RecordingReader(path) as reader:
+        assert len(reader) == len(OBJECTS)
+        for obj, obj_back in zip(OBJECTS, reader):
+            assert_equal(obj, obj_back)
+        assert reader[-2].shape == (100, 100)
+        assert_equal(OBJECTS[2], reader[2])
+
+
+def test_zero_copy(tmp_path):
+    path = tmp_path / 'recording.pmq'
+    with RecordingWriter(path) as recorder:
+        recorder.write(np.arange(1000.))
+    reader = RecordingReader(path)
+    array = reader[0]
+    assert not array.flags.owndata
+    assert not array.flags.writeable
+    reader.close()
+    assert np.array_equal(array, np.arange(1000.))  # still mapped while used
+
+
+def test_append_and_refresh(tmp_path):
+    path = tmp_path / 'recording.pmq'
+    recorder = RecordingWriter(path)
+    recorder.write('first')
+    recorder.flush()
+    reader = RecordingReader(path)
+    assert len(reader) == 1
+    recorder.write('second')
+    recorder.close()
+    reader.refresh()
+    assert list(reader) == ['first', 'second']
+    reader.close()
+
+    with RecordingWriter(path) as recorder:
+        assert len(recorder) == 2
+        assert recorder.write('third') == 2
+    with RecordingReader(path) as reader:
+        assert list(reader) == ['first', 'second', 'third']
+
+
+def test_repair(tmp_path):
+    path = tmp_path / 'recording.pmq'
+    with RecordingWriter(path) as recorder:
+        for obj in OBJECTS:
+            recorder.write(obj)
+    get_index_path(path).write_bytes(get_index_path(path).read_bytes()[:12])  # lagging index
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00incomplete')
+
+    with RecordingReader(path) as reader:
+        assert len(reader) == len(OBJECTS)
+        assert_equal(OBJECTS[3], reader[3])
+
+    with RecordingWriter(path) as recorder:
+        assert len(recorder) == len(OBJECTS)
+        recorder.write('last')
+    assert get_index_path(path).stat().st_size == 8 * (len(OBJECTS) + 1)
+    with RecordingReader(path) as reader:
+        assert reader[-1] == 'last'
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'other.pmq'
+    path.write_bytes(b'something else')
+    with pytest.raises(ValueError):
+        RecordingReader(path)
+
+
+def test_socket_recorder(tmp_path):
+    path = tmp_path / 'recording.pmq'
+    sender, receiver = socket.socketpair()
+    sender, receiver = Socket(sender), Socket(receiver)
+    with RecordingWriter(path) as recorder:
+        sender.recorder = recorder
+        for obj in OBJECTS[:3]:
+            sender.check_sended_with_serializer(obj)
+            assert_equal(obj, receiver.check_received_with_deserializer())
+    sender.close()
+    receiver.close()
+    with RecordingReader(path) as reader:
+        assert list(reader) == OBJECTS[:3]
+
+
+def test_socket_recorder_batches(tmp_path):
+    path = tmp_path / 'recording.pmq'
+    sender, receiver = socket.socketpair()
+    sender, receiver = Socket(sender), Socket(receiver)
+    with RecordingWriter(path) as recorder:
+        sender.recorder = recorder
+        sender.check_sended_batch_with_serializer(OBJECTS[:3])
+        sender.check_sended_with_serializer('single')
+        with BatchSender(sender, max_delay=None) as batch_sender:
+            batch_sender.send(1)
+            batch_sender.send('two')
+    for objs in (OBJECTS[:3], ['single'], [1, 'two']):
+        assert receiver.check_received_objects_with_deserializer() == objs
+    sender.close()
+    receiver.close()
+    with RecordingReader(path) as reader:
+        assert len(reader) == 3
+        assert reader.get_objects(0) == OBJECTS[:3]
+        assert reader.get_objects(1) == ['single']
+        assert reader[1] == 'single'
+        with pytest.raises(ValueError):
+            reader[2]
+        assert list(reader.iter_objects()) == OBJECTS[:3] + ['single', 1, 'two']
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 
 from pymodaq_utils.serialize import utils
@@ -40,3 +41,111 @@ class TestStaticClassMethods:
         assert bytes_length == utils.int_to_bytes(len(MESSAGE))
 
         assert utils.bytes_to_string(bytes_string) == MESSAGE
+
+    def test_memoryview_cursor(self):
+        bytes_string = utils.int_to_bytes(12) + b'remaining'
+        int_obj, remaining_bytes = utils.get_int_from_bytes(memoryview(bytes_string))
+        assert int_obj == 12
+        assert isinstance(remaining_bytes, memoryview)
+        assert remaining_bytes.obj is bytes_string
+        assert utils.bytes_to_string(remaining_bytes) == 'remaining'
+
+
+class TestBytesWriter:
+
+    def test_write(self):
+        writer = utils.BytesWriter(segment_threshold=16)
+        writer.write_int(3)
+        writer.write_string('abc')
+        payload = bytes(range(100))
+        writer.write(payload)
+        writer.write(b'end')
+
+        assert writer.nbytes == len(writer) == 4 + 4 + 3 + 100 + 3
+        assert len(writer.segments) == 3
+        assert writer.segments[1].obj is payload
+        assert writer.to_bytes() == (utils.int_to_bytes(3) + utils.int_to_bytes(3) + b'abc' +
+                                     payload + b'end')
+
+    def test_extend(self):
+        writer = utils.BytesWriter()
+        writer.write(b'head')
+        other = utils.BytesWriter()
+        other.write_string('tail')
+        writer.extend(other)
+        assert writer.to_bytes() == b'head' + utils.int_to_bytes(4) + b'tail'
+
+
+class TestLargeLengths:
+
+    def test_int_escape(self):
+        large_int = 5 * 2**32
+        bytes_string = utils.int_to_bytes(large_int)
+        assert len(bytes_string) == 12
+        assert bytes_string[:4] == utils.LENGTH_ESCAPE_BYTES
+        assert utils.get_int_from_bytes(bytes_string + b'abc') == (large_int, b'abc')
+        assert utils.get_int_from_bytes(utils.int_to_bytes(56) + b'abc') == (56, b'abc')
+
+    def test_frame_header(self):
+        header = utils.frame_header_to_bytes(1234)
+        assert header == utils.int_to_bytes(1234)
+        assert utils.get_frame_header_from_bytes(header + b'abc') == (1234, 0, b'abc')
+
+        for length, flags in ((5 * 2**32, 0), (1234, 3)):
+            header = utils.frame_header_to_bytes(length, flags)
+            assert len(header) == utils.FRAME_EXTENDED_HEADER_LENGTH
+            assert utils.get_frame_header_length(header) == utils.FRAME_EXTENDED_HEADER_LENGTH
+            assert utils.get_frame_header_from_bytes(header + b'abc') == (length, flags, b'abc')
+
+    def test_read_frame_header(self):
+        stream = memoryview(utils.frame_header_to_bytes(5 * 2**32, 2) + b'abc')
+        position = 0
+
+        def read(length):
+            nonlocal position
+            position += length
+            return stream[position - length:position]
+
+        assert utils.read_frame_header(read) == (5 * 2**32, 2)
+        assert bytes(stream[position:]) == b'abc'
+
+    def test_unknown_version(self):
+        header = bytearray(utils.frame_header_to_bytes(12, 1))
+        header[4] = utils.FRAME_VERSION + 1
+        with pytest.raises(ValueError):
+            utils.get_frame_header_from_bytes(header)
+
+
+class TestBlocks:
+    @pytest.mark.parametrize('codec', (None, 'zlib', 'bz2'))
+    @pytest.mark.parametrize('checksum', (None, 'crc32', 'sha256'))
+    def test_encode_decode(self, codec, checksum):
+        data = np.repeat(np.arange(2500, dtype=np.int32), 10).tobytes()
+        blocks = utils.encode_blocks(data, 4096, codec, checksum)
+        assert len(blocks) == 1 + -(-len(data) // 4096)
+        if codec is None:
+            assert all(np.shares_memory(np.frombuffer(block, np.uint8),
+                                        np.frombuffer(data, np.uint8)) for block in blocks[1:])
+        else:
+            assert sum(len(block) for block in blocks[1:]) < len(data) / 2
+        decoded = utils.decode_blocks(b''.join(blocks))
+        assert bytes(decoded) == data
+
+    def test_incompressible_blocks(self):
+        data = np.random.randint(0, 256, 10000, dtype=np.uint8).tobytes()
+        blocks = utils.encode_blocks(data, 1000, 'zlib')
+        assert [len(block) for block in blocks[1:]] == [1000] * 10
+        assert bytes(utils.decode_blocks(b''.join(blocks))) == data
+
+    def test_checksum_mismatch(self):
+        data = bytes(range(256)) * 100
+        encoded = bytearray(b''.join(utils.encode_blocks(data, 1000, checksum='crc32')))
+        encoded[-1] ^= 0xFF
+        with pytest.raises(ValueError):
+            utils.decode_blocks(encoded)
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            utils.encode_blocks(b'data', 2, checksum='unknown')
+        with pytest.raises(ValueError):
+            utils.BytesWriter(checksum='unknown')
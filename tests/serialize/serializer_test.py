@@ -1,7 +1,8 @@
 import numpy as np
 import pytest
 
-from pymodaq_utils.serialize.factory import SerializableFactory
+from pymodaq_utils.serialize import utils
+from pymodaq_utils.serialize.factory import SerializableBase, SerializableFactory
 from pymodaq_utils.serialize.serializer import (StringSerializeDeserialize as SSD,
                                                 BytesSerializeDeserialize as BSD,
                                                 ScalarSerializeDeserialize as ScSD,
@@ -173,3 +174,292 @@ def test_list_serialization_deserialization(obj_list):
         else:
             assert obj_list[ind] == obj
 
+
+def test_deserialization_without_copy():
+    arrays = [np.arange(10), np.array([[1.5, 2.5], [3.5, 4.5]])]
+    bytes_str = ser_factory.get_apply_serializer(arrays)
+
+    list_back, remaining_bytes = ser_factory.get_apply_deserializer(bytes_str, only_object=False)
+    assert isinstance(remaining_bytes, memoryview)
+    assert len(remaining_bytes) == 0
+    for array, array_back in zip(arrays, list_back):
+        assert np.allclose(array, array_back)
+        base = array_back
+        while isinstance(base, np.ndarray):
+            assert not base.flags.owndata
+            base = base.base
+        assert base.obj is bytes_str
+
+
+def test_writer_without_copy():
+    array = np.arange(1000, dtype=float).reshape((10, 100))
+    writer = ser_factory.get_apply_writer([array, 'a string'], append_length=True)
+    bytes_str = writer.to_bytes()
+    assert bytes_str == ser_factory.get_apply_serializer([array, 'a string'], append_length=True)
+    assert writer.nbytes == len(bytes_str)
+    assert any(getattr(segment, 'obj', None) is not None and
+               np.shares_memory(np.frombuffer(segment, dtype=float), array)
+               for segment in writer.segments)
+
+    array_t = array.T
+    assert np.allclose(ser_factory.get_apply_deserializer(ser_factory.get_apply_serializer(array_t)),
+                       array_t)
+
+
+def test_get_type_from_str():
+    assert ser_factory.get_type_from_str('int') is int
+    assert ser_factory.get_type_from_str('ndarray') is np.ndarray
+    assert ser_factory.get_type_from_str('complex') is complex
+    with pytest.raises(ValueError):
+        ser_factory.get_type_from_str('in')
+    with pytest.raises(ValueError):
+        ser_factory.get_type_from_str('numpy.ndarray')
+
+
+def test_register_name_collision(caplog):
+    def make_class():
+        class NameCollision:
+            pass
+        return NameCollision
+
+    first, second = make_class(), make_class()
+    ser_factory.register_from_type(first, lambda obj: b'', lambda bytes_str: (first(), bytes_str))
+    ser_factory.register_from_type(first, lambda obj: b'', lambda bytes_str: (first(), bytes_str))
+    assert caplog.text == ''
+    ser_factory.register_from_type(second, lambda obj: b'',
+                                   lambda bytes_str: (second(), bytes_str))
+    assert 'NameCollision' in caplog.text
+    assert ser_factory.get_type_from_str('NameCollision') is first
+    assert second in ser_factory.get_serializables()
+    assert isinstance(ser_factory.get_apply_deserializer(ser_factory.get_apply_serializer(second())),
+                      first)
+
+
+@pytest.mark.parametrize('obj_list', ([0.1 * ind for ind in range(100)],
+                                      list(range(-50, 50)),
+                                      [ind % 3 == 0 for ind in range(20)],
+                                      [ind + 1j * ind for ind in range(20)],
+                                      [f'{ind:04d}' for ind in range(20)],
+                                      [bytes([ind, 0, ind]) for ind in range(20)],
+                                      ))
+def test_packed_list_serialization(obj_list):
+    assert SSD.serialize(LSD.PACKED_TAG) not in LSD.serialize(obj_list)  # opt-in
+    ser = LSD.serialize(obj_list, pack_lists=True)
+    assert SSD.serialize(LSD.PACKED_TAG) in ser
+    assert len(ser) < len(obj_list) * len(ser_factory.get_apply_serializer(obj_list[0]))
+
+    list_back, remaining_bytes = LSD.deserialize(ser + b'extra')
+    assert list_back == obj_list
+    assert all(type(obj) is type(obj_list[0]) for obj in list_back)
+    assert remaining_bytes == b'extra'
+
+    assert ser_factory.get_apply_deserializer(ser_factory.get_apply_serializer(obj_list)) == obj_list
+    writer = ser_factory.get_apply_writer(obj_list, utils.BytesWriter(pack_lists=True))
+    assert ser_factory.get_apply_deserializer(writer.to_bytes()) == obj_list
+
+
+@pytest.mark.parametrize('obj_list', ([-1] + [2**63 + 1] * 7,
+                                      [1] * 7 + [2**63],
+                                      ))
+def test_packed_list_serialization_out_of_range(obj_list):
+    ser = LSD.serialize(obj_list, pack_lists=True)
+    assert SSD.serialize(LSD.PACKED_TAG) not in ser
+    list_back = LSD.deserialize(ser)[0]
+    assert list_back == obj_list
+    assert not any(isinstance(obj, float) for obj in list_back)
+
+
+@pytest.mark.parametrize('obj_list', ([0.1 * ind for ind in range(4)],
+                                      [1, 2, 3, 4, 5, 6, 7, 8.],
+                                      [1, True] * 5,
+                                      ['a', 'bb'] * 5,
+                                      [''] * 10,
+                                      ))
+def test_not_packed_list_serialization(obj_list):
+    ser = LSD.serialize(obj_list, pack_lists=True)
+    assert SSD.serialize(LSD.PACKED_TAG) not in ser
+    assert LSD.deserialize(ser)[0] == obj_list
+
+
+@pytest.mark.parametrize('codec', ('zlib', 'lzma', 'bz2'))
+def test_ndarray_compression(codec):
+    array = np.zeros((200, 300), dtype=np.uint16)
+    array[::10, ::20] = 12
+    raw_bytes = ser_factory.get_apply_serializer(array)
+
+    writer = ser_factory.get_apply_writer(array, utils.BytesWriter(codec=codec))
+    compressed_bytes = writer.to_bytes()
+    assert len(compressed_bytes) < len(raw_bytes) / 10
+    assert f'<u2{NdSD.OPTIONS_SEPARATOR}{codec}'.encode() in compressed_bytes
+    assert np.array_equal(ser_factory.get_apply_deserializer(compressed_bytes), array)
+
+    small_array = array[:10, :10]
+    writer = ser_factory.get_apply_writer(small_array, utils.BytesWriter(codec=codec))
+    assert writer.to_bytes() == ser_factory.get_apply_serializer(small_array)
+
+    random_array = np.random.randint(0, 256, (200, 300), dtype=np.uint8)
+    writer = ser_factory.get_apply_writer(random_array, utils.BytesWriter(codec=codec))
+    assert writer.to_bytes() == ser_factory.get_apply_serializer(random_array)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        utils.BytesWriter(codec='unknown')
+
+
+class CompactTagsSerializable(SerializableBase):
+    def __init__(self, name: str, data: np.ndarray):
+        self.name = name
+        self.data = data
+
+    @staticmethod
+    def serialize(obj: 'CompactTagsSerializable') -> bytes:
+        return (ser_factory.get_apply_serializer(obj.name) +
+                ser_factory.get_apply_serializer(obj.data))
+
+    @staticmethod
+    def deserialize(bytes_str):
+        name, remaining_bytes = ser_factory.get_apply_deserializer(bytes_str, False)
+        data, remaining_bytes = ser_factory.get_apply_deserializer(remaining_bytes, False)
+        return CompactTagsSerializable(name, data), remaining_bytes
+
+
+def test_compact_tags():
+    ser_factory.register_decorator()(CompactTagsSerializable)
+
+    obj = [ind if ind % 2 else f'{ind}' for ind in range(50)]
+    obj += [np.arange(3), [1.5, True, 2 + 1j], CompactTagsSerializable('a name', np.arange(5.))]
+    bytes_str = ser_factory.get_apply_serializer(obj, append_length=True)
+    compact_writer = ser_factory.get_apply_writer(obj, utils.BytesWriter(compact_tags=True),
+                                                  append_length=True)
+    compact_bytes = compact_writer.to_bytes()
+    assert len(compact_bytes) < len(bytes_str) * 0.7
+
+    length, flags, remaining_bytes = utils.get_frame_header_from_bytes(compact_bytes)
+    assert flags == utils.FRAME_FLAG_TAG_TABLE
+    assert length == len(remaining_bytes)
+    obj_back = ser_factory.get_apply_deserializer(remaining_bytes, flags=flags)
+    assert obj_back[:50] == obj[:50]
+    assert np.array_equal(obj_back[50], obj[50])
+    assert obj_back[51] == obj[51]
+    assert obj_back[52].name == obj[52].name
+    assert np.array_equal(obj_back[52].data, obj[52].data)
+
+    with pytest.raises(ValueError):
+        ser_factory.get_apply_deserializer(remaining_bytes, flags=0x80)
+
+
+def test_tag_id_to_bytes():
+    for tag_id in (0, 127, 128, 1000, utils.TAG_TABLE_MAX_LENGTH - 1):
+        table = [f'{ind}' for ind in range(tag_id + 1)]
+        with utils.tag_table(table):
+            assert utils.get_tag_from_bytes(utils.tag_id_to_bytes(tag_id) + b'a') == (
+                f'{tag_id}', b'a')
+    assert len(utils.tag_id_to_bytes(127)) == 1
+    assert len(utils.tag_id_to_bytes(128)) == 2
+    with pytest.raises(ValueError):
+        utils.tag_id_to_bytes(utils.TAG_TABLE_MAX_LENGTH)
+
+
+@pytest.mark.parametrize('scalar', (0, -1, 2**62, -2**63, 2**63, 0.1, -1e300, float('inf'),
+                                    1.5 - 2.5j, True, False,
+                                    np.int32(-5), np.float32(2.5), np.uint16(7), np.complex64(1j)))
+def test_scalar_struct_fast_path(scalar):
+    scalar_array = np.array([scalar])
+    numpy_bytes = (SSD.serialize(scalar_array.dtype.descr[0][1]) +
+                   utils.int_to_bytes(scalar_array.nbytes) + scalar_array.tobytes())
+    assert ScSD.serialize(scalar) == numpy_bytes
+
+    scalar_back, remaining_bytes = ScSD.deserialize(numpy_bytes)
+    assert scalar_back == scalar
+    assert len(remaining_bytes) == 0
+    if type(scalar) in (bool, int, float, complex) and scalar_array.dtype.kind != 'u':
+        assert type(scalar_back) is type(scalar)
+
+
+@pytest.mark.parametrize('fortran_order', (False, True))
+def test_ndarray_memory_order(fortran_order):
+    array = np.arange(2400, dtype=float).reshape((20, 30, 4))
+    for array_in, order in ((array, 'C'), (array.T, 'F'), (np.asfortranarray(array), 'F'),
+                            (array[:, ::2, 1:], 'C')):
+        if not fortran_order:
+            order = 'C'
+        writer = ser_factory.get_apply_writer(array_in,
+                                              utils.BytesWriter(fortran_order=fortran_order))
+        assert (f'<f8{NdSD.OPTIONS_SEPARATOR}F'.encode() in writer.to_bytes()) == (order == 'F')
+        if array_in.flags.c_contiguous or order == 'F':
+            assert any(np.shares_memory(np.frombuffer(segment, dtype=np.uint8), array_in)
+                       for segment in writer.segments)
+        else:
+            assert ser_factory.get_apply_serializer(array_in) == \
+                ser_factory.get_apply_serializer(np.ascontiguousarray(array_in))
+
+        array_back = ser_factory.get_apply_deserializer(writer.to_bytes())
+        assert np.array_equal(array_back, array_in)
+        assert array_back.flags[f'{order}_CONTIGUOUS']
+
+    array_f = np.asfortranarray(np.zeros((300, 400)))
+    writer = ser_factory.get_apply_writer(array_f, utils.BytesWriter(codec='zlib',
+                                                                     fortran_order=True))
+    array_back = ser_factory.get_apply_deserializer(writer.to_bytes())
+    assert np.array_equal(array_back, array_f)
+    assert array_back.flags.f_contiguous
+
+
+@pytest.mark.skipif(not utils.SHARED_MEMORY_AVAILABLE, reason='POSIX shared memory required')
+def test_ndarray_shared_memory():
+    from multiprocessing import shared_memory
+
+    array = np.arange(100000, dtype=float).reshape((100, 1000))
+    writer = utils.BytesWriter(shared_memory_threshold=array.nbytes)
+    message = ser_factory.get_apply_writer([array, np.arange(10)], writer).to_bytes()
+    assert len(message) < 1000
+    assert f'<f8{NdSD.OPTIONS_SEPARATOR}shm'.encode() in message
+    name = bytes(message[message.index(b'psm_'):]).split(b'\x00')[0].decode()
+
+    array_back, small_array = ser_factory.get_apply_deserializer(message)
+    assert np.array_equal(array_back, array)
+    assert np.array_equal(small_array, np.arange(10))
+    with pytest.raises(FileNotFoundError):  # ownership taken by the receiver
+        shared_memory.SharedMemory(name)
+
+    view = array_back[:10]
+    del array_back
+    assert len(utils._shared_segments) == 1  # still viewed
+    del view
+    assert len(utils._shared_segments) == 0
+
+
+@pytest.mark.parametrize('compact_tags', (False, True))
+def test_batch(compact_tags):
+    objs = ['a', 1, 2.5, np.arange(10), [1, 'b'], b'']
+    writer = ser_factory.get_apply_batch_writer(objs, utils.BytesWriter(compact_tags=compact_tags))
+    length, flags, remaining_bytes = utils.get_frame_header_from_bytes(writer.to_bytes())
+    assert flags & utils.FRAME_FLAG_BATCH
+    assert length == len(remaining_bytes)
+    objs_back = ser_factory.get_apply_batch_deserializer(remaining_bytes, flags)
+    assert len(objs_back) == len(objs)
+    for obj, obj_back in zip(objs, objs_back):
+        assert np.array_equal(obj_back, obj) if isinstance(obj, np.ndarray) else obj_back == obj
+
+    writer = ser_factory.get_apply_batch_writer([])
+    _, flags, remaining_bytes = utils.get_frame_header_from_bytes(writer.to_bytes())
+    assert ser_factory.get_apply_batch_deserializer(remaining_bytes, flags) == []
+
+
+@pytest.mark.parametrize('options', (dict(codec='zlib', codec_threshold=0),
+                                     dict(checksum='crc32'),
+                                     dict(codec='lzma', checksum='blake2b', codec_threshold=0)))
+def test_ndarray_blocks(options):
+    array = np.asfortranarray(np.repeat(np.arange(300.), 100).reshape((150, 200)))
+    writer = ser_factory.get_apply_writer(array, utils.BytesWriter(block_size=10000,
+                                                                   fortran_order=True, **options))
+    message = writer.to_bytes()
+    assert f'{NdSD.OPTIONS_SEPARATOR}blocks'.encode() in message
+    array_back = ser_factory.get_apply_deserializer(message)
+    assert np.array_equal(array_back, array)
+    assert array_back.flags.f_contiguous
+
+    writer = ser_factory.get_apply_writer(np.arange(10.), utils.BytesWriter(block_size=10000,
+                                                                           **options))
+    assert b'blocks' not in writer.to_bytes()
@@ -0,0 +1,119 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_utils.serialize import utils
+from pymodaq_utils.serialize.mysocket import Socket
+from pymodaq_utils.serialize.serializer import ser_factory
+from pymodaq_utils.serialize.server import SocketServer
+
+
+def connect(server: SocketServer) -> Socket:
+    client = Socket(socket.create_connection(server.address))
+    client.receive_timeout = 10
+    return client
+
+
+def wait_for(condition, timeout=10):
+    start = time.perf_counter()
+    while not condition():
+        assert time.perf_counter() - start < timeout
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def server():
+    messages = []
+    disconnected = []
+
+    def on_message(connection, obj):
+        if obj == 'raise':
+            raise RuntimeError('callback error')
+        messages.append(obj)
+        connection.send(['echo', obj])
+
+    server = SocketServer(('localhost', 0), on_message=on_message,
+                          on_disconnect=disconnected.append)
+    server.messages = messages
+    server.disconnected = disconnected
+    thread = threading.Thread(target=server.serve_forever, args=(0.1,), daemon=True)
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+    server.close()
+
+
+def test_echo_and_broadcast(server):
+    clients = [connect(server) for _ in range(50)]
+    wait_for(lambda: len(server) == len(clients))
+    for ind, client in enumerate(clients):
+        client.check_sended_with_serializer(['client', ind, np.full((100, 100), ind)])
+    for ind, client in enumerate(clients):
+        tag, obj_back = client.check_received_with_deserializer()
+        assert tag == 'echo'
+        assert obj_back[1] == ind
+        assert np.array_equal(obj_back[2], np.full((100, 100), ind))
+    assert sorted(obj[1] for obj in server.messages) == list(range(len(clients)))
+
+    server.broadcast(np.arange(100000), exclude=server.connections[0])
+    for client in clients[1:]:
+        assert np.array_equal(client.check_received_with_deserializer(), np.arange(100000))
+
+    clients[0].close()
+    wait_for(lambda: len(server.disconnected) == 1)
+    assert len(server) == len(clients) - 1
+    for client in clients[1:]:
+        client.close()
+    wait_for(lambda: len(server) == 0)
+
+
+def test_batch_and_invalid_stream(server):
+    client = connect(server)
+    client.check_sended_batch_with_serializer(['first', 'second'])
+    assert client.check_received_with_deserializer() == ['echo', 'first']
+    assert client.check_received_with_deserializer() == ['echo', 'second']
+
+    invalid_frame = b'\x00\x00\x00\x08\x00\x00\x00\x04none'
+    client.check_sended(invalid_frame + ser_factory.get_apply_serializer('after',
+                                                                        append_length=True))
+    assert client.check_received_with_deserializer() == ['echo', 'after']
+    client.check_sended_with_serializer('raise')
+    client.check_sended_with_serializer('still connected')
+    assert client.check_received_with_deserializer() == ['echo', 'still connected']
+    assert len(server.disconnected) == 0
+
+    client.check_sended_with_serializer('last')
+    client.check_sended(utils.LENGTH_ESCAPE_BYTES + bytes([utils.FRAME_VERSION + 1, 0]) +
+                        bytes(8))
+    assert client.check_received_with_deserializer() == ['echo', 'last']
+    wait_for(lambda: len(server.disconnected) == 1)
+    client.close()
+
+
+def test_received_and_slow_client():
+    with SocketServer(('localhost', 0), max_pending=10**6) as server:
+        client = connect(server)
+        while len(server) == 0:
+            server.serve_once(0.1)
+        connection = server.connections[0]
+        client.check_sended_with_serializer('polled')
+        while len(connection.received) == 0:
+            server.serve_once(0.1)
+        assert connection.received.popleft() == 'polled'
+
+        connection.send(np.zeros(10**5))
+        assert connection.pending_bytes > 0
+        server.serve_once(0.1)
+        assert connection.pending_bytes == 0
+        assert np.array_equal(client.check_received_with_deserializer(), np.zeros(10**5))
+
+        for ind in range(20):  # the client does not read
+            server.broadcast(np.zeros(10**5))
+            server.serve_once(0)
+        assert connection.closed
+        assert len(server) == 0
+        client.close()
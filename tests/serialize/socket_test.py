@@ -1,8 +1,17 @@
+import asyncio
 import socket
+import threading
+import time
 
+import numpy as np
 import pytest
 
-from pymodaq_utils.serialize.mysocket import Socket
+from pymodaq_utils.mysocket import ConnectionClosedError, ReceiveTimeoutError
+from pymodaq_utils.serialize import utils
+from pymodaq_utils.serialize.mysocket import (AsyncSocket, BatchSender, QueuedSender,
+                                              QueuePolicy, Socket)
+from pymodaq_utils.serialize.recording import RecordingReader, RecordingWriter
+from pymodaq_utils.serialize.serializer import ser_factory
 
 
 class MockPythonSocket:  # pragma: no cover
@@ -52,6 +61,11 @@ class MockPythonSocket:  # pragma: no cover
         self._send = self._send[length:]
         return bytes_string
 
+    def recv_into(self, buffer, nbytes=0, **kwargs):
+        bytes_string = self.recv(nbytes if nbytes else len(buffer))
+        buffer[:len(bytes_string)] = bytes_string
+        return len(bytes_string)
+
     def close(self):
         self._closed = True
 
@@ -116,3 +130,440 @@ class TestSocket:
             test_Socket.send(b'test')
         test_Socket.check_received_length(4100)
         assert not test_Socket.socket._send
+
+    def test_check_received_length_into(self):
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        data = np.random.randint(0, 255, 500000, dtype=np.uint8).tobytes()
+        thread = threading.Thread(target=sender.check_sended, args=(data,))
+        thread.start()
+        data_back = receiver.check_received_length(len(data))
+        thread.join()
+        sender.close()
+        receiver.close()
+        assert isinstance(data_back, bytearray)
+        assert data_back == data
+
+    def test_check_received_with_deserializer(self):
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.check_sended_with_serializer(['a string', 12.5, b'bytes'])
+        assert test_Socket.check_received_with_deserializer() == ['a string', 12.5, b'bytes']
+        assert not test_Socket.socket._send
+
+    def test_check_sended_with_compact_tags(self):
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.compact_tags = True
+        obj = [1, 'a', 2.5, 3, 'b', [4.5, 'c']]
+        test_Socket.check_sended_with_serializer(obj)
+        assert test_Socket.check_received_with_deserializer() == obj
+
+    def test_check_sended_with_codec(self):
+        array = np.zeros((500, 500))
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.codec = 'zlib'
+        test_Socket.check_sended_with_serializer(array)
+        assert len(test_Socket.socket._send) < array.nbytes / 10
+        assert np.array_equal(test_Socket.check_received_with_deserializer(), array)
+
+    def test_check_sended_segments(self):
+        array = np.random.random_sample((200, 300))
+        obj = ['header', array, 12]
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        thread = threading.Thread(target=sender.check_sended_with_serializer, args=(obj,))
+        thread.start()
+        obj_back = receiver.check_received_with_deserializer()
+        thread.join()
+        sender.close()
+        receiver.close()
+
+        assert obj_back[0] == 'header'
+        assert np.array_equal(obj_back[1], array)
+        assert obj_back[2] == 12
+
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.check_sended_segments([b'te', bytearray(b'st'), memoryview(np.arange(3))])
+        assert test_Socket.socket._send == b'test' + np.arange(3).tobytes()
+
+    @pytest.mark.parametrize('compact_tags', (False, True))
+    def test_check_sended_batch(self, compact_tags):
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.compact_tags = compact_tags
+        objs = ['status', 12.5, np.arange(5), [1, 'a']]
+        test_Socket.check_sended_batch_with_serializer(objs)
+        test_Socket.check_sended_with_serializer('single')
+        objs_back = test_Socket.check_received_objects_with_deserializer()
+        assert objs_back[:2] == objs[:2] and objs_back[3] == objs[3]
+        assert np.array_equal(objs_back[2], objs[2])
+        assert test_Socket.check_received_objects_with_deserializer() == ['single']
+
+        test_Socket.check_sended_batch_with_serializer(objs)
+        with pytest.raises(ValueError):
+            test_Socket.check_received_with_deserializer()
+
+
+class TestFileSegments:
+    def test_check_sended_views(self):
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.check_sended(bytearray(b'test'))
+        test_Socket.check_sended(memoryview(np.arange(3, dtype=np.uint8)))
+        assert test_Socket.socket._send == b'test\x00\x01\x02'
+
+    def test_file_span(self, tmp_path):
+        path = tmp_path / 'array.dat'
+        np.arange(100000, dtype=np.float64).tofile(path)
+        array = np.memmap(path, dtype=np.float64, mode='r', offset=8000, shape=(990, 100))
+        for array_view, in_file in ((array, True), (array[10:20], True), (array.T, True),
+                                    (array[:, 1:], False), (np.array(array[5]), False)):
+            writer = utils.BytesWriter(file_segments=True, fortran_order=True)
+            ser_factory.get_apply_writer(np.asarray(array_view), writer)
+            file_segments = [segment for segment in writer.segments
+                             if isinstance(segment, utils.FileSegment)]
+            assert len(file_segments) == int(in_file)
+            assert np.array_equal(ser_factory.get_apply_deserializer(writer.to_bytes()),
+                                  array_view)
+        assert utils.get_file_span(array[10:20]) == (str(path), 8000 + 10 * 100 * 8)
+        assert utils.get_file_span(np.memmap(path, dtype=np.uint8, mode='c')) is None
+
+    def test_sendfile(self, tmp_path):
+        path = tmp_path / 'array.dat'
+        np.arange(300000, dtype=np.int32).tofile(path)
+        array = np.memmap(path, dtype=np.int32, mode='r', shape=(600, 500))
+        with RecordingWriter(tmp_path / 'record.pmq') as recorder:
+            recorder.write('first')
+            recorder.write(np.arange(1000))
+
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        sender.file_segments = True
+
+        def send_all():
+            sender.check_sended_with_serializer(['header', np.asarray(array[100:])])
+            with RecordingReader(tmp_path / 'record.pmq') as reader:
+                sender.check_sended_segments([reader.get_frame_segment(-1),
+                                              reader.get_frame_segment(0)])
+
+        thread = threading.Thread(target=send_all, daemon=True)
+        thread.start()
+        receiver.receive_timeout = 10
+        obj_back = receiver.check_received_with_deserializer()
+        assert np.array_equal(receiver.check_received_with_deserializer(), np.arange(1000))
+        assert receiver.check_received_with_deserializer() == 'first'
+        thread.join()
+        sender.close()
+        receiver.close()
+        assert obj_back[0] == 'header'
+        assert np.array_equal(obj_back[1], array[100:])
+
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.check_sended_segments([b'head', utils.FileSegment(path, 4, 8)])
+        assert test_Socket.socket._send == b'head' + np.arange(1, 3, dtype=np.int32).tobytes()
+        with pytest.raises(EOFError):
+            test_Socket.check_sended_segments([utils.FileSegment(path, 1200000 - 4, 8)])
+
+
+class TestReceiveErrors:
+    def test_peer_closed(self):
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        sender.check_sended(b'\x00\x00\x00\x10partial')
+        sender.close()
+        with pytest.raises(ConnectionClosedError) as error:
+            receiver.check_received_with_deserializer()
+        assert error.value.received == 7
+        assert error.value.expected == 16
+        assert bytes(error.value.partial) == b'partial'
+        receiver.close()
+
+        test_Socket = Socket(MockPythonSocket())
+        with pytest.raises(ConnectionError):
+            test_Socket.check_received_length(4)
+
+    def test_deadline(self):
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        receiver.receive_timeout = 0.05
+        sender.check_sended(b'abc')
+        start = time.perf_counter()
+        with pytest.raises(ReceiveTimeoutError) as error:
+            receiver.check_received_length(10)
+        assert time.perf_counter() - start < 1
+        assert error.value.received == 3
+        assert isinstance(error.value, TimeoutError)
+        assert receiver.socket.gettimeout() is None
+
+        sender.check_sended(b'defg')
+        assert receiver.check_received_length(4) == b'defg'
+        sender.close()
+        receiver.close()
+
+    def test_socket_timeout(self):
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        receiver.socket.settimeout(0.05)
+        sender.check_sended(b'abc')
+        with pytest.raises(ReceiveTimeoutError) as error:
+            receiver.check_received_length(10)
+        assert error.value.received == 3
+        assert error.value.expected == 10
+        assert bytes(error.value.partial) == b'abc'
+        assert receiver.socket.gettimeout() == 0.05
+        sender.close()
+        receiver.close()
+
+
+class TestBatchSender:
+    def test_flush_on_size(self):
+        test_Socket = Socket(MockPythonSocket())
+        with BatchSender(test_Socket, max_bytes=100, max_delay=None) as sender:
+            for ind in range(10):
+                sender.send(float(ind))
+                assert len(sender) < 10
+            assert len(sender) > 0
+        objs_back = []
+        while test_Socket.socket._send:
+            objs_back.extend(test_Socket.check_received_objects_with_deserializer())
+        assert objs_back == [float(ind) for ind in range(10)]
+
+    def test_flush_on_count(self):
+        test_Socket = Socket(MockPythonSocket())
+        sender = BatchSender(test_Socket, max_count=3, max_delay=None)
+        for ind in range(7):
+            sender.send(ind)
+        assert len(sender) == 1
+        assert test_Socket.check_received_objects_with_deserializer() == [0, 1, 2]
+        assert test_Socket.check_received_objects_with_deserializer() == [3, 4, 5]
+        sender.flush()
+        assert test_Socket.check_received_objects_with_deserializer() == [6]
+
+    def test_flush_on_delay(self):
+        sender_socket, receiver_socket = (Socket(sock) for sock in socket.socketpair())
+        receiver_socket.socket.settimeout(5)
+        sender = BatchSender(sender_socket, max_delay=0.01)
+        sender.send('a')
+        sender.send('b')
+        assert receiver_socket.check_received_objects_with_deserializer() == ['a', 'b']
+        assert len(sender) == 0
+        sender_socket.close()
+        receiver_socket.close()
+
+    @pytest.mark.parametrize('compact_tags', (False, True))
+    def test_failed_send(self, compact_tags):
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.compact_tags = compact_tags
+        sender = BatchSender(test_Socket, max_delay=None)
+        sender.send('a')
+        with pytest.raises(NotImplementedError):
+            sender.send([2, object()])
+        assert len(sender) == 1
+        sender.send([3, 'b'])
+        sender.flush()
+        assert test_Socket.check_received_objects_with_deserializer() == ['a', [3, 'b']]
+
+
+class TestQueuedSender:
+    @staticmethod
+    def start(policy, maxsize=2):
+        """ Get a sender whose thread is stuck sending a first large frame"""
+        sender_socket, receiver_socket = (Socket(sock) for sock in socket.socketpair())
+        receiver_socket.receive_timeout = 10
+        sender = QueuedSender(sender_socket, maxsize=maxsize, policy=policy)
+        sender.send(np.zeros(2**20))
+        start = time.perf_counter()
+        while len(sender) != 0:
+            assert time.perf_counter() - start < 10
+            time.sleep(0.01)
+        return sender, receiver_socket
+
+    @staticmethod
+    def receive_all(receiver_socket, nobjs):
+        assert np.array_equal(receiver_socket.check_received_with_deserializer(), np.zeros(2**20))
+        return [receiver_socket.check_received_with_deserializer() for _ in range(nobjs)]
+
+    def test_send_copies(self):
+        sender_socket, receiver_socket = (Socket(sock) for sock in socket.socketpair())
+        array = np.arange(10000)
+        with QueuedSender(sender_socket) as sender:
+            sender.send(array)
+            array[:] = 0
+            sender.send(['text', array])
+        assert np.array_equal(receiver_socket.check_received_with_deserializer(),
+                              np.arange(10000))
+        assert np.array_equal(receiver_socket.check_received_with_deserializer()[1], array)
+        assert sender.metrics.sent == 2
+        assert sender.metrics.depth == 0
+
+    @pytest.mark.parametrize('policy, sent, expected', (
+            ('drop_oldest', [1, 2, 3], [2, 3]),
+            (QueuePolicy.DROP_NEWEST, [1, 2, 3], [1, 2]),
+            ('coalesce_latest', [('a', 1), ('b', 1), ('a', 2), ('c', 1)],
+             [['b', 1], ['c', 1]])))
+    def test_drop_policies(self, policy, sent, expected):
+        sender, receiver_socket = self.start(policy)
+        for obj in sent:
+            sender.send(list(obj) if isinstance(obj, tuple) else obj,
+                        key=obj[0] if isinstance(obj, tuple) else None)
+        metrics = sender.metrics
+        assert metrics.depth == metrics.max_depth == 2
+        assert metrics.dropped + metrics.coalesced == len(sent) - 2
+        assert self.receive_all(receiver_socket, 2) == expected
+        sender.close()
+        assert sender.metrics.sent == 3
+
+    def test_coalesce_in_place(self):
+        sender, receiver_socket = self.start('coalesce_latest', maxsize=2)
+        for obj in (['a', 1], ['b', 1], ['a', 2]):
+            sender.send(obj, key=obj[0])
+        assert sender.metrics.coalesced == 1
+        assert self.receive_all(receiver_socket, 2) == [['a', 2], ['b', 1]]
+        sender.close()
+
+    def test_coalesce_only_when_full(self):
+        sender, receiver_socket = self.start('coalesce_latest', maxsize=64)
+        for ind in range(5):
+            sender.send(ind)
+        metrics = sender.metrics
+        assert metrics.depth == 5
+        assert metrics.coalesced == 0
+        assert self.receive_all(receiver_socket, 5) == list(range(5))
+        sender.close()
+
+    def test_block(self):
+        sender, receiver_socket = self.start('block', maxsize=1)
+        sender.send('queued')
+        thread = threading.Thread(target=sender.send, args=('blocked',))
+        thread.start()
+        time.sleep(0.05)
+        assert thread.is_alive()
+        assert self.receive_all(receiver_socket, 2) == ['queued', 'blocked']
+        thread.join()
+        sender.close()
+        assert sender.metrics.blocked_time > 0.04
+        assert sender.metrics.dropped == 0
+
+    def test_errors(self):
+        sender_socket, receiver_socket = (Socket(sock) for sock in socket.socketpair())
+        sender_socket.header_templates = True
+        with pytest.raises(ValueError):
+            QueuedSender(sender_socket, policy='drop_oldest')
+        with pytest.raises(ValueError):
+            QueuedSender(sender_socket, policy='unknown')
+        sender = QueuedSender(sender_socket, policy='block')
+        sender.send(np.arange(10))
+        sender.send(np.arange(10))
+        assert sender.flush(timeout=10)
+        assert np.array_equal(receiver_socket.check_received_with_deserializer(), np.arange(10))
+        receiver_socket.close()
+        with pytest.raises(ConnectionError):
+            for ind in range(100):
+                sender.send(np.zeros(10000))
+                time.sleep(0.001)
+        with pytest.raises(ConnectionError):
+            sender.flush()
+        sender.close(flush=False)
+        sender_socket.close()
+
+
+class TestAsyncSocket:
+    def test_send_receive(self):
+        array = np.random.random_sample((300, 400))
+        objects = ['header', array, [1, 2.5, 'a'], 12]
+
+        async def exchange():
+            sock_a, sock_b = socket.socketpair()
+            sender = await AsyncSocket.open_connection(sock=sock_a)
+            receiver = await AsyncSocket.open_connection(sock=sock_b)
+
+            async def send_all():
+                for obj in objects:
+                    await sender.check_sended_with_serializer(obj)
+
+            send_task = asyncio.create_task(send_all())
+            objects_back = [await receiver.check_received_with_deserializer() for _ in objects]
+            await send_task
+            await sender.close()
+            with pytest.raises(asyncio.IncompleteReadError):
+                await receiver.check_received_with_deserializer()
+            await receiver.close()
+            return objects_back
+
+        objects_back = asyncio.run(exchange())
+        assert objects_back[0] == 'header'
+        assert np.array_equal(objects_back[1], array)
+        assert objects_back[2:] == objects[2:]
+
+
+class TestReceiveIntoOutput:
+    def send_receive(self, objs, out):
+        sender, receiver = (Socket(sock) for sock in socket.socketpair())
+        sender.fortran_order = True
+        thread = threading.Thread(target=lambda: [sender.check_sended_with_serializer(obj)
+                                                  for obj in objs])
+        thread.start()
+        objs_back = [receiver.check_received_with_deserializer(out=out) for _ in objs]
+        thread.join()
+        sender.close()
+        receiver.close()
+        return objs_back
+
+    def test_output_array(self):
+        array = np.random.random_sample((50, 60))
+        out = np.zeros_like(array)
+        array_back, = self.send_receive([array], out)
+        assert array_back is out
+        assert np.array_equal(out, array)
+
+        out = np.zeros((60, 50)).T
+        array_back, = self.send_receive([np.asfortranarray(array)], out)
+        assert array_back is out
+        assert np.array_equal(out, array)
+
+    def test_array_pool(self):
+        pool = utils.ArrayPool()
+        arrays = [np.full((20, 30), ind, dtype=np.int32) for ind in range(3)]
+        arrays_back = self.send_receive(arrays + [np.arange(5)], pool)
+        for array, array_back in zip(arrays, arrays_back):
+            assert np.array_equal(array, array_back)
+            assert array_back.flags.writeable
+        pool.release(arrays_back[0])
+        assert len(pool) == 1
+        array_back, = self.send_receive(arrays[2:], pool)
+        assert array_back is arrays_back[0]
+        assert len(pool) == 0
+
+    def test_nested_and_fallback(self):
+        out = [np.zeros(10), np.zeros((2, 3), dtype=np.int64)]
+        obj = ['header', np.arange(10.), np.arange(6).reshape((2, 3))]
+        obj_back, string = self.send_receive([obj, 'string'], list(out))
+        assert obj_back[0] == 'header'
+        assert obj_back[1] is out[0] and obj_back[2] is out[1]
+        assert np.array_equal(out[1], obj[2])
+        assert string == 'string'
+
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.codec = 'zlib'
+        test_Socket.codec_threshold = 0
+        out = np.ones((100,))
+        test_Socket.check_sended_with_serializer(np.zeros((100,)))
+        assert test_Socket.check_received_with_deserializer(out=out) is out
+        assert not out.any()
+
+    def test_escaped_length(self):
+        array = np.arange(6.).reshape((2, 3))
+        writer = utils.BytesWriter()
+        writer.write_string('ndarray')
+        writer.write_string('<f8')
+        for bytes_str in (utils.LENGTH_ESCAPE_BYTES + array.nbytes.to_bytes(8, 'big'),
+                          utils.int_to_bytes(2),
+                          utils.LENGTH_ESCAPE_BYTES + (2).to_bytes(8, 'big'),
+                          utils.int_to_bytes(3), array.tobytes()):
+            writer.write(bytes_str)
+        message = writer.to_bytes()
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.check_sended(utils.frame_header_to_bytes(len(message), 0) + message)
+        out = np.zeros_like(array)
+        assert test_Socket.check_received_with_deserializer(out=out) is out
+        assert np.array_equal(out, array)
+
+    def test_incompatible_output(self):
+        test_Socket = Socket(MockPythonSocket())
+        test_Socket.check_sended_with_serializer(np.arange(10))
+        test_Socket.check_sended_with_serializer('next')
+        with pytest.raises(ValueError):
+            test_Socket.check_received_with_deserializer(out=lambda dtype, shape, order:
+                                                         np.zeros(3))
+        assert test_Socket.check_received_with_deserializer() == 'next'
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from pymodaq_utils.serialize.serializer import SerializableFactory
+from pymodaq_utils.serialize.stream import FramingError, StreamDeserializer
+from pymodaq_utils.serialize import utils
+
+ser_factory = SerializableFactory()
+
+OBJECTS = ['hello', 12.5, [1, 'a', b'b'], np.arange(10000).reshape((100, 100)), b'']
+
+
+def assert_objects_equal(objects, objects_back):
+    assert len(objects) == len(objects_back)
+    for obj, obj_back in zip(objects, objects_back):
+        if isinstance(obj, np.ndarray):
+            assert np.array_equal(obj, obj_back)
+        else:
+            assert obj == obj_back
+
+
+def get_stream() -> bytes:
+    return b''.join([ser_factory.get_apply_serializer(obj, append_length=True) for obj in OBJECTS])
+
+
+@pytest.mark.parametrize('chunk_size', (1, 3, 7, 1000, 100000))
+def test_feed(chunk_size):
+    stream = get_stream()
+    stream_deserializer = StreamDeserializer()
+    objects_back = []
+    for ind in range(0, len(stream), chunk_size):
+        objects_back.extend(stream_deserializer.feed(stream[ind:ind + chunk_size]))
+    assert not stream_deserializer.pending
+    assert_objects_equal(OBJECTS, objects_back)
+
+
+def test_pending():
+    bytes_str = ser_factory.get_apply_serializer('hello', append_length=True)
+    stream_deserializer = StreamDeserializer()
+    assert not stream_deserializer.pending
+    assert stream_deserializer.feed(bytes_str[:2]) == []
+    assert stream_deserializer.pending
+    assert stream_deserializer.feed(bytes_str[2:-1]) == []
+    assert stream_deserializer.pending
+    assert stream_deserializer.feed(bytes_str[-1:] + bytes_str) == ['hello', 'hello']
+    assert not stream_deserializer.pending
+
+
+def test_extended_header():
+    bytes_str = ser_factory.get_apply_serializer('hello')
+    stream = utils.frame_header_to_bytes(len(bytes_str), flags=0) + bytes_str
+    extended = (utils.LENGTH_ESCAPE_BYTES + utils.FRAME_VERSION.to_bytes(1, 'big') + b'\x00' +
+                len(bytes_str).to_bytes(8, 'big') + bytes_str)
+    stream_deserializer = StreamDeserializer()
+    objects_back = []
+    for ind in range(len(extended)):
+        objects_back.extend(stream_deserializer.feed(extended[ind:ind + 1]))
+    objects_back.extend(stream_deserializer.feed(stream))
+    assert objects_back == ['hello', 'hello']
+
+
+def test_compact_tags():
+    stream = b''.join([ser_factory.get_apply_writer(obj, utils.BytesWriter(compact_tags=True),
+                                                    append_length=True).to_bytes()
+                       for obj in OBJECTS])
+    stream_deserializer = StreamDeserializer()
+    objects_back = []
+    for ind in range(0, len(stream), 5):
+        objects_back.extend(stream_deserializer.feed(stream[ind:ind + 5]))
+    assert_objects_equal(OBJECTS, objects_back)
+
+
+def test_feed_batch():
+    stream = (ser_factory.get_apply_batch_writer(OBJECTS).to_bytes() +
+              ser_factory.get_apply_serializer('last', append_length=True))
+    stream_deserializer = StreamDeserializer()
+    objects_back = []
+    for ind in range(0, len(stream), 10):
+        objects_back.extend(stream_deserializer.feed(stream[ind:ind + 10]))
+    assert_objects_equal(OBJECTS + ['last'], objects_back)
+
+
+def test_invalid_frame():
+    valid = ser_factory.get_apply_serializer('valid', append_length=True)
+    invalid = utils.frame_header_to_bytes(7) + b'\x00\x00\x00\x03zzz'
+    stream_deserializer = StreamDeserializer()
+    with pytest.raises(ValueError):
+        stream_deserializer.feed(valid + invalid + valid[:5])
+    assert stream_deserializer.feed(valid[5:]) == ['valid', 'valid']
+    with pytest.raises(ValueError):
+        stream_deserializer.feed(invalid)
+    assert stream_deserializer.feed(valid) == ['valid']
+    assert not stream_deserializer.pending
+
+    invalid_header = utils.LENGTH_ESCAPE_BYTES + bytes([utils.FRAME_VERSION + 1, 0]) + bytes(8)
+    with pytest.raises(FramingError):
+        stream_deserializer.feed(valid + invalid_header)
+    assert stream_deserializer.feed(b'') == ['valid']
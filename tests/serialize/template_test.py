@@ -0,0 +1,143 @@
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from pymodaq_utils.serialize import utils
+from pymodaq_utils.serialize.mysocket import Socket
+from pymodaq_utils.serialize.recording import RecordingReader, RecordingWriter
+from pymodaq_utils.serialize.serializer import ser_factory
+from pymodaq_utils.serialize.stream import StreamDeserializer
+from pymodaq_utils.serialize.template import TemplateDecoder, TemplateEncoder
+
+
+def encode_decode(objs, out=None):
+    encoder = TemplateEncoder()
+    decoder = TemplateDecoder()
+    frames = []
+    objs_back = []
+    for obj in objs:
+        writer = ser_factory.get_apply_writer(obj, utils.BytesWriter(fortran_order=True))
+        frame = encoder.encode(writer).to_bytes()
+        length, flags, body = utils.get_frame_header_from_bytes(frame)
+        assert length == len(body)
+        frames.append((frame, flags))
+        if out is None:
+            objs_back.append(decoder.decode(body, flags))
+        else:
+            with utils.output_arrays(out):
+                objs_back.append(decoder.decode(body, flags))
+    return frames, objs_back
+
+
+def test_same_structure():
+    arrays = [np.random.random_sample((100, 200)) for _ in range(3)]
+    frames, arrays_back = encode_decode(arrays)
+    assert [flags for _, flags in frames] == [utils.FRAME_FLAG_TEMPLATE] + \
+        [utils.FRAME_FLAG_TEMPLATE_REFERENCE] * 2
+    header_length = len(frames[0][0]) - arrays[0].nbytes
+    assert len(frames[1][0]) - arrays[1].nbytes < header_length / 2
+    for array, array_back in zip(arrays, arrays_back):
+        assert np.array_equal(array, array_back)
+
+
+def test_changed_fields():
+    objs = [['frame', 1, np.arange(12.).reshape((3, 4)), b'raw'],
+            ['frame', 2, np.arange(12.).reshape((4, 3)), b'RAW'],
+            ['other', 3, np.ones((4, 3)), b'raw'],
+            ['a longer string', 4, np.arange(12.).reshape((4, 3)), b'raw'],
+            ['frame', 5, np.arange(24.).reshape((4, 6)), b'raw']]
+    frames, objs_back = encode_decode(objs)
+    assert [flags for _, flags in frames] == [
+        utils.FRAME_FLAG_TEMPLATE, utils.FRAME_FLAG_TEMPLATE_REFERENCE,
+        utils.FRAME_FLAG_TEMPLATE_REFERENCE, utils.FRAME_FLAG_TEMPLATE,
+        utils.FRAME_FLAG_TEMPLATE]
+    for obj, obj_back in zip(objs, objs_back):
+        assert obj_back[0] == obj[0] and obj_back[1] == obj[1] and obj_back[3] == obj[3]
+        assert np.array_equal(obj_back[2], obj[2])
+
+
+def test_escaped_integers():
+    def escape(int_obj):
+        return utils.LENGTH_ESCAPE_BYTES + int_obj.to_bytes(8, 'big')
+
+    objs = [['frame', 1, np.arange(10.)], ['frame', 2, np.arange(10.)]]
+    frames, _ = encode_decode(objs)
+    decoder = TemplateDecoder()
+    decoder.decode(utils.get_frame_header_from_bytes(frames[0][0])[2], frames[0][1])
+    _, flags, body = utils.get_frame_header_from_bytes(frames[1][0])
+    npatches, remaining_bytes = utils.get_int_from_bytes(body)
+    assert npatches == 1
+    offset, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+    nbytes, remaining_bytes = utils.get_int_from_bytes(remaining_bytes)
+    escaped_body = escape(npatches) + escape(offset) + escape(nbytes) + bytes(remaining_bytes)
+    obj_back = decoder.decode(escaped_body, flags)
+    assert obj_back[:2] == ['frame', 2]
+    assert np.array_equal(obj_back[2], np.arange(10.))
+
+
+def test_fast_path():
+    arrays = [np.full((10, 20), ind, dtype=np.uint16) for ind in range(3)]
+    arrays.append(np.asfortranarray(arrays[0]))
+    _, arrays_back = encode_decode(arrays)
+    for array, array_back in zip(arrays, arrays_back):
+        assert np.array_equal(array, array_back)
+    assert all(array_back.flags.writeable for array_back in arrays_back[1:3])
+    assert arrays_back[3].flags.f_contiguous
+
+    pool = utils.ArrayPool()
+    _, arrays_back = encode_decode(arrays[:3], out=pool)
+    pool.release(arrays_back[1])
+    _, arrays_back_again = encode_decode(arrays[:3], out=pool)
+    assert arrays_back_again[0] is arrays_back[1]
+    for array, array_back in zip(arrays, arrays_back_again):
+        assert np.array_equal(array, array_back)
+
+
+def test_no_template():
+    _, flags, body = utils.get_frame_header_from_bytes(
+        TemplateEncoder().encode(ser_factory.get_apply_writer('a')).to_bytes())
+    with pytest.raises(ValueError):
+        TemplateDecoder().decode(body, utils.FRAME_FLAG_TEMPLATE_REFERENCE)
+    with pytest.raises(ValueError):
+        ser_factory.get_apply_deserializer(body, flags=flags)
+
+
+def test_socket_and_stream(tmp_path):
+    objs = [['status', np.full((50, 60), ind)] for ind in range(4)] + ['end']
+    sender, receiver = (Socket(sock) for sock in socket.socketpair())
+    sender.header_templates = True
+    stream = []
+
+    def send_all():
+        with RecordingWriter(tmp_path / 'record.pmq') as recorder:
+            sender.recorder = recorder
+            for obj in objs:
+                sender.check_sended_with_serializer(obj)
+
+    thread = threading.Thread(target=send_all)
+    thread.start()
+    objs_back = [receiver.check_received_with_deserializer() for _ in objs[:-1]]
+    objs_back.extend(receiver.check_received_objects_with_deserializer())
+    thread.join()
+    sender.close()
+    receiver.close()
+
+    with RecordingReader(tmp_path / 'record.pmq') as reader:
+        objs_recorded = list(reader)
+    for obj_list in (objs_back, objs_recorded):
+        assert obj_list[-1] == 'end'
+        for obj, obj_back in zip(objs[:-1], obj_list):
+            assert obj_back[0] == obj[0]
+            assert np.array_equal(obj_back[1], obj[1])
+
+    encoder = TemplateEncoder()
+    stream = b''.join(encoder.encode(ser_factory.get_apply_writer(obj)).to_bytes()
+                      for obj in objs)
+    stream_deserializer = StreamDeserializer()
+    objs_back = []
+    for ind in range(0, len(stream), 1000):
+        objs_back.extend(stream_deserializer.feed(stream[ind:ind + 1000]))
+    assert objs_back[-1] == 'end'
+    assert all(np.array_equal(obj_back[1], obj[1]) for obj, obj_back in zip(objs[:-1], objs_back))